@@ -0,0 +1,20 @@
+from celery import shared_task
+from celery.utils.log import get_task_logger
+
+from django.contrib.auth import get_user_model
+
+from dashboard.tasks import delete_websites
+from websites.models import Website
+
+logger = get_task_logger(__name__)
+
+User = get_user_model()
+
+
+@shared_task
+def delete_account(user_id):
+    """ delete in background the account `user_id`, deactivated by `DeleteAccountView`, and all its websites """
+    ids = list(Website.all_objects.filter(user_id=user_id).values_list("id", flat=True))
+    delete_websites(ids)
+    User.objects.filter(id=user_id).delete()
+    logger.info("account deleted {'user_id': %s, 'websites': %s}", user_id, len(ids))
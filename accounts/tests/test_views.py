@@ -47,9 +47,11 @@ class ViewTestCase(TestCase):
 
         self.assertStatusCode('success', response.status_code)
 
+    @patch("accounts.views.delete_account.delay")
+    @patch("accounts.views.Website")
     @patch("accounts.views.User.objects.get")
     @patch("accounts.views.logout")
-    def test_delete_account_exist(self, mock_logout, mock_get):
+    def test_delete_account_exist(self, mock_logout, mock_get, mock_website, mock_delete):
         """
         Try to delete an account that does not exist
         """
@@ -59,7 +61,13 @@ class ViewTestCase(TestCase):
         request.META = {"CSRF_COOKIE": "XXX"}
         response = view.post(request)
 
-        mock_get.return_value.delete.assert_called()
+        account = mock_get.return_value
+        self.assertFalse(account.is_active)
+        account.save.assert_called_once_with(update_fields=["is_active"])
+        mock_website.objects.filter.assert_called_once_with(user=account)
+        mock_website.hide.assert_called_once_with(mock_website.objects.filter.return_value)
+        mock_delete.assert_called_once_with(account.id)
+        account.delete.assert_not_called()
         mock_logout.assert_called()
         self.assertStatusCode('redirection', response.status_code)
         self.assertEqual(response.url, "/")
@@ -4,6 +4,9 @@ from django.http import HttpResponseRedirect
 from django.shortcuts import render
 from django.views.generic import TemplateView
 
+from websites.models import Website
+from .tasks import delete_account
+
 User = get_user_model()
 
 
@@ -13,7 +16,11 @@ class DeleteAccountView(LoginRequiredMixin, TemplateView):
     def post(self, request):
         account = User.objects.get(username=request.user)
         if account is not None:
-            account.delete()
+            # the account is deactivated and its websites hidden right away, they are deleted in background
+            account.is_active = False
+            account.save(update_fields=["is_active"])
+            Website.hide(Website.objects.filter(user=account))
+            delete_account.delay(account.id)
             logout(request)
             return HttpResponseRedirect("/")
         return render(request, self.template_name)
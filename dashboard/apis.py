@@ -1,12 +1,14 @@
 import logging
 
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
 
-from websites.utils import is_ajax, explode_airbnb_url
+from websites.utils import is_ajax, explode_airbnb_url, resolve_airbnb_urls
 from websites.models import Website
+from scrapper.apis import airbnb_circuit_breaker
 
-from .tasks import scrap_and_create_website
+from .tasks import delete_websites, start_website_creation, start_websites_batch
 
 
 _logger = logging.getLogger('websites')
@@ -20,6 +22,10 @@ def _internal_error(msg):
     return JsonResponse({"error": msg}, status=500)
 
 
+def _unavailable_error(msg):
+    return JsonResponse({"error": msg}, status=503)
+
+
 @login_required
 def api_website_create(request):
     if not is_ajax(request) or "rental_url" not in request.POST:
@@ -38,11 +44,53 @@ def api_website_create(request):
     if Website.has_reached_resource_limits(request.user):
         return _user_error("Limite de nombre de sites atteinte. Supprimez-en un pour pouvoir en créer un nouveau.")
 
+    # don't start a task which would fail anyway while Airbnb is not reachable
+    if airbnb_circuit_breaker.state == airbnb_circuit_breaker.OPEN:
+        return _unavailable_error("Airbnb est momentanément inaccessible. Veuillez réessayer dans quelques minutes.")
+
     # scrap and create the website in background.
     # the task id is provided to allow the client to poll task result
-    task = scrap_and_create_website.delay(request.user.id, rental_base_url, airbnb_id)
+    task_id = start_website_creation(request.user.id, rental_base_url, airbnb_id)
+
+    return JsonResponse({"task_id": task_id}, status=202)
+
+
+@login_required
+def api_websites_batch_create(request):
+    if not is_ajax(request) or "rental_urls" not in request.POST:
+        return _internal_error("mauvaise requête")
+
+    urls = [url.strip() for url in request.POST.getlist("rental_urls") if url.strip()]
+    if not urls:
+        return _internal_error("URLs des annonces non fournies")
+    if len(urls) > settings.WEBSITES_BATCH_MAX_SIZE:
+        return _user_error(f"Un maximum de {settings.WEBSITES_BATCH_MAX_SIZE} annonces peut être fourni à la fois")
+
+    _logger.info("websites batch create {'count': %s}", len(urls))
+
+    listings, invalid_urls = resolve_airbnb_urls(urls)
+    if not listings:
+        return _user_error("Aucune des URLs fournies n'est une URL Airbnb valide")
+
+    # check if the current user does not exceed limitations
+    if Website.has_reached_resource_limits(request.user, len(listings)):
+        return _user_error("Limite de nombre de sites atteinte. Supprimez-en pour pouvoir en créer de nouveaux.")
+
+    # don't start tasks which would fail anyway while Airbnb is not reachable
+    if airbnb_circuit_breaker.state == airbnb_circuit_breaker.OPEN:
+        return _unavailable_error("Airbnb est momentanément inaccessible. Veuillez réessayer dans quelques minutes.")
+
+    # the batch id is provided to allow the client to poll the progress of the whole batch
+    batch_id, task_ids = start_websites_batch(request.user.id, listings)
 
-    return JsonResponse({"task_id": task.id}, status=202)
+    return JsonResponse({
+        "batch_id": batch_id,
+        "tasks": [
+            {"airbnb_id": airbnb_id, "task_id": task_id}
+            for (_, airbnb_id), task_id in zip(listings, task_ids)
+        ],
+        "invalid_urls": invalid_urls,
+    }, status=202)
 
 
 @login_required
@@ -52,10 +100,11 @@ def api_website_delete(request, key):
     if not is_ajax(request):
         return _internal_error("mauvaise requête")
 
-    website = Website.get_website(key)
+    # the website is hidden right away, and deleted in background
+    ids = Website.hide(Website.objects.filter(key=key))
 
-    if website:
-        website.delete()
+    if ids:
+        delete_websites.delay(ids)
         return JsonResponse({"key": key})
     else:
         return _user_error("Ce site n'existe pas")
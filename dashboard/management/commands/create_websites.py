@@ -0,0 +1,117 @@
+import json
+import time
+from pathlib import Path
+
+from celery import current_app
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from dashboard.tasks import get_task_outcome, start_websites_batch
+from websites.models import Website
+from websites.utils import resolve_airbnb_urls
+
+POLL_INTERVAL = 2
+TIMEOUT = 3600
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the websites of many Airbnb listings for a user. "
+        "With a state file, an interrupted or partially failed run can be resumed: "
+        "websites already created are skipped and failed or timed out ones are retried."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("username", help="owner of the websites")
+        parser.add_argument("urls", nargs="*", help="urls of the Airbnb listings")
+        parser.add_argument("--file", help="file containing the urls of the Airbnb listings, one per line")
+        parser.add_argument("--state", help="JSON file where the progress is saved, to resume the run")
+        parser.add_argument("--concurrency", type=int, help="maximum number of websites created at the same time")
+        parser.add_argument("--ignore-limits", action="store_true", help="don't check the websites count limit")
+        parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help=f"default: {POLL_INTERVAL}s")
+        parser.add_argument(
+            "--timeout", type=float, default=TIMEOUT,
+            help=f"maximum duration of the wait for the websites, default: {TIMEOUT}s",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            user = get_user_model().objects.get(username=options["username"])
+        except get_user_model().DoesNotExist:
+            raise CommandError(f"unknown user '{options['username']}'")
+
+        urls = list(options["urls"])
+        if options["file"]:
+            urls += [line.strip() for line in Path(options["file"]).read_text().splitlines() if line.strip()]
+
+        state_path = Path(options["state"]) if options["state"] else None
+        state = json.loads(state_path.read_text()) if state_path and state_path.exists() else {}
+
+        listings, invalid_urls = resolve_airbnb_urls(urls) if urls else ([], [])
+        for url in invalid_urls:
+            self.stderr.write(f"invalid Airbnb url: {url}")
+        for base_url, airbnb_id in listings:
+            state.setdefault(airbnb_id, {"url": base_url, "task_id": None, "status": None})
+
+        # websites already created are skipped, failed or never started ones are (re)submitted
+        to_submit = [
+            airbnb_id for airbnb_id, listing in state.items()
+            if listing["status"] == "error" or not listing["task_id"]
+        ]
+        if to_submit:
+            if not options["ignore_limits"] and Website.has_reached_resource_limits(user, len(to_submit)):
+                raise CommandError("the websites count limit would be exceeded (see --ignore-limits)")
+
+            _, task_ids = start_websites_batch(
+                user.id, [(state[airbnb_id]["url"], airbnb_id) for airbnb_id in to_submit], options["concurrency"]
+            )
+            for airbnb_id, task_id in zip(to_submit, task_ids):
+                state[airbnb_id] |= {"task_id": task_id, "status": "pending"}
+            self._save_state(state_path, state)
+
+        self._wait(state, state_path, options["poll_interval"], options["timeout"])
+
+        statuses = [listing["status"] for listing in state.values()]
+        self.stdout.write(f"{statuses.count('success')} website(s) created, {statuses.count('error')} failed")
+        failures = {airbnb_id: listing for airbnb_id, listing in state.items() if listing["status"] == "error"}
+        for airbnb_id, listing in failures.items():
+            self.stderr.write(f"{airbnb_id}: {listing.get('msg')}")
+        if failures or invalid_urls:
+            raise CommandError(f"{len(failures)} website(s) not created, {len(invalid_urls)} invalid url(s)")
+
+    def _wait(self, state, state_path, poll_interval, timeout):
+        """
+        wait for the pending tasks, the progress is reported (and saved) each time a task completes.
+        Tasks still pending after `timeout` are reported as failed, so that they're retried on resume.
+        """
+        deadline = time.time() + timeout
+        while True:
+            updated = False
+            for airbnb_id, listing in state.items():
+                if listing["status"] != "pending":
+                    continue
+                status, data = get_task_outcome(current_app.AsyncResult(listing["task_id"]))
+                if status != "pending":
+                    listing |= {"status": status, "key": data.get("key"), "msg": data.get("msg")}
+                    updated = True
+
+            statuses = [listing["status"] for listing in state.values()]
+            if updated:
+                self._save_state(state_path, state)
+                self.stdout.write(
+                    f"{len(statuses) - statuses.count('pending')}/{len(statuses)} completed: "
+                    f"{statuses.count('success')} created, {statuses.count('error')} failed"
+                )
+            if "pending" not in statuses:
+                return
+            if time.time() >= deadline:
+                for listing in state.values():
+                    if listing["status"] == "pending":
+                        listing |= {"status": "error", "msg": f"not completed after {timeout}s"}
+                self._save_state(state_path, state)
+                return
+            time.sleep(poll_interval)
+
+    def _save_state(self, state_path, state):
+        if state_path:
+            state_path.write_text(json.dumps(state, indent=2))
@@ -0,0 +1,103 @@
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from dashboard.tasks import start_websites_rerender
+from websites.export import get_websites_to_rerender, rerender_websites
+
+POLL_INTERVAL = 2
+
+
+class Command(BaseCommand):
+    help = (
+        "Render again the exported websites after a change of their templates, by chunks run in parallel "
+        "by a pool of processes or by the Celery workers. Websites already rendered with the current "
+        "templates are skipped, so an interrupted run is resumed by running the command again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size", type=int, default=settings.WEBSITES_RERENDER_CHUNK_SIZE,
+            help="number of websites rendered by each process/task",
+        )
+        parser.add_argument(
+            "--workers", type=int, default=multiprocessing.cpu_count(),
+            help="number of processes rendering the websites (0: rendered by this process)",
+        )
+        parser.add_argument("--celery", action="store_true", help="render the websites with the Celery workers")
+        parser.add_argument("--no-wait", action="store_true", help="with --celery, don't wait for the workers")
+        parser.add_argument("--force", action="store_true", help="render again all the exported websites")
+        parser.add_argument("--poll-interval", type=float, default=POLL_INTERVAL, help=f"default: {POLL_INTERVAL}s")
+
+    def handle(self, *args, **options):
+        start = time.time()
+        if options["celery"]:
+            stats = self._rerender_with_celery(options)
+        else:
+            stats = self._rerender_with_processes(options)
+        if stats is None:
+            return
+
+        duration = time.time() - start
+        self.stdout.write(
+            f"{stats['rendered']} website(s) rendered in {duration:.1f}s "
+            f"({stats['rendered'] / duration if duration else 0:.1f}/s): "
+            f"{stats['changed']} changed, {stats['rendered'] - stats['changed']} unchanged, {stats['failed']} failed"
+        )
+        if stats["failed"]:
+            raise CommandError(f"{stats['failed']} website(s) not rendered, run the command again to retry them")
+
+    def _report(self, stats, total, start):
+        done = stats["rendered"] + stats["failed"]
+        self.stdout.write(f"{done}/{total} website(s), {done / max(time.time() - start, 0.001):.1f}/s")
+
+    def _rerender_with_processes(self, options):
+        ids = get_websites_to_rerender(options["force"])
+        self.stdout.write(f"{len(ids)} website(s) to render")
+        chunk_size = options["chunk_size"]
+        chunks = [ids[i:i + chunk_size] for i in range(0, len(ids), chunk_size)]
+
+        stats = Counter(rendered=0, changed=0, failed=0)
+        start = time.time()
+        if options["workers"] == 0 or len(chunks) <= 1:
+            for chunk in chunks:
+                stats.update(rerender_websites(chunk))
+                self._report(stats, len(ids), start)
+            return stats
+
+        # the processes are forked: they must not share the database connections of this process
+        connections.close_all()
+        with ProcessPoolExecutor(options["workers"], mp_context=multiprocessing.get_context("fork")) as executor:
+            for future in as_completed([executor.submit(rerender_websites, chunk) for chunk in chunks]):
+                stats.update(future.result())
+                self._report(stats, len(ids), start)
+        return stats
+
+    def _rerender_with_celery(self, options):
+        ids, result = start_websites_rerender(options["chunk_size"], options["force"])
+        self.stdout.write(f"{len(ids)} website(s) to render")
+        if result is None or options["no_wait"]:
+            return None
+
+        chunks = result.results
+        completed = 0
+        while completed < len(chunks):
+            time.sleep(options["poll_interval"])
+            ready = sum(1 for chunk in chunks if chunk.ready())
+            if ready != completed:
+                completed = ready
+                self.stdout.write(f"{completed}/{len(chunks)} chunk(s) rendered")
+
+        stats = Counter(rendered=0, changed=0, failed=0)
+        chunk_size = options["chunk_size"]
+        for i, chunk in enumerate(chunks):
+            if chunk.successful():
+                stats.update(chunk.result)
+            else:
+                stats["failed"] += len(ids[i * chunk_size:(i + 1) * chunk_size])
+        return stats
@@ -0,0 +1,98 @@
+"""
+Progress of the website creations, pushed by the workflow tasks to the dashboard over Redis pub/sub.
+
+Every event is a dict with a `stage` ("scraped", "converted", "published", "media", "done" or "error")
+and some stage data. The events of a task are also kept in Redis, in order: a client polling them
+gives the number of events already received and gets the next ones, without missing any.
+"""
+import json
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+_logger = logging.getLogger('utils')
+
+FINAL_STAGES = ("done", "error")
+
+_redis = None
+
+
+def _get_redis():
+    # progress events go through the Redis instance of the broker
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.CELERY_BROKER_URL)
+    return _redis
+
+
+def _channel(task_id):
+    return f"progress:{task_id}"
+
+
+def _events_key(task_id):
+    return f"progress:{task_id}:events"
+
+
+def is_final(event):
+    return event["stage"] in FINAL_STAGES
+
+
+def publish_progress(task_id, stage, **data):
+    """
+    publish the `stage` of the website creation `task_id`.
+    Progress is best effort: a Redis error never fails the workflow.
+    """
+    if not task_id:
+        return
+    event = json.dumps({"stage": stage, **data})
+    try:
+        with _get_redis().pipeline() as pipe:
+            pipe.rpush(_events_key(task_id), event)
+            pipe.expire(_events_key(task_id), settings.WEBSITES_PROGRESS_TTL)
+            pipe.publish(_channel(task_id), event)
+            pipe.execute()
+    except redis.RedisError as e:
+        _logger.warning("unable to publish the progress {'task_id': %s, 'stage': %s}: %s", task_id, stage, e)
+
+
+def advance_media_progress(task_id, count, total):
+    """ add `count` photos to the photos ingested by the parallel media chunks of `task_id`, then publish it """
+    if not task_id or not count:
+        return
+    key = f"progress:{task_id}:photos"
+    try:
+        with _get_redis().pipeline() as pipe:
+            pipe.incrby(key, count)
+            pipe.expire(key, settings.WEBSITES_PROGRESS_TTL)
+            done, _ = pipe.execute()
+    except redis.RedisError as e:
+        _logger.warning("unable to publish the progress {'task_id': %s, 'stage': media}: %s", task_id, e)
+        return
+    publish_progress(task_id, "media", done=min(done, total), total=total)
+
+
+def get_progress_events(task_id, after=0):
+    """ get the progress events of `task_id` published after the first `after` ones """
+    return [json.loads(event) for event in _get_redis().lrange(_events_key(task_id), after, -1)]
+
+
+def wait_progress_events(task_id, after, timeout):
+    """
+    get the progress events of `task_id` published after the first `after` ones,
+    waiting at most `timeout` seconds for one if there is none yet
+    """
+    pubsub = _get_redis().pubsub(ignore_subscribe_messages=True)
+    try:
+        # subscribe before getting the events, so that no event is missed in between
+        pubsub.subscribe(_channel(task_id))
+        deadline = time.monotonic() + timeout
+        while not (events := get_progress_events(task_id, after)):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            pubsub.get_message(timeout=remaining)
+        return events
+    finally:
+        pubsub.close()
@@ -1,43 +1,134 @@
+import math
 import time
+from datetime import timedelta
+from uuid import uuid4
 
-from celery import shared_task
+from celery import chain, chord, current_app, group, shared_task
+from celery.result import GroupResult
 from celery.utils.log import get_task_logger
 
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from django.db.models.functions import Coalesce
 from django.template import defaultfilters
 from django.utils import timezone
 from django.urls import reverse
 
-from websites.models import Website
+from websites.models import MEDIA_STATUS_PENDING, Website
 from websites.config import WEBSITE_URL
-from scrapper.apis import scrap_and_convert
+from websites.utils import explode_airbnb_url, partition_list
+from websites.export import export_website, get_websites_to_rerender, rerender_websites
+from websites.views import warm_website_pages
+from scrapper.apis import convert_airbnb_data, scrap_airbnb_data, scrap_and_convert
+
+from .progress import advance_media_progress, publish_progress
 
 logger = get_task_logger(__name__)
 
 
-@shared_task
-def scrap_and_create_website(user_id, base_url, airbnb_id):
+def _access_error():
+    return {
+        "result": "error",
+        "msg": "Impossible d'accéder à votre annonce Airbnb"
+    }
+
+
+def _is_error(result):
+    return result.get("result") != "success"
+
+
+def _publish_pages(website):
     """
+    cache the pages of the `website` and export them into a static bundle.
+    A failure only delays their caching to their first visit, and their export to the next change.
     """
+    try:
+        warm_website_pages(website.key)
+        if settings.WEBSITES_EXPORT:
+            export_website(website)
+    except Exception as e:
+        logger.exception(str(e))
+
+
+def _fail(progress_id, error):
+    """ report the `error` which stops the website creation `progress_id` """
+    publish_progress(progress_id, "error", data=error)
+    return error
+
+
+@shared_task
+def scrap_listing(airbnb_id, progress_id=None):
+    """ first stage of the website creation: scrap the raw data of the listing (network bound) """
     logger.info("scrap and create website for {'airbnb_id': %s}", airbnb_id)
 
     try:
         start = time.time()
-        data = scrap_and_convert(airbnb_id)
+        airbnb_data = scrap_airbnb_data(airbnb_id)
         end = time.time()
         logger.info("scrapping: %s", end - start)
     except Exception:
-        data = None
+        airbnb_data = None
+
+    if not airbnb_data:
+        return _fail(progress_id, _access_error())
+    publish_progress(progress_id, "scraped")
+    return {"result": "success", "airbnb_data": airbnb_data}
+
+
+@shared_task
+def convert_listing(scrapped, progress_id=None):
+    """ second stage of the website creation: convert the raw data of the listing (CPU bound) """
+    if _is_error(scrapped):
+        return scrapped
 
+    data = convert_airbnb_data(scrapped["airbnb_data"])
     if not data:
-        return {
-            "result": "error",
-            "msg": "Impossible d'accéder à votre annonce Airbnb"
-        }
+        return _fail(progress_id, _access_error())
+    publish_progress(progress_id, "converted")
+    return {"result": "success", "data": data}
+
+
+@shared_task
+def store_website_media(converted, progress_id=None):
+    """
+    third stage of the website creation: download/upload the media files published with the website,
+    the host picture and the main photo (network bound), which are given to the create stage
+    """
+    if _is_error(converted):
+        return converted
+
+    try:
+        start = time.time()
+        media = Website.store_media(converted["data"], defer_media=settings.WEBSITES_DEFER_MEDIA)
+        end = time.time()
+        logger.info("store media: %s, count: %s", end - start, len(media))
+    except Exception as e:
+        # the website is created without these media files
+        logger.exception(str(e))
+        media = {}
+    return {**converted, "media": media}
+
+
+@shared_task
+def create_website(converted, user_id, base_url, progress_id=None):
+    """
+    last stage of the website creation: persist the website (database bound).
+    Its result is the result of the whole creation, polled by the client: the website is published
+    here, and its other media files are ingested in background by the media stage.
+    """
+    if _is_error(converted):
+        return converted
+    data = converted["data"]
+    # media files stored by the previous stage (missing for the messages queued without this stage)
+    stored_media = converted.get("media")
 
     # generate the website and get the redirect page
     try:
         start = time.time()
-        website = Website.create(user_id, base_url, data)
+        website = Website.create(
+            user_id, base_url, data, defer_media=settings.WEBSITES_DEFER_MEDIA, stored_media=stored_media
+        )
         end = time.time()
         logger.info("full create: %s", end - start)
     except Exception as e:
@@ -45,16 +136,377 @@ def scrap_and_create_website(user_id, base_url, airbnb_id):
         website = None
 
     if not website:
-        return {
+        Website.discard_stored_media(stored_media)
+        return _fail(progress_id, {
             "result": "error",
             "msg": "Impossible de créer le site web à partir des données de votre annonce"
-        }
+        })
 
-    return {
+    result = {
         "result": "success",
         "key": website.key,
         "name": website.name,
         "url": WEBSITE_URL % website.key,
         "generated_date": defaultfilters.date(timezone.localtime(website.generated_date), "d/m/Y G:i"),
         "delete_url": reverse('api_website_delete', args=[website.key]),
+        "media_status": website.media_status,
+    }
+    publish_website_pages.delay(website.key)
+    publish_progress(progress_id, "published", data=result)
+    if website.media_status == MEDIA_STATUS_PENDING:
+        media_workflow(website.key, data, progress_id=progress_id).apply_async()
+    else:
+        publish_progress(progress_id, "done", media_status=website.media_status)
+    return result
+
+
+@shared_task
+def ingest_website_media(key, photos, reviews, progress_id=None, total=None):
+    """ media stage of the website creation: ingest a chunk of the deferred media files (I/O bound) """
+    website = Website.get_website(key)
+    if not website:
+        return {"result": "error", "msg": "Site web introuvable"}
+
+    try:
+        start = time.time()
+        count = website.ingest_media(photos, reviews)
+        end = time.time()
+        logger.info("media chunk: %s, count: %s", end - start, count)
+    except Exception as e:
+        # the missing media files are ingested again by the finalize step
+        logger.exception(str(e))
+        return {"result": "error", "msg": "Impossible de récupérer les photos de votre annonce"}
+
+    advance_media_progress(progress_id, len(photos), total)
+    return {"result": "success", "key": website.key, "count": count}
+
+
+@shared_task
+def finalize_website(results, key, data, progress_id=None):
+    """
+    last stage of the website creation, once all the media chunks are ingested: the media files which
+    couldn't be ingested are retried, the photos are ordered and the media status is updated
+    """
+    website = Website.get_website(key)
+    if not website:
+        return {"result": "error", "msg": "Site web introuvable"}
+
+    try:
+        website.ingest_deferred_media(data)
+    except Exception as e:
+        logger.exception(str(e))
+        # the website is published anyway, without its missing media files
+        publish_progress(progress_id, "done", media_status=website.media_status)
+        return {"result": "error", "msg": "Impossible de récupérer les photos de votre annonce"}
+
+    publish_website_pages.delay(website.key)
+    publish_progress(progress_id, "done", media_status=website.media_status)
+    return {"result": "success", "key": website.key, "media_status": website.media_status}
+
+
+@shared_task
+def publish_website_pages(key):
+    """ cache the pages of the website `key` and export them (network bound), out of the database stages """
+    website = Website.get_website(key)
+    if website:
+        _publish_pages(website)
+
+
+@shared_task
+def recover_website_media(failed_task_id, *, key, data, progress_id=None):
+    """
+    error callback of the media stage, sent instead of the finalization when a chunk died (time limit, ...):
+    the website is finalized anyway, the missing media files being retried by the finalization
+    """
+    logger.warning("media chunk failed {'key': %s, 'task_id': %s}", key, failed_task_id)
+    return finalize_website([], key, data, progress_id=progress_id)
+
+
+@shared_task
+def expire_pending_media():
+    """
+    job marking as failed the media files of the websites pending for too long, whose media stage was
+    never finalized (lost worker, ...): their placeholders are not shown forever
+    """
+    date = timezone.now() - timedelta(seconds=settings.WEBSITES_MEDIA_PENDING_TIMEOUT)
+    keys = Website.expire_pending_media(date)
+    if keys:
+        logger.warning("pending media expired {'keys': %s}", keys)
+    return keys
+
+
+def media_workflow(key, data, chunk_size=None, progress_id=None):
+    """
+    parallel ingestion of the deferred media files of the website `key`, by chunks, then finalization.
+    The finalization is never run if a chunk dies: the website is then recovered by `recover_website_media`.
+    """
+    chunk_size = chunk_size or settings.WEBSITES_MEDIA_CHUNK_SIZE
+    photos, reviews = data.get("photos") or [], data.get("reviews") or []
+    progress = {"progress_id": progress_id} if progress_id else {}
+    chunks = [
+        ingest_website_media.si(key, photos[i:i + chunk_size], [], total=len(photos), **progress)
+        for i in range(0, len(photos), chunk_size)
+    ]
+    chunks += [
+        ingest_website_media.si(key, [], reviews[i:i + chunk_size], **progress)
+        for i in range(0, len(reviews), chunk_size)
+    ]
+    if not chunks:
+        return finalize_website.si([], key, data, **progress)
+    return chord(
+        chunks,
+        finalize_website.s(key, data, **progress).on_error(recover_website_media.s(key=key, data=data, **progress)),
+    )
+
+
+def website_creation_workflow(user_id, base_url, airbnb_id, task_id=None):
+    """
+    workflow of the website creation: scrap => convert => store media => create, each stage being routed
+    to its own queue (see CELERY_TASK_ROUTES). `task_id` is the id of the create stage,
+    whose result is the result of the whole workflow: the progress of all the stages is published under it.
+    """
+    task_id = task_id or str(uuid4())
+    return chain(
+        scrap_listing.si(airbnb_id, progress_id=task_id),
+        convert_listing.s(progress_id=task_id),
+        store_website_media.s(progress_id=task_id),
+        create_website.s(user_id, base_url, progress_id=task_id).set(task_id=task_id),
+    )
+
+
+def start_website_creation(user_id, base_url, airbnb_id):
+    """ start the creation of a website in background, returns the id of the task to poll """
+    task_id = str(uuid4())
+    website_creation_workflow(user_id, base_url, airbnb_id, task_id).apply_async()
+    return task_id
+
+
+@shared_task(bind=True)
+def scrap_and_create_website(self, user_id, base_url, airbnb_id):
+    """
+    former single task of the website creation, kept for the messages queued before the workflow:
+    it's replaced by the workflow, whose result is the result of this task
+    """
+    return self.replace(website_creation_workflow(user_id, base_url, airbnb_id, self.request.id))
+
+
+@shared_task
+def refresh_website(key):
+    """
+    re-scrap the listing of the website `key` and refresh the sections of the website which changed
+    """
+    website = Website.get_website(key)
+    if not website:
+        return {"result": "error", "msg": "Site web introuvable"}
+
+    _, airbnb_id = explode_airbnb_url(website.rental_url)
+    logger.info("refresh website {'key': %s, 'airbnb_id': %s}", key, airbnb_id)
+    try:
+        data = scrap_and_convert(airbnb_id, use_cache=False) if airbnb_id else None
+    except Exception:
+        data = None
+
+    if not data:
+        website.record_sync_attempt(False)
+        return {
+            "result": "error",
+            "msg": "Impossible d'accéder à votre annonce Airbnb"
+        }
+
+    try:
+        sections = website.refresh(data)
+    except Exception as e:
+        logger.exception(str(e))
+        sections = None
+
+    website.record_sync_attempt(sections is not None)
+    if sections is None:
+        return {
+            "result": "error",
+            "msg": "Impossible de mettre à jour le site web à partir des données de votre annonce"
+        }
+
+    if sections:
+        _publish_pages(website)
+    return {"result": "success", "key": website.key, "sections": sections}
+
+
+@shared_task
+def delete_websites(ids):
+    """ delete in background the websites `ids`, hidden by `Website.hide`, by batches """
+    batch_size = settings.WEBSITES_DELETE_BATCH_SIZE
+    count = 0
+    for i in range(0, len(ids), batch_size):
+        count += Website.purge(ids[i:i + batch_size])
+    logger.info("websites deleted {'count': %s}", count)
+    return count
+
+
+@shared_task
+def rerender_websites_chunk(ids):
+    """ render again a chunk of exported websites with the current templates """
+    return rerender_websites(ids)
+
+
+def start_websites_rerender(chunk_size=None, force=False):
+    """
+    render again in background the exported websites not rendered with the current templates (all of them
+    with `force`), by chunks run in parallel by the workers.
+    Returns the ids of the websites to render and the result of the group of chunks (None if there is none).
+    """
+    ids = get_websites_to_rerender(force)
+    if not ids:
+        return ids, None
+    chunk_size = chunk_size or settings.WEBSITES_RERENDER_CHUNK_SIZE
+    result = group(
+        rerender_websites_chunk.si(ids[i:i + chunk_size]) for i in range(0, len(ids), chunk_size)
+    ).apply_async()
+    logger.info("websites rerender started {'count': %s}", len(ids))
+    return ids, result
+
+
+@shared_task
+def rerender_exported_websites(force=False):
+    """ job rendering again the exported websites once the templates changed (see `start_websites_rerender`) """
+    ids, _ = start_websites_rerender(force=force)
+    return len(ids)
+
+
+def _reserve_sync_budget(count):
+    """
+    reserve up to `count` listing scraps in the sync budget of the current hour, shared by all the workers
+    (in the "sync" cache). Returns the number of reserved scraps.
+    """
+    cache = caches["sync"]
+    key = f"websites_sync:budget:{int(time.time() // 3600)}"
+    cache.add(key, 0, timeout=3600)
+    used = cache.incr(key, count)
+    reserved = max(0, min(count, settings.WEBSITES_SYNC_MAX_PER_HOUR - used + count))
+    if reserved < count:
+        cache.decr(key, count - reserved)
+    return reserved
+
+
+def _release_sync_budget(count):
+    if count:
+        caches["sync"].decr(f"websites_sync:budget:{int(time.time() // 3600)}", count)
+
+
+def _sync_due(now):
+    """
+    filter of the websites due for a sync: the websites not synced for `WEBSITES_SYNC_STALE_AFTER`,
+    the delay being doubled by every consecutive failure, up to `WEBSITES_SYNC_MAX_BACKOFF`
+    """
+    delay, max_delay = settings.WEBSITES_SYNC_STALE_AFTER, max(settings.WEBSITES_SYNC_MAX_BACKOFF, 1)
+    due, failures = Q(), 0
+    while delay < max_delay:
+        due |= Q(sync_failures=failures, synced_date__lt=now - timedelta(seconds=delay))
+        delay, failures = delay * 2, failures + 1
+    return due | Q(sync_failures__gte=failures, synced_date__lt=now - timedelta(seconds=max_delay))
+
+
+@shared_task
+def sync_stale_websites():
+    """
+    refresh the websites whose data is the oldest, the stalest first. The date of a website is
+    its last sync attempt, so that the websites whose sync fails are retried after the other ones.
+    Every run refreshes its share of the hourly budget, and the refreshes are spread over
+    the interval between two runs, so that the provider calls are evenly distributed.
+    """
+    batch_size = max(1, math.ceil(settings.WEBSITES_SYNC_MAX_PER_HOUR * settings.WEBSITES_SYNC_INTERVAL / 3600))
+    budget = _reserve_sync_budget(batch_size)
+    if not budget:
+        logger.info("websites sync budget exhausted")
+        return []
+
+    candidates = (
+        Website.objects
+        .annotate(synced_date=Coalesce("sync_attempt_date", "refreshed_date", "generated_date"))
+        .filter(_sync_due(timezone.now()))
+        .order_by("synced_date")
+        .values_list("key", flat=True)
+    )
+
+    # a website being refreshed is locked until the next run, so that it's not scheduled twice
+    keys = []
+    for key in candidates.iterator():
+        if len(keys) == budget:
+            break
+        if caches["sync"].add(f"websites_sync:lock:{key}", True, timeout=settings.WEBSITES_SYNC_INTERVAL):
+            keys.append(key)
+    _release_sync_budget(budget - len(keys))
+
+    delay = settings.WEBSITES_SYNC_INTERVAL / budget
+    for i, key in enumerate(keys):
+        refresh_website.apply_async((key,), countdown=i * delay)
+    logger.info("websites sync scheduled {'count': %s}", len(keys))
+    return keys
+
+
+@shared_task
+def start_batch_lane(lane):
+    """
+    start the creation of the first website of a batch `lane` ([user id, base url, airbnb id, task id] lists).
+    The next one is started once this one is done, whether it succeeded or failed (the last stage to run
+    calls back the lane), so that a failing listing never stops the rest of its lane.
+    """
+    if not lane:
+        return 0
+    (user_id, base_url, airbnb_id, task_id), rest = lane[0], lane[1:]
+    next_lane = start_batch_lane.si(rest) if rest else None
+    website_creation_workflow(user_id, base_url, airbnb_id, task_id).apply_async(link=next_lane, link_error=next_lane)
+    return len(lane)
+
+
+def start_websites_batch(user_id, listings, concurrency=None):
+    """
+    create the websites of the (base url, airbnb id) `listings` in background.
+    Listings are spread over `concurrency` lanes run in parallel, each lane creating its websites
+    one after the other (see `start_batch_lane`), so that a batch never creates more than `concurrency`
+    websites at the same time.
+    Returns the batch id and the task id of every listing (in the same order as `listings`).
+    """
+    concurrency = min(concurrency or settings.WEBSITES_BATCH_CONCURRENCY, len(listings))
+    task_ids = [str(uuid4()) for _ in listings]
+    lanes = partition_list(
+        [[user_id, base_url, airbnb_id, task_id] for (base_url, airbnb_id), task_id in zip(listings, task_ids)],
+        concurrency,
+    )
+    for lane in lanes:
+        start_batch_lane(lane)
+
+    # the results of all the tasks are saved under the batch id to follow the progress of the batch
+    batch_id = str(uuid4())
+    GroupResult(batch_id, [current_app.AsyncResult(task_id) for task_id in task_ids]).save()
+    logger.info("websites batch started {'batch_id': %s, 'count': %s}", batch_id, len(listings))
+    return batch_id, task_ids
+
+
+def get_task_outcome(result):
+    """ get the outcome ("pending", "success" or "error") of a website creation task and its data """
+    if not result.ready():
+        return "pending", None
+    if not result.successful():
+        return "error", {"result": "error", "msg": "Erreur inattendue lors de la création du site"}
+    data = result.result
+    return ("success" if data.get("result") == "success" else "error"), data
+
+
+def get_websites_batch_progress(batch_id):
+    """ get the aggregated progress of the batch `batch_id`, None if the batch doesn't exist """
+    batch = GroupResult.restore(batch_id, app=current_app)
+    if batch is None:
+        return None
+
+    tasks = []
+    for result in batch.results:
+        status, data = get_task_outcome(result)
+        tasks.append({"task_id": result.id, "status": status, "data": data})
+    return {
+        "batch_id": batch_id,
+        "total": len(tasks),
+        "completed": sum(1 for task in tasks if task["status"] != "pending"),
+        "succeeded": sum(1 for task in tasks if task["status"] == "success"),
+        "failed": sum(1 for task in tasks if task["status"] == "error"),
+        "tasks": tasks,
     }
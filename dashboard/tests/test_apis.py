@@ -2,10 +2,11 @@ import json
 from unittest import TestCase
 from unittest.mock import Mock, patch
 
-from django.test import Client
+from django.test import Client, override_settings
 from django.urls import reverse
+from django.utils.datastructures import MultiValueDict
 
-from ..apis import api_website_create, api_website_delete
+from ..apis import api_website_create, api_website_delete, api_websites_batch_create
 
 
 class ApiTestCase(TestCase):
@@ -123,7 +124,33 @@ class ApiTestCase(TestCase):
         mock_explode.assert_called_with(request.POST["rental_url"])
         mock_resource.assert_called_with(request.user)
 
-    @patch("dashboard.apis.scrap_and_create_website")
+    @patch("dashboard.apis.start_website_creation")
+    @patch("dashboard.apis.airbnb_circuit_breaker")
+    @patch("dashboard.apis.Website.has_reached_resource_limits")
+    @patch("dashboard.apis.explode_airbnb_url")
+    def test_api_website_create_airbnb_unavailable(self, mock_explode, mock_resource, mock_circuit, mock_celery):
+        """
+        Service unavailable (503) while the Airbnb circuit is open
+        """
+        request = Mock()
+        request.headers = {"x-requested-with": "XMLHttpRequest"}
+        request.POST = {"rental_url": "https://airbnb.fr/1234"}
+        request.user = Mock()
+
+        mock_explode.return_value = ("https://airbnb.fr", "1234")
+        mock_resource.return_value = False
+        mock_circuit.state = mock_circuit.OPEN
+
+        response = api_website_create(request)
+
+        self.assertEqual(response.status_code, 503)
+        self._check_response(
+            response.content,
+            {"error": "Airbnb est momentanément inaccessible. Veuillez réessayer dans quelques minutes."}
+        )
+        mock_celery.assert_not_called()
+
+    @patch("dashboard.apis.start_website_creation")
     @patch("dashboard.apis.Website.has_reached_resource_limits")
     @patch("dashboard.apis.explode_airbnb_url")
     def test_api_website_create_nominal_case(self, mock_explode, mock_resource, mock_celery):
@@ -132,9 +159,9 @@ class ApiTestCase(TestCase):
         """
         rental_url = "https://airbnb.fr"
         rental_id = "1234"
-        task_id = 121
+        task_id = "121"
 
-        mock_celery.delay().id = task_id
+        mock_celery.return_value = task_id
         request = Mock()
         request.headers = {"x-requested-with": "XMLHttpRequest"}
         request.POST = {"rental_url": f"{rental_url}{rental_id}"}
@@ -150,7 +177,102 @@ class ApiTestCase(TestCase):
         self._check_response(response.content, {"task_id": task_id})
         mock_explode.assert_called_with(request.POST["rental_url"])
         mock_resource.assert_called_with(request.user)
-        mock_celery.delay.assert_called_with(request.user.id, rental_url, rental_id)
+        mock_celery.assert_called_with(request.user.id, rental_url, rental_id)
+
+    # ---------------------------------------------------------
+    # api_websites_batch_create
+    # ---------------------------------------------------------
+
+    def _batch_request(self, urls):
+        request = Mock()
+        request.headers = {"x-requested-with": "XMLHttpRequest"}
+        request.POST = MultiValueDict({"rental_urls": urls})
+        request.user = Mock()
+        request.user.id = 123
+        return request
+
+    def test_api_websites_batch_create_is_not_ajax_request(self):
+        """
+        Internal server error (500) if the request is not an ajax request
+        """
+        request = self._batch_request(["https://airbnb.fr/rooms/1"])
+        request.headers = {}
+
+        response = api_websites_batch_create(request)
+
+        self.assertStatusCode('server_error', response.status_code)
+        self._check_response(response.content, {"error": "mauvaise requête"})
+
+    def test_api_websites_batch_create_empty_rental_urls(self):
+        """
+        Internal server error (500) if no url is provided
+        """
+        response = api_websites_batch_create(self._batch_request(["", " "]))
+
+        self.assertStatusCode('server_error', response.status_code)
+        self._check_response(response.content, {"error": "URLs des annonces non fournies"})
+
+    @override_settings(WEBSITES_BATCH_MAX_SIZE=2)
+    def test_api_websites_batch_create_too_many_rental_urls(self):
+        """
+        User error (400) if too many urls are provided
+        """
+        response = api_websites_batch_create(self._batch_request(["a", "b", "c"]))
+
+        self.assertStatusCode('client_error', response.status_code)
+        self._check_response(response.content, {"error": "Un maximum de 2 annonces peut être fourni à la fois"})
+
+    @patch("dashboard.apis.resolve_airbnb_urls")
+    def test_api_websites_batch_create_invalid_rental_urls(self, mock_resolve):
+        """
+        User error (400) if none of the urls is valid
+        """
+        mock_resolve.return_value = ([], ["a", "b"])
+
+        response = api_websites_batch_create(self._batch_request(["a", "b"]))
+
+        self.assertStatusCode('client_error', response.status_code)
+        self._check_response(response.content, {"error": "Aucune des URLs fournies n'est une URL Airbnb valide"})
+
+    @patch("dashboard.apis.start_websites_batch")
+    @patch("dashboard.apis.Website.has_reached_resource_limits")
+    @patch("dashboard.apis.resolve_airbnb_urls")
+    def test_api_websites_batch_create_number_of_websites_exceeded(self, mock_resolve, mock_resource, mock_start):
+        """
+        User error (400) if the batch would exceed the number of websites of the user
+        """
+        request = self._batch_request(["a", "b"])
+        mock_resolve.return_value = ([("a", "1"), ("b", "2")], [])
+        mock_resource.return_value = True
+
+        response = api_websites_batch_create(request)
+
+        self.assertStatusCode('client_error', response.status_code)
+        mock_resource.assert_called_with(request.user, 2)
+        mock_start.assert_not_called()
+
+    @patch("dashboard.apis.start_websites_batch")
+    @patch("dashboard.apis.Website.has_reached_resource_limits")
+    @patch("dashboard.apis.resolve_airbnb_urls")
+    def test_api_websites_batch_create_nominal_case(self, mock_resolve, mock_resource, mock_start):
+        """
+        Nominal case: start a batch of background tasks
+        """
+        request = self._batch_request(["a", "b", "c"])
+        mock_resolve.return_value = ([("a", "1"), ("b", "2")], ["c"])
+        mock_resource.return_value = False
+        mock_start.return_value = ("batch", ["t1", "t2"])
+
+        response = api_websites_batch_create(request)
+
+        self.assertEqual(response.status_code, 202)
+        self._check_response(response.content, {
+            "batch_id": "batch",
+            "tasks": [{"airbnb_id": "1", "task_id": "t1"}, {"airbnb_id": "2", "task_id": "t2"}],
+            "invalid_urls": ["c"],
+        })
+        mock_resolve.assert_called_with(["a", "b", "c"])
+        mock_start.assert_called_with(123, [("a", "1"), ("b", "2")])
 
     # ---------------------------------------------------------
     # api_website_delete
@@ -180,7 +302,7 @@ class ApiTestCase(TestCase):
         self.assertStatusCode('server_error', response.status_code)
         self._check_response(response.content, {"error": "mauvaise requête"})
 
-    @patch("dashboard.apis.Website.get_website", Mock(return_value=None))
+    @patch("dashboard.apis.Website.hide", Mock(return_value=[]))
     def test_api_website_delete_website_not_found(self):
         """
         User error (400) - the website identified by `key` does not exist.
@@ -194,17 +316,19 @@ class ApiTestCase(TestCase):
         self._check_response(response.content, {"error": "Ce site n'existe pas"})
 
 
-    @patch("dashboard.apis.Website.get_website")
-    def test_api_website_delete_nominal_case(self, mock_website):
+    @patch("dashboard.apis.delete_websites.delay")
+    @patch("dashboard.apis.Website.hide")
+    def test_api_website_delete_nominal_case(self, mock_hide, mock_delete):
         """
-        Delete an existing website and get back the website key.
+        Hide an existing website, delete it in background and get back the website key.
         """
         key = "1234"
         request = Mock()
         request.headers = {"x-requested-with": "XMLHttpRequest"}
+        mock_hide.return_value = [12]
 
         response = api_website_delete(request, key)
 
-        mock_website.return_value.delete.assert_called()
+        mock_delete.assert_called_once_with([12])
         self.assertStatusCode('success', response.status_code)
         self._check_response(response.content, {"key": key})
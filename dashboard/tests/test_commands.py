@@ -0,0 +1,140 @@
+import json
+import shutil
+import tempfile
+from io import StringIO
+from pathlib import Path
+from unittest.mock import Mock, patch
+
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase
+
+
+@patch("dashboard.management.commands.create_websites.current_app.AsyncResult", side_effect=lambda task_id: task_id)
+@patch("dashboard.management.commands.create_websites.resolve_airbnb_urls")
+@patch("dashboard.management.commands.create_websites.start_websites_batch")
+@patch("dashboard.management.commands.create_websites.get_task_outcome")
+class CreateWebsitesTestCase(TestCase):
+
+    def setUp(self):
+        get_user_model().objects.create(username="agency")
+        state_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, state_dir)
+        self.state_path = Path(state_dir) / "state.json"
+
+    def _call(self, *urls):
+        out, err = StringIO(), StringIO()
+        call_command(
+            "create_websites", "agency", *urls, state=str(self.state_path), ignore_limits=True,
+            poll_interval=0, stdout=out, stderr=err,
+        )
+        return out.getvalue()
+
+    def test_reports_progress(self, mock_outcome, mock_start, mock_resolve, mock_async_result):
+        mock_resolve.return_value = ([("u1", "1"), ("u2", "2")], [])
+        mock_start.return_value = ("batch", ["t1", "t2"])
+        outcomes = {
+            "t1": [("pending", None), ("success", {"key": "k1"})],
+            "t2": [("success", {"key": "k2"})],
+        }
+        mock_outcome.side_effect = lambda task_id: outcomes[task_id].pop(0)
+
+        out = self._call("u1", "u2")
+
+        self.assertIn("1/2 completed: 1 created, 0 failed", out)
+        self.assertIn("2/2 completed: 2 created, 0 failed", out)
+        mock_start.assert_called_once_with(get_user_model().objects.get().id, [("u1", "1"), ("u2", "2")], None)
+        state = json.loads(self.state_path.read_text())
+        self.assertEqual({id: listing["key"] for id, listing in state.items()}, {"1": "k1", "2": "k2"})
+
+    def test_resume_retries_failed_websites(self, mock_outcome, mock_start, mock_resolve, mock_async_result):
+        mock_resolve.return_value = ([("u1", "1"), ("u2", "2")], [])
+        mock_start.return_value = ("batch", ["t1", "t2"])
+        mock_outcome.side_effect = lambda task_id: (
+            ("success", {"key": "k1"}) if task_id == "t1" else ("error", {"msg": "scrap error"})
+        )
+
+        with self.assertRaisesMessage(CommandError, "1 website(s) not created"):
+            self._call("u1", "u2")
+
+        mock_start.reset_mock()
+        mock_start.return_value = ("batch2", ["t3"])
+        mock_outcome.side_effect = lambda task_id: ("success", {"key": "k2"})
+
+        out = self._call("u1", "u2")
+
+        mock_start.assert_called_once_with(get_user_model().objects.get().id, [("u2", "2")], None)
+        self.assertIn("2 website(s) created, 0 failed", out)
+
+    def test_reports_invalid_urls(self, mock_outcome, mock_start, mock_resolve, mock_async_result):
+        mock_resolve.return_value = ([], ["bad"])
+
+        with self.assertRaisesMessage(CommandError, "0 website(s) not created, 1 invalid url(s)"):
+            self._call("bad")
+        mock_start.assert_not_called()
+
+    def test_timeout(self, mock_outcome, mock_start, mock_resolve, mock_async_result):
+        mock_resolve.return_value = ([("u1", "1")], [])
+        mock_start.return_value = ("batch", ["t1"])
+        mock_outcome.return_value = ("pending", None)
+
+        with self.assertRaisesMessage(CommandError, "1 website(s) not created"):
+            call_command(
+                "create_websites", "agency", "u1", state=str(self.state_path), ignore_limits=True,
+                poll_interval=0, timeout=0, stdout=StringIO(), stderr=StringIO(),
+            )
+
+        # the listing is retried on resume
+        state = json.loads(self.state_path.read_text())
+        self.assertEqual(state["1"]["status"], "error")
+
+    def test_unknown_user(self, mock_outcome, mock_start, mock_resolve, mock_async_result):
+        with self.assertRaisesMessage(CommandError, "unknown user 'nobody'"):
+            call_command("create_websites", "nobody", "u1")
+
+
+class RerenderWebsitesTestCase(TestCase):
+
+    def _call(self, *args):
+        out = StringIO()
+        call_command("rerender_websites", *args, poll_interval=0, stdout=out)
+        return out.getvalue()
+
+    @patch("dashboard.management.commands.rerender_websites.rerender_websites")
+    @patch("dashboard.management.commands.rerender_websites.get_websites_to_rerender", return_value=[1, 2, 3])
+    def test_rerender_websites(self, mock_get, mock_rerender):
+        mock_rerender.side_effect = lambda ids: {"rendered": len(ids), "changed": 1, "failed": 0}
+
+        out = self._call("--workers", "0", "--chunk-size", "2", "--force")
+
+        mock_get.assert_called_once_with(True)
+        self.assertEqual([c.args[0] for c in mock_rerender.call_args_list], [[1, 2], [3]])
+        self.assertIn("3 website(s) to render", out)
+        self.assertIn("3/3 website(s)", out)
+        self.assertIn("3 website(s) rendered in", out)
+        self.assertIn("2 changed, 1 unchanged, 0 failed", out)
+
+    @patch("dashboard.management.commands.rerender_websites.rerender_websites")
+    @patch("dashboard.management.commands.rerender_websites.get_websites_to_rerender", return_value=[1, 2])
+    def test_rerender_websites_failures(self, mock_get, mock_rerender):
+        mock_rerender.return_value = {"rendered": 1, "changed": 0, "failed": 1}
+
+        with self.assertRaisesMessage(CommandError, "1 website(s) not rendered"):
+            self._call("--workers", "0")
+
+    @patch("dashboard.management.commands.rerender_websites.start_websites_rerender")
+    def test_rerender_websites_with_celery(self, mock_start):
+        chunks = [
+            Mock(ready=Mock(return_value=True), successful=Mock(return_value=True),
+                 result={"rendered": 2, "changed": 2, "failed": 0}),
+            Mock(ready=Mock(return_value=True), successful=Mock(return_value=False)),
+        ]
+        mock_start.return_value = ([1, 2, 3], Mock(results=chunks))
+
+        with self.assertRaisesMessage(CommandError, "1 website(s) not rendered"):
+            out = StringIO()
+            call_command("rerender_websites", "--celery", "--chunk-size", "2", poll_interval=0, stdout=out)
+
+        mock_start.assert_called_once_with(2, False)
+        self.assertIn("2/2 chunk(s) rendered", out.getvalue())
+        self.assertIn("2 changed, 0 unchanged, 1 failed", out.getvalue())
@@ -0,0 +1,170 @@
+import json
+from unittest.mock import patch
+
+import redis
+from django.test import Client, SimpleTestCase, override_settings
+from django.urls import reverse
+
+from ..progress import advance_media_progress, get_progress_events, publish_progress, wait_progress_events
+
+
+@override_settings(WEBSITES_PROGRESS_TTL=60)
+class ProgressTestCase(SimpleTestCase):
+
+    def setUp(self):
+        patcher = patch("dashboard.progress._get_redis")
+        self.redis = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.pipe = self.redis.pipeline.return_value.__enter__.return_value
+        self.pubsub = self.redis.pubsub.return_value
+
+    def _messages(self, *events):
+        return [None if event is None else {"data": json.dumps(event)} for event in events]
+
+    def test_publish_progress(self):
+        publish_progress("task", "media", done=1, total=2)
+
+        event = json.dumps({"stage": "media", "done": 1, "total": 2})
+        self.pipe.rpush.assert_called_once_with("progress:task:events", event)
+        self.pipe.expire.assert_called_once_with("progress:task:events", 60)
+        self.pipe.publish.assert_called_once_with("progress:task", event)
+
+    def test_publish_progress_without_task(self):
+        publish_progress(None, "scraped")
+
+        self.redis.pipeline.assert_not_called()
+
+    def test_publish_progress_redis_error(self):
+        self.pipe.execute.side_effect = redis.ConnectionError()
+
+        # the progress is best effort
+        publish_progress("task", "scraped")
+
+    def test_advance_media_progress(self):
+        self.pipe.execute.side_effect = [[4, True], [True, 1]]
+
+        advance_media_progress("task", 2, 10)
+
+        self.pipe.incrby.assert_called_once_with("progress:task:photos", 2)
+        self.pipe.publish.assert_called_once_with(
+            "progress:task", json.dumps({"stage": "media", "done": 4, "total": 10})
+        )
+
+    def test_get_progress_events(self):
+        self.redis.lrange.return_value = [json.dumps({"stage": "converted"}), json.dumps({"stage": "published"})]
+
+        self.assertEqual(get_progress_events("task", 1), [{"stage": "converted"}, {"stage": "published"}])
+        self.redis.lrange.assert_called_once_with("progress:task:events", 1, -1)
+
+    def test_wait_progress_events(self):
+        self.redis.lrange.return_value = [json.dumps({"stage": "scraped"})]
+
+        # the events already published are returned at once
+        self.assertEqual(wait_progress_events("task", 0, 5), [{"stage": "scraped"}])
+        self.pubsub.subscribe.assert_called_once_with("progress:task")
+        self.pubsub.get_message.assert_not_called()
+        self.pubsub.close.assert_called_once()
+
+    def test_wait_progress_events_published_meanwhile(self):
+        self.redis.lrange.side_effect = [[], [json.dumps({"stage": "converted"})]]
+
+        self.assertEqual(wait_progress_events("task", 1, 5), [{"stage": "converted"}])
+        self.pubsub.get_message.assert_called_once()
+
+    @patch("dashboard.progress.time.monotonic")
+    def test_wait_progress_events_timeout(self, mock_monotonic):
+        self.redis.lrange.return_value = []
+        mock_monotonic.side_effect = [0, 2, 6]
+
+        self.assertEqual(wait_progress_events("task", 1, 5), [])
+        self.pubsub.get_message.assert_called_once_with(timeout=3)
+        self.pubsub.close.assert_called_once()
+
+
+@override_settings(WEBSITES_PROGRESS_POLL_TIMEOUT=5)
+class TaskProgressViewTestCase(SimpleTestCase):
+
+    @patch("dashboard.views.current_app")
+    @patch("dashboard.views.wait_progress_events")
+    def test_poll(self, mock_wait, mock_app):
+        mock_wait.return_value = [{"stage": "converted"}, {"stage": "published", "data": {}}]
+        mock_app.AsyncResult.return_value.ready.return_value = False
+
+        response = Client().get(reverse("task_progress", args=["task"]), {"after": 1})
+
+        self.assertEqual(response.json(), {"events": mock_wait.return_value})
+        mock_wait.assert_called_once_with("task", 1, 5)
+
+    @patch("dashboard.views.current_app")
+    @patch("dashboard.views.wait_progress_events")
+    def test_poll_final_event(self, mock_wait, mock_app):
+        mock_wait.return_value = [{"stage": "media", "done": 4, "total": 4}, {"stage": "done", "media_status": "ready"}]
+
+        response = Client().get(reverse("task_progress", args=["task"]), {"after": 4})
+
+        self.assertEqual(response.json(), {"events": mock_wait.return_value})
+        mock_app.AsyncResult.assert_not_called()
+
+    @patch("dashboard.views.current_app")
+    @patch("dashboard.views.wait_progress_events")
+    def test_poll_without_new_event(self, mock_wait, mock_app):
+        mock_wait.return_value = []
+        mock_app.AsyncResult.return_value.ready.return_value = False
+
+        response = Client().get(reverse("task_progress", args=["task"]), {"after": "invalid"})
+
+        self.assertEqual(response.json(), {"events": []})
+        mock_wait.assert_called_once_with("task", 0, 5)
+
+    @patch("dashboard.views.current_app")
+    @patch("dashboard.views.wait_progress_events")
+    def test_poll_finished_task_without_progress(self, mock_wait, mock_app):
+        mock_wait.return_value = []
+        result = mock_app.AsyncResult.return_value
+        result.ready.return_value = True
+        result.successful.return_value = True
+        result.result = {"result": "success", "key": "1234", "media_status": "ready"}
+
+        response = Client().get(reverse("task_progress", args=["task"]))
+
+        self.assertEqual(
+            response.json()["events"],
+            [{"stage": "published", "data": result.result}, {"stage": "done", "media_status": "ready"}],
+        )
+
+    @patch("dashboard.views.current_app")
+    @patch("dashboard.views.wait_progress_events")
+    def test_poll_failed_task_after_some_progress(self, mock_wait, mock_app):
+        # the worker died after publishing some progress: the error is reported whatever the cursor
+        mock_wait.return_value = []
+        result = mock_app.AsyncResult.return_value
+        result.ready.return_value = True
+        result.successful.return_value = False
+
+        response = Client().get(reverse("task_progress", args=["task"]), {"after": 2})
+
+        self.assertEqual([event["stage"] for event in response.json()["events"]], ["error"])
+
+    @patch("dashboard.views.Website.get_website")
+    @patch("dashboard.views.current_app")
+    @patch("dashboard.views.wait_progress_events")
+    def test_poll_finished_task_with_pending_media(self, mock_wait, mock_app, mock_get_website):
+        mock_wait.return_value = []
+        result = mock_app.AsyncResult.return_value
+        result.ready.return_value = True
+        result.successful.return_value = True
+        result.result = {"result": "success", "key": "1234", "media_status": "pending"}
+        mock_get_website.return_value.media_status = "pending"
+
+        # the media stage publishes the final event itself
+        response = Client().get(reverse("task_progress", args=["task"]), {"after": 3})
+        self.assertEqual(response.json(), {"events": []})
+
+        # ... unless it's over without publishing it
+        mock_get_website.return_value.media_status = "failed"
+        response = Client().get(reverse("task_progress", args=["task"]), {"after": 3})
+        self.assertEqual(
+            response.json()["events"],
+            [{"stage": "published", "data": result.result}, {"stage": "done", "media_status": "failed"}],
+        )
+        mock_get_website.assert_called_with("1234")
@@ -1,112 +1,163 @@
 
 from unittest import TestCase
-from unittest.mock import patch
-from datetime import datetime
+from unittest.mock import Mock, patch
+from datetime import datetime, timedelta
 import pytz
 
+from django.contrib.auth import get_user_model
+from django.conf import settings
+from django.core.cache import caches
 from django.template import defaultfilters
+from django.test import TestCase as DjangoTestCase, override_settings
 from django.utils import timezone
 from django.urls import reverse
 
 from websites.config import WEBSITE_URL
+from websites.models import Website, WebsiteLocation
 
-from ..tasks import scrap_and_create_website
+from ..tasks import (
+    convert_listing,
+    create_website,
+    delete_websites,
+    expire_pending_media,
+    finalize_website,
+    get_task_outcome,
+    get_websites_batch_progress,
+    ingest_website_media,
+    media_workflow,
+    publish_website_pages,
+    recover_website_media,
+    refresh_website,
+    scrap_and_create_website,
+    scrap_listing,
+    start_batch_lane,
+    start_websites_batch,
+    start_websites_rerender,
+    store_website_media,
+    sync_stale_websites,
+    website_creation_workflow,
+)
 
 
 class TaskTestCase(TestCase):
 
-    @patch("dashboard.tasks.scrap_and_convert")
-    def test_scrap_and_create_website_scrap_exception(self, mock_scrap):
+    @patch("dashboard.tasks.scrap_airbnb_data")
+    def test_scrap_listing_exception(self, mock_scrap):
         """
         Data scrapping raises an exception
         """
-        user_id = 123
-        base_url = "https://airbnb.fr"
         airbnb_id = "123456"
 
         mock_scrap.side_effect = Exception()
 
-        response = scrap_and_create_website(user_id, base_url, airbnb_id)
+        response = scrap_listing(airbnb_id)
 
         self.assertEqual(response, {"result": "error", "msg": "Impossible d'accéder à votre annonce Airbnb"})
         mock_scrap.assert_called_with(airbnb_id)
 
-    @patch("dashboard.tasks.scrap_and_convert")
-    def test_scrap_and_create_website_scrap_error(self, mock_scrap):
+    @patch("dashboard.tasks.scrap_airbnb_data")
+    def test_scrap_listing_error(self, mock_scrap):
         """
         Data scraping returns an error
         """
-        user_id = 123
-        base_url = "https://airbnb.fr"
-        airbnb_id = "123456"
+        mock_scrap.return_value = None
+
+        response = scrap_listing("123456")
+
+        self.assertEqual(response, {"result": "error", "msg": "Impossible d'accéder à votre annonce Airbnb"})
+
+    @patch("dashboard.tasks.scrap_airbnb_data")
+    def test_scrap_listing_nominal_case(self, mock_scrap):
+        mock_scrap.return_value = [{"details": 1}, {"reviews": 2}]
 
-        mock_scrap.return_value = False
+        response = scrap_listing("123456")
 
-        response = scrap_and_create_website(user_id, base_url, airbnb_id)
+        self.assertEqual(response, {"result": "success", "airbnb_data": [{"details": 1}, {"reviews": 2}]})
+
+    @patch("dashboard.tasks.convert_airbnb_data")
+    def test_convert_listing(self, mock_convert):
+        mock_convert.return_value = {"data": "value"}
+
+        response = convert_listing({"result": "success", "airbnb_data": ["details", "reviews"]})
+
+        self.assertEqual(response, {"result": "success", "data": {"data": "value"}})
+        mock_convert.assert_called_with(["details", "reviews"])
+
+    @patch("dashboard.tasks.convert_airbnb_data")
+    def test_convert_listing_error(self, mock_convert):
+        mock_convert.return_value = None
+
+        response = convert_listing({"result": "success", "airbnb_data": ["details", "reviews"]})
 
         self.assertEqual(response, {"result": "error", "msg": "Impossible d'accéder à votre annonce Airbnb"})
-        mock_scrap.assert_called_with(airbnb_id)
+
+    @patch("dashboard.tasks.convert_airbnb_data")
+    def test_stages_forward_errors(self, mock_convert):
+        error = {"result": "error", "msg": "Impossible d'accéder à votre annonce Airbnb"}
+
+        self.assertEqual(convert_listing(error), error)
+        self.assertEqual(store_website_media(error), error)
+        self.assertEqual(create_website(error, 123, "https://airbnb.fr"), error)
+        mock_convert.assert_not_called()
 
     @patch("dashboard.tasks.Website.create")
-    @patch("dashboard.tasks.scrap_and_convert")
-    def test_scrap_and_create_website_create_raise_exception(self, mock_scrap, mock_create):
+    def test_create_website_raise_exception(self, mock_create):
         """
         Website creation raises an exception
         """
         user_id = 123
         base_url = "https://airbnb.fr"
-        airbnb_id = "123456"
         scrapped_data = {"data": "value"}
 
-        mock_scrap.return_value = scrapped_data
         mock_create.side_effect = Exception()
 
-        response = scrap_and_create_website(user_id, base_url, airbnb_id)
+        response = create_website({"result": "success", "data": scrapped_data}, user_id, base_url)
 
-        self.assertEqual(response, {"result": "error", "msg": "Impossible de créer le site web à partir des données de votre annonce"})
-        mock_scrap.assert_called_with(airbnb_id)
-        mock_create.assert_called_with(user_id, base_url, scrapped_data)
+        self.assertEqual(
+            response,
+            {"result": "error", "msg": "Impossible de créer le site web à partir des données de votre annonce"},
+        )
+        mock_create.assert_called_with(user_id, base_url, scrapped_data, defer_media=True, stored_media=None)
 
     @patch("dashboard.tasks.Website.create")
-    @patch("dashboard.tasks.scrap_and_convert")
-    def test_scrap_and_create_website_create_error(self, mock_scrap, mock_create):
+    def test_create_website_error(self, mock_create):
         """
         Website creation returns an error
         """
         user_id = 123
         base_url = "https://airbnb.fr"
-        airbnb_id = "123456"
         scrapped_data = {"data": "value"}
 
-        mock_scrap.return_value = scrapped_data
         mock_create.return_value = None
 
-        response = scrap_and_create_website(user_id, base_url, airbnb_id)
+        response = create_website({"result": "success", "data": scrapped_data}, user_id, base_url)
 
-        self.assertEqual(response, {"result": "error", "msg": "Impossible de créer le site web à partir des données de votre annonce"})
-        mock_scrap.assert_called_with(airbnb_id)
-        mock_create.assert_called_with(user_id, base_url, scrapped_data)
+        self.assertEqual(
+            response,
+            {"result": "error", "msg": "Impossible de créer le site web à partir des données de votre annonce"},
+        )
+        mock_create.assert_called_with(user_id, base_url, scrapped_data, defer_media=True, stored_media=None)
 
+    @patch("dashboard.tasks.publish_website_pages")
+    @patch("dashboard.tasks.media_workflow")
     @patch("dashboard.tasks.Website.create")
-    @patch("dashboard.tasks.scrap_and_convert")
-    def test_scrap_and_create_website_nominal_case(self, mock_scrap, mock_create):
+    def test_create_website_nominal_case(self, mock_create, mock_media, mock_publish_pages):
         """
-        Website creation returns an error
+        Website creation succeeds
         """
         user_id = 123
         base_url = "https://airbnb.fr"
-        airbnb_id = "123456"
         scrapped_data = {"data": "value"}
         website_data = {
             "key": "1234",
             "name": "My website",
             "generated_date": datetime(2009, 7, 10, 18, 44, 59, 193982, tzinfo=pytz.utc),
+            "media_status": "ready",
         }
 
-        mock_scrap.return_value = scrapped_data
         mock_create.return_value.configure_mock(**website_data)
 
-        response = scrap_and_create_website(user_id, base_url, airbnb_id)
+        response = create_website({"result": "success", "data": scrapped_data}, user_id, base_url)
 
         self.assertEqual(
             response,
@@ -117,8 +168,453 @@ class TaskTestCase(TestCase):
                 "url": WEBSITE_URL % website_data["key"],
                 "generated_date": defaultfilters.date(timezone.localtime(website_data["generated_date"]), "d/m/Y G:i"),
                 "delete_url": reverse('api_website_delete', args=[website_data["key"]]),
-
+                "media_status": "ready",
             }
         )
-        mock_scrap.assert_called_with(airbnb_id)
-        mock_create.assert_called_with(user_id, base_url, scrapped_data)
+        mock_create.assert_called_with(user_id, base_url, scrapped_data, defer_media=True, stored_media=None)
+        mock_media.assert_not_called()
+        # the pages of the new website are cached and exported right away, on the media queue
+        mock_publish_pages.delay.assert_called_once_with("1234")
+
+    @patch("dashboard.tasks.Website.discard_stored_media")
+    @patch("dashboard.tasks.publish_website_pages", Mock())
+    @patch("dashboard.tasks.Website.create")
+    def test_create_website_uses_stored_media(self, mock_create, mock_discard):
+        mock_create.return_value.configure_mock(
+            key="1234", name="My website", generated_date=timezone.now(), media_status="ready",
+        )
+        media = {"https://media.fr/host.jpg": {"name": "host.jpg", "variants": []}}
+
+        response = create_website({"result": "success", "data": {"data": "value"}, "media": media}, 123, "url")
+
+        self.assertEqual(response["result"], "success")
+        mock_create.assert_called_with(123, "url", {"data": "value"}, defer_media=True, stored_media=media)
+        mock_discard.assert_not_called()
+
+        # the media files stored for a website which isn't created are discarded
+        mock_create.return_value = None
+        response = create_website({"result": "success", "data": {"data": "value"}, "media": media}, 123, "url")
+
+        self.assertEqual(response["result"], "error")
+        mock_discard.assert_called_once_with(media)
+
+    @patch("dashboard.tasks.Website.store_media")
+    def test_store_website_media(self, mock_store):
+        mock_store.return_value = {"https://media.fr/host.jpg": {"name": "host.jpg", "variants": []}}
+
+        response = store_website_media({"result": "success", "data": {"data": "value"}})
+
+        self.assertEqual(response, {"result": "success", "data": {"data": "value"}, "media": mock_store.return_value})
+        mock_store.assert_called_once_with({"data": "value"}, defer_media=True)
+
+    @patch("dashboard.tasks.Website.store_media")
+    def test_store_website_media_error(self, mock_store):
+        mock_store.side_effect = Exception()
+
+        response = store_website_media({"result": "success", "data": {"data": "value"}})
+
+        # the website is created anyway, without these media files
+        self.assertEqual(response, {"result": "success", "data": {"data": "value"}, "media": {}})
+
+    @patch("dashboard.tasks.export_website")
+    @patch("dashboard.tasks.warm_website_pages")
+    @patch("dashboard.tasks.Website.get_website")
+    def test_publish_website_pages(self, mock_get, mock_warm, mock_export):
+        mock_get.return_value.key = "1234"
+
+        publish_website_pages("1234")
+
+        mock_warm.assert_called_once_with("1234")
+        mock_export.assert_called_once_with(mock_get.return_value)
+
+        # a failure only delays the caching of the pages to their first visit
+        mock_warm.side_effect = Exception()
+        publish_website_pages("1234")
+
+        mock_get.return_value = None
+        publish_website_pages("1234")
+        self.assertEqual(mock_warm.call_count, 2)
+
+    @patch("dashboard.tasks.publish_website_pages", Mock())
+    @patch("dashboard.tasks.publish_progress")
+    @patch("dashboard.tasks.media_workflow")
+    @patch("dashboard.tasks.Website.create")
+    def test_create_website_defers_media(self, mock_create, mock_media, mock_publish):
+        mock_create.return_value.configure_mock(
+            key="1234", name="My website", generated_date=timezone.now(), media_status="pending",
+        )
+
+        response = create_website(
+            {"result": "success", "data": {"data": "value"}}, 123, "https://airbnb.fr", progress_id="task",
+        )
+
+        self.assertEqual((response["result"], response["media_status"]), ("success", "pending"))
+        mock_media.assert_called_once_with("1234", {"data": "value"}, progress_id="task")
+        mock_media.return_value.apply_async.assert_called_once()
+        # the website is published, the media stage reports the end of the creation
+        mock_publish.assert_called_once_with("task", "published", data=response)
+
+    @patch("dashboard.tasks.publish_progress")
+    @patch("dashboard.tasks.scrap_airbnb_data")
+    def test_stages_publish_their_progress(self, mock_scrap, mock_publish):
+        mock_scrap.return_value = ["details", "reviews"]
+        scrap_listing("123456", progress_id="task")
+        mock_publish.assert_called_with("task", "scraped")
+
+        mock_scrap.return_value = None
+        response = scrap_listing("123456", progress_id="task")
+        mock_publish.assert_called_with("task", "error", data=response)
+
+    def test_website_creation_workflow(self):
+        workflow = website_creation_workflow(123, "https://airbnb.fr/rooms/1", "1", "task")
+
+        # the progress of every stage is published under the id of the task polled by the client
+        self.assertEqual([t.kwargs for t in workflow.tasks], [{"progress_id": "task"}] * 4)
+
+        self.assertEqual(
+            [(t.task, t.args) for t in workflow.tasks],
+            [
+                ("dashboard.tasks.scrap_listing", ("1",)),
+                ("dashboard.tasks.convert_listing", ()),
+                ("dashboard.tasks.store_website_media", ()),
+                ("dashboard.tasks.create_website", (123, "https://airbnb.fr/rooms/1")),
+            ],
+        )
+        self.assertEqual(workflow.tasks[-1].options["task_id"], "task")
+
+    @patch("dashboard.tasks.website_creation_workflow")
+    def test_scrap_and_create_website_starts_the_workflow(self, mock_workflow):
+        with patch.object(scrap_and_create_website, "replace") as mock_replace:
+            scrap_and_create_website.apply(args=(123, "https://airbnb.fr/rooms/1", "1"), task_id="task")
+
+        # the workflow replaces the former task, under its id
+        mock_workflow.assert_called_once_with(123, "https://airbnb.fr/rooms/1", "1", "task")
+        mock_replace.assert_called_once_with(mock_workflow.return_value)
+
+    def test_media_workflow(self):
+        data = {"photos": [{"url": i} for i in range(5)], "reviews": [{"review": i} for i in range(2)]}
+
+        workflow = media_workflow("1234", data, chunk_size=2)
+
+        self.assertEqual(
+            [t.args for t in workflow.tasks],
+            [
+                ("1234", [{"url": 0}, {"url": 1}], []),
+                ("1234", [{"url": 2}, {"url": 3}], []),
+                ("1234", [{"url": 4}], []),
+                ("1234", [], [{"review": 0}, {"review": 1}]),
+            ],
+        )
+        self.assertEqual((workflow.body.task, workflow.body.args), ("dashboard.tasks.finalize_website", ("1234", data)))
+        # the website is recovered if a chunk dies
+        [recover] = workflow.body.options["link_error"]
+        self.assertEqual(recover.task, "dashboard.tasks.recover_website_media")
+        self.assertEqual(recover.kwargs, {"key": "1234", "data": data})
+
+    @patch("dashboard.tasks.finalize_website")
+    def test_recover_website_media(self, mock_finalize):
+        response = recover_website_media("chunk", key="1234", data={"data": "value"}, progress_id="task")
+
+        self.assertEqual(response, mock_finalize.return_value)
+        mock_finalize.assert_called_once_with([], "1234", {"data": "value"}, progress_id="task")
+
+    @override_settings(WEBSITES_MEDIA_PENDING_TIMEOUT=3600)
+    @patch("dashboard.tasks.Website.expire_pending_media")
+    def test_expire_pending_media(self, mock_expire):
+        mock_expire.return_value = ["1234"]
+
+        self.assertEqual(expire_pending_media(), ["1234"])
+        date = mock_expire.call_args.args[0]
+        self.assertAlmostEqual((timezone.now() - date).total_seconds(), 3600, delta=60)
+
+    def test_media_workflow_without_media(self):
+        workflow = media_workflow("1234", {"photos": [], "reviews": []})
+
+        self.assertEqual(
+            (workflow.task, workflow.args),
+            ("dashboard.tasks.finalize_website", ([], "1234", {"photos": [], "reviews": []})),
+        )
+
+    @patch("dashboard.tasks.advance_media_progress")
+    @patch("dashboard.tasks.Website.get_website")
+    def test_ingest_website_media(self, mock_get, mock_advance):
+        website = mock_get.return_value
+        website.key = "1234"
+        website.ingest_media.return_value = 3
+
+        response = ingest_website_media("1234", [{"url": "photo"}], [], progress_id="task", total=5)
+
+        self.assertEqual(response, {"result": "success", "key": "1234", "count": 3})
+        website.ingest_media.assert_called_once_with([{"url": "photo"}], [])
+        mock_advance.assert_called_once_with("task", 1, 5)
+
+    @patch("dashboard.tasks.Website.get_website")
+    def test_ingest_website_media_error(self, mock_get):
+        mock_get.return_value.ingest_media.side_effect = Exception()
+
+        response = ingest_website_media("1234", [{"url": "photo"}], [])
+
+        self.assertEqual(response, {"result": "error", "msg": "Impossible de récupérer les photos de votre annonce"})
+
+    @patch("dashboard.tasks.publish_website_pages")
+    @patch("dashboard.tasks.Website.get_website")
+    def test_finalize_website(self, mock_get, mock_publish_pages):
+        website = mock_get.return_value
+        website.configure_mock(key="1234", media_status="ready")
+
+        response = finalize_website([], "1234", {"data": "value"})
+
+        self.assertEqual(response, {"result": "success", "key": "1234", "media_status": "ready"})
+        website.ingest_deferred_media.assert_called_once_with({"data": "value"})
+        mock_publish_pages.delay.assert_called_once_with("1234")
+
+    @patch("dashboard.tasks.Website.get_website")
+    def test_finalize_website_error(self, mock_get):
+        mock_get.return_value.ingest_deferred_media.side_effect = Exception()
+
+        response = finalize_website([], "1234", {"data": "value"})
+
+        self.assertEqual(response, {"result": "error", "msg": "Impossible de récupérer les photos de votre annonce"})
+
+    @override_settings(WEBSITES_DELETE_BATCH_SIZE=2)
+    @patch("dashboard.tasks.Website.purge")
+    def test_delete_websites_by_batches(self, mock_purge):
+        mock_purge.side_effect = lambda ids: len(ids)
+
+        self.assertEqual(delete_websites([1, 2, 3, 4, 5]), 5)
+        self.assertEqual([c.args[0] for c in mock_purge.call_args_list], [[1, 2], [3, 4], [5]])
+
+    @patch("dashboard.tasks.Website.get_website")
+    def test_refresh_website_unknown_website(self, mock_get):
+        mock_get.return_value = None
+
+        response = refresh_website("1234")
+
+        self.assertEqual(response, {"result": "error", "msg": "Site web introuvable"})
+
+    @patch("dashboard.tasks.scrap_and_convert")
+    @patch("dashboard.tasks.Website.get_website")
+    def test_refresh_website_scrap_error(self, mock_get, mock_scrap):
+        mock_get.return_value.rental_url = "https://www.airbnb.fr/rooms/123456"
+        mock_scrap.return_value = None
+
+        response = refresh_website("1234")
+
+        self.assertEqual(response, {"result": "error", "msg": "Impossible d'accéder à votre annonce Airbnb"})
+        mock_scrap.assert_called_with("123456", use_cache=False)
+        mock_get.return_value.refresh.assert_not_called()
+        mock_get.return_value.record_sync_attempt.assert_called_once_with(False)
+
+    @patch("dashboard.tasks.scrap_and_convert")
+    @patch("dashboard.tasks.Website.get_website")
+    def test_refresh_website_refresh_exception(self, mock_get, mock_scrap):
+        mock_get.return_value.rental_url = "https://www.airbnb.fr/rooms/123456"
+        mock_get.return_value.refresh.side_effect = Exception()
+
+        response = refresh_website("1234")
+
+        self.assertEqual(
+            response,
+            {"result": "error", "msg": "Impossible de mettre à jour le site web à partir des données de votre annonce"},
+        )
+
+    @patch("dashboard.tasks.export_website", Mock())
+    @patch("dashboard.tasks.warm_website_pages")
+    @patch("dashboard.tasks.scrap_and_convert")
+    @patch("dashboard.tasks.Website.get_website")
+    def test_refresh_website_nominal_case(self, mock_get, mock_scrap, mock_warm):
+        website = mock_get.return_value
+        website.configure_mock(key="1234", rental_url="https://www.airbnb.fr/rooms/123456")
+        website.refresh.return_value = ["photos", "reviews"]
+
+        response = refresh_website("1234")
+
+        self.assertEqual(response, {"result": "success", "key": "1234", "sections": ["photos", "reviews"]})
+        website.refresh.assert_called_once_with(mock_scrap.return_value)
+        website.record_sync_attempt.assert_called_once_with(True)
+        mock_warm.assert_called_once_with("1234")
+
+
+class BatchTestCase(TestCase):
+
+    @patch("dashboard.tasks.GroupResult")
+    @patch("dashboard.tasks.website_creation_workflow")
+    def test_start_websites_batch(self, mock_workflow, mock_group_result):
+        listings = [(f"https://airbnb.fr/rooms/{i}", str(i)) for i in range(5)]
+
+        batch_id, task_ids = start_websites_batch(123, listings, concurrency=2)
+
+        # listings are spread over 2 lanes, only the first listing of each lane is started
+        self.assertEqual(
+            [c.args for c in mock_workflow.call_args_list],
+            [(123, listings[0][0], "0", task_ids[0]), (123, listings[3][0], "3", task_ids[3])],
+        )
+        # the rest of the lane is started once the listing is done, whatever its outcome
+        options = mock_workflow.return_value.apply_async.call_args_list[0].kwargs
+        self.assertEqual(options["link"], options["link_error"])
+        self.assertEqual(
+            options["link"].args,
+            ([[123, url, id, task_id] for (url, id), task_id in list(zip(listings, task_ids))[1:3]],),
+        )
+        options = mock_workflow.return_value.apply_async.call_args_list[1].kwargs
+        self.assertEqual(options["link"].args, ([[123, listings[4][0], "4", task_ids[4]]],))
+
+        # the results of all the tasks are saved under the batch id
+        self.assertEqual(mock_group_result.call_args.args[0], batch_id)
+        self.assertEqual([r.id for r in mock_group_result.call_args.args[1]], task_ids)
+        mock_group_result.return_value.save.assert_called_once()
+
+    @patch("dashboard.tasks.website_creation_workflow")
+    def test_start_batch_lane_last_listing(self, mock_workflow):
+        self.assertEqual(start_batch_lane([[123, "https://airbnb.fr/rooms/1", "1", "t1"]]), 1)
+
+        mock_workflow.assert_called_once_with(123, "https://airbnb.fr/rooms/1", "1", "t1")
+        mock_workflow.return_value.apply_async.assert_called_once_with(link=None, link_error=None)
+
+    def test_website_creation_workflow_continues_lane_on_error(self):
+        next_lane = start_batch_lane.si([[123, "https://airbnb.fr/rooms/2", "2", "t2"]])
+
+        workflow = website_creation_workflow(123, "https://airbnb.fr/rooms/1", "1", "t1")
+        with patch("celery.app.task.Task.apply_async") as mock_apply:
+            workflow.apply_async(link=next_lane, link_error=next_lane)
+
+        # every stage calls back the lane on error
+        options = mock_apply.call_args.kwargs
+        self.assertIn(next_lane, options["link_error"])
+
+    @patch("dashboard.tasks.get_websites_to_rerender", return_value=list(range(5)))
+    @patch("dashboard.tasks.group")
+    def test_start_websites_rerender(self, mock_group, mock_get):
+        ids, result = start_websites_rerender(chunk_size=2, force=True)
+
+        mock_get.assert_called_once_with(True)
+        self.assertEqual(ids, list(range(5)))
+        chunks = list(mock_group.call_args.args[0])
+        self.assertEqual([chunk.args for chunk in chunks], [([0, 1],), ([2, 3],), ([4],)])
+        self.assertEqual(result, mock_group.return_value.apply_async.return_value)
+
+    @patch("dashboard.tasks.get_websites_to_rerender", return_value=[])
+    @patch("dashboard.tasks.group")
+    def test_start_websites_rerender_nothing_to_render(self, mock_group, mock_get):
+        self.assertEqual(start_websites_rerender(), ([], None))
+        mock_group.assert_not_called()
+
+    def _result(self, ready, successful=True, result=None):
+        return Mock(id="task", ready=Mock(return_value=ready), successful=Mock(return_value=successful), result=result)
+
+    def test_get_task_outcome(self):
+        self.assertEqual(get_task_outcome(self._result(False)), ("pending", None))
+        self.assertEqual(get_task_outcome(self._result(True, False))[0], "error")
+        self.assertEqual(
+            get_task_outcome(self._result(True, result={"result": "error", "msg": "msg"})),
+            ("error", {"result": "error", "msg": "msg"}),
+        )
+        self.assertEqual(
+            get_task_outcome(self._result(True, result={"result": "success", "key": "k"})),
+            ("success", {"result": "success", "key": "k"}),
+        )
+
+    @patch("dashboard.tasks.GroupResult.restore")
+    def test_get_websites_batch_progress(self, mock_restore):
+        mock_restore.return_value.results = [
+            self._result(False),
+            self._result(True, result={"result": "success"}),
+            self._result(True, result={"result": "error"}),
+            self._result(True, result={"result": "success"}),
+        ]
+
+        progress = get_websites_batch_progress("batch")
+
+        self.assertEqual(
+            {k: v for k, v in progress.items() if k != "tasks"},
+            {"batch_id": "batch", "total": 4, "completed": 3, "succeeded": 2, "failed": 1},
+        )
+        self.assertEqual([t["status"] for t in progress["tasks"]], ["pending", "success", "error", "success"])
+
+    @patch("dashboard.tasks.GroupResult.restore")
+    def test_get_websites_batch_progress_unknown_batch(self, mock_restore):
+        mock_restore.return_value = None
+        self.assertEqual(get_websites_batch_progress("batch"), None)
+
+
+# the "sync" cache is on the Redis instance of the broker, a local memory cache stands for it in the tests
+@override_settings(
+    WEBSITES_SYNC_STALE_AFTER=3600, WEBSITES_SYNC_INTERVAL=600, WEBSITES_SYNC_MAX_PER_HOUR=12,
+    WEBSITES_SYNC_MAX_BACKOFF=4 * 3600,
+    CACHES=settings.CACHES | {"sync": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "sync"}},
+)
+@patch("dashboard.tasks.refresh_website.apply_async")
+class SyncTestCase(DjangoTestCase):
+
+    def setUp(self):
+        caches["sync"].clear()
+        self.user = get_user_model().objects.create(username="user", email="user@eroo.fr")
+
+    def _create_website(self, key, hours, refreshed_hours=None, attempt_hours=None, failures=0):
+        website = Website.objects.create(
+            key=key,
+            rental_url=f"https://airbnb.fr/rooms/{key}",
+            description="",
+            bedroom_count=1,
+            bed_count=1,
+            bathroom_count=1,
+            guest_count=1,
+            user=self.user,
+            location=WebsiteLocation.objects.create(title="", latitude=0, longitude=0),
+        )
+        now = timezone.now()
+        Website.objects.filter(id=website.id).update(
+            generated_date=now - timedelta(hours=hours),
+            refreshed_date=now - timedelta(hours=refreshed_hours) if refreshed_hours is not None else None,
+            sync_attempt_date=now - timedelta(hours=attempt_hours) if attempt_hours is not None else None,
+            sync_failures=failures,
+        )
+
+    def test_sync_stalest_websites_first(self, mock_apply):
+        self._create_website("fresh", hours=0)
+        self._create_website("refreshed", hours=10, refreshed_hours=0)
+        self._create_website("stale", hours=2)
+        self._create_website("stalest", hours=5)
+        self._create_website("refreshed_stale", hours=10, refreshed_hours=3)
+
+        keys = sync_stale_websites()
+
+        # 12 per hour => 2 per run of 10 minutes, spread over the interval
+        self.assertEqual(keys, ["stalest", "refreshed_stale"])
+        self.assertEqual(
+            [(c.args, c.kwargs) for c in mock_apply.call_args_list],
+            [((("stalest",),), {"countdown": 0}), ((("refreshed_stale",),), {"countdown": 300})],
+        )
+
+    def test_sync_does_not_schedule_a_website_twice(self, mock_apply):
+        for i in range(3):
+            self._create_website(f"stale_{i}", hours=5 - i)
+
+        self.assertEqual(sync_stale_websites(), ["stale_0", "stale_1"])
+        self.assertEqual(sync_stale_websites(), ["stale_2"])
+
+    def test_sync_backs_off_failing_websites(self, mock_apply):
+        # stale for 1h, doubled by every failure, up to 4h
+        self._create_website("failed_once", hours=10, attempt_hours=1.5, failures=1)
+        self._create_website("failed_once_due", hours=10, attempt_hours=2.5, failures=1)
+        self._create_website("failing", hours=10, attempt_hours=3.5, failures=5)
+        self._create_website("failing_due", hours=10, attempt_hours=4.5, failures=5)
+
+        self.assertEqual(sync_stale_websites(), ["failing_due", "failed_once_due"])
+
+    def test_sync_stalest_attempts_first(self, mock_apply):
+        # the websites whose last attempt failed don't stay the stalest ones
+        for i in range(10):
+            self._create_website(f"failing_{i}", hours=100, attempt_hours=1.9 - i / 100, failures=i % 2)
+        self._create_website("stale", hours=5)
+
+        self.assertEqual(sync_stale_websites(), ["stale", "failing_0"])
+
+    def test_sync_respects_hourly_budget(self, mock_apply):
+        for i in range(20):
+            self._create_website(f"stale_{i:02}", hours=30 - i)
+
+        keys = [key for _ in range(10) for key in sync_stale_websites()]
+
+        self.assertEqual(len(keys), 12)
+        self.assertEqual(len(set(keys)), 12)
@@ -1,13 +1,16 @@
 from django.urls import path
-from .views import DashboardView, TaskView, homepage
-from .apis import api_website_create, api_website_delete
+from .views import BatchView, DashboardView, TaskProgressView, TaskView, homepage
+from .apis import api_website_create, api_website_delete, api_websites_batch_create
 
 urlpatterns = [
     path("", homepage, name="homepage"),
     path("dashboard", DashboardView.as_view(), name="dashboard"),
     path('dashboard/task/<str:task_id>/', TaskView.as_view(), name='task'),
+    path('dashboard/task/<str:task_id>/progress/', TaskProgressView.as_view(), name='task_progress'),
+    path('dashboard/batch/<str:batch_id>/', BatchView.as_view(), name='batch'),
 
     # API
     path("api/v1/website/create", api_website_create, name="api_website_create"),
     path("api/v1/website/delete/<str:key>", api_website_delete, name="api_website_delete"),
+    path("api/v1/websites/batch/create", api_websites_batch_create, name="api_websites_batch_create"),
 ]
@@ -1,12 +1,16 @@
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.http import JsonResponse
+from django.http import Http404, JsonResponse
 from django.shortcuts import redirect
 from django.views import View
 from django.views.generic import TemplateView
 
 from celery import current_app
 from websites.config import MAX_WEBSITES_COUNT, WEBSITE_URL
-from websites.models import Website
+from websites.models import MEDIA_STATUS_PENDING, Website
+
+from .progress import is_final, wait_progress_events
+from .tasks import get_task_outcome, get_websites_batch_progress
 
 
 def homepage(request):
@@ -44,3 +48,50 @@ class TaskView(View):
             response_data['data'] = task.get()
 
         return JsonResponse(response_data)
+
+
+def _get_outcome_events(result, received):
+    """
+    progress events reporting the outcome of the finished website creation `result`.
+    Its media files may still be ingested: the media stage publishes the "done" event itself,
+    so only the "published" event is reported, unless the client already `received` some events.
+    """
+    status, data = get_task_outcome(result)
+    if status == "error":
+        return [{"stage": "error", "data": data}]
+
+    media_status = data.get("media_status")
+    if media_status == MEDIA_STATUS_PENDING:
+        website = Website.get_website(data["key"])
+        media_status = website.media_status if website else None
+    if media_status != MEDIA_STATUS_PENDING:
+        return [{"stage": "published", "data": data}, {"stage": "done", "media_status": media_status}]
+    return [] if received else [{"stage": "published", "data": data}]
+
+
+class TaskProgressView(View):
+    """
+    long-poll of the progress of a website creation (see `dashboard.progress`): returns the events following
+    the `after` first ones, waiting at most WEBSITES_PROGRESS_POLL_TIMEOUT seconds for one, so that a client
+    only holds a thread of the web server for a short time.
+    """
+
+    def get(self, request, task_id):
+        try:
+            after = max(int(request.GET.get("after", 0)), 0)
+        except ValueError:
+            after = 0
+        events = wait_progress_events(task_id, after, settings.WEBSITES_PROGRESS_POLL_TIMEOUT)
+        if not any(is_final(event) for event in events) and (result := current_app.AsyncResult(task_id)).ready():
+            # no final progress published (anymore): the outcome of the finished task is reported instead
+            events = events + _get_outcome_events(result, received=bool(after or events))
+        return JsonResponse({"events": events})
+
+
+class BatchView(View):
+    def get(self, request, batch_id):
+        progress = get_websites_batch_progress(batch_id)
+        if progress is None:
+            raise Http404("batch not found")
+
+        return JsonResponse(progress)
@@ -42,6 +42,70 @@ AIRBNB_API_KEY = env.str("AIRBNB_API_KEY")
 
 SCRAPING_PROXY_ENABLED = env.bool("SCRAPING_PROXY_ENABLED", False)
 SCRAPING_PROXY = env.str("SCRAPING_PROXY") if SCRAPING_PROXY_ENABLED else None
+# deadline (in seconds) shared by all the provider calls done to scrap a listing
+SCRAPING_TIMEOUT = env.int("SCRAPING_TIMEOUT", default=30)
+
+# set of api keys/proxies used in turn, every api key being paired with a proxy
+AIRBNB_API_KEYS = env.list("AIRBNB_API_KEYS", default=[AIRBNB_API_KEY])
+SCRAPING_PROXIES = env.list("SCRAPING_PROXIES", default=[SCRAPING_PROXY]) if SCRAPING_PROXY_ENABLED else [None]
+
+# rate limit of the provider calls, per api key/proxy: `SCRAPING_RATE_LIMIT` calls per second
+# with bursts of `SCRAPING_RATE_LIMIT_BURST` calls. A call waits up to `SCRAPING_RATE_LIMIT_MAX_WAIT`
+# seconds for a token. With USE_DISTRIBUTED_RATE_LIMIT, the limit is shared by all the workers (Redis at
+# REDIS_URL): it's the default, an in-memory limit per process is only used by the tests and in development.
+USE_DISTRIBUTED_RATE_LIMIT = env.bool(
+    "USE_DISTRIBUTED_RATE_LIMIT", default=not (IS_ENV_DEV or IS_TESTS_IN_PROGRESS)
+)
+SCRAPING_RATE_LIMIT = env.float("SCRAPING_RATE_LIMIT", default=1.0)
+SCRAPING_RATE_LIMIT_BURST = env.int("SCRAPING_RATE_LIMIT_BURST", default=5)
+SCRAPING_RATE_LIMIT_MAX_WAIT = env.int("SCRAPING_RATE_LIMIT_MAX_WAIT", default=120)
+
+# provider calls failing with a transient error are retried with an exponential backoff (in seconds)
+SCRAPING_RETRIES = env.int("SCRAPING_RETRIES", default=3)
+SCRAPING_RETRY_BASE_DELAY = env.float("SCRAPING_RETRY_BASE_DELAY", default=0.5)
+SCRAPING_RETRY_MAX_DELAY = env.float("SCRAPING_RETRY_MAX_DELAY", default=5)
+# after `SCRAPING_CIRCUIT_FAILURE_THRESHOLD` consecutive failed scrapes, the provider is considered
+# as down and scrapes fail immediately during `SCRAPING_CIRCUIT_RECOVERY_TIMEOUT` seconds
+SCRAPING_CIRCUIT_FAILURE_THRESHOLD = env.int("SCRAPING_CIRCUIT_FAILURE_THRESHOLD", default=5)
+SCRAPING_CIRCUIT_RECOVERY_TIMEOUT = env.int("SCRAPING_CIRCUIT_RECOVERY_TIMEOUT", default=60)
+
+# ------------ websites configurations ------------
+
+# maximum number of media files downloaded/uploaded at the same time for a website
+MEDIA_INGEST_MAX_WORKERS = env.int("MEDIA_INGEST_MAX_WORKERS", default=8)
+# timeout (in seconds) applied to the download of every single media file
+MEDIA_DOWNLOAD_TIMEOUT = env.int("MEDIA_DOWNLOAD_TIMEOUT", default=10)
+# maximum size (in bytes) of a downloaded media file
+MEDIA_DOWNLOAD_MAX_SIZE = env.int("MEDIA_DOWNLOAD_MAX_SIZE", default=20 * 1024 * 1024)
+# publish the websites as soon as their main photo is stored, the other media files being ingested in background
+WEBSITES_DEFER_MEDIA = env.bool("WEBSITES_DEFER_MEDIA", default=True)
+# number of photos (or reviews) ingested by each task of the parallel media stage
+WEBSITES_MEDIA_CHUNK_SIZE = env.int("WEBSITES_MEDIA_CHUNK_SIZE", default=10)
+# widths (in pixels) of the resized WebP variants generated for every image, used in `srcset`
+IMAGE_VARIANT_WIDTHS = env.list("IMAGE_VARIANT_WIDTHS", subcast=int, default=[320, 640, 1024])
+IMAGE_VARIANT_QUALITY = env.int("IMAGE_VARIANT_QUALITY", default=80)
+# number of processes generating the variants (0: generated by the ingestion threads, None: one per core)
+IMAGE_VARIANTS_MAX_WORKERS = env.int("IMAGE_VARIANTS_MAX_WORKERS", default=None)
+# the progress of a website creation is kept (in seconds) for the clients following it
+WEBSITES_PROGRESS_TTL = env.int("WEBSITES_PROGRESS_TTL", default=3600)
+# maximum duration (in seconds) of a progress poll waiting for an event: it holds a thread of the web server
+WEBSITES_PROGRESS_POLL_TIMEOUT = env.int("WEBSITES_PROGRESS_POLL_TIMEOUT", default=5)
+# maximum number of websites of a batch created at the same time
+WEBSITES_BATCH_CONCURRENCY = env.int("WEBSITES_BATCH_CONCURRENCY", default=4)
+# duration (in seconds) after which the media files of a website still pending are marked as failed
+WEBSITES_MEDIA_PENDING_TIMEOUT = env.int("WEBSITES_MEDIA_PENDING_TIMEOUT", default=3600)
+# maximum number of listings in a batch
+WEBSITES_BATCH_MAX_SIZE = env.int("WEBSITES_BATCH_MAX_SIZE", default=100)
+# number of websites deleted per transaction by the background deletion
+WEBSITES_DELETE_BATCH_SIZE = env.int("WEBSITES_DELETE_BATCH_SIZE", default=20)
+# websites whose data is older than this age (in seconds) are refreshed by the periodic sync
+WEBSITES_SYNC_STALE_AFTER = env.int("WEBSITES_SYNC_STALE_AFTER", default=24 * 3600)
+# interval (in seconds) between two runs of the periodic sync
+WEBSITES_SYNC_INTERVAL = env.int("WEBSITES_SYNC_INTERVAL", default=10 * 60)
+# maximum number of listings scrapped by the periodic sync per hour
+WEBSITES_SYNC_MAX_PER_HOUR = env.int("WEBSITES_SYNC_MAX_PER_HOUR", default=60)
+# maximum delay (in seconds) before syncing again a website whose syncs keep failing (delisted listing, ...)
+WEBSITES_SYNC_MAX_BACKOFF = env.int("WEBSITES_SYNC_MAX_BACKOFF", default=7 * 24 * 3600)
 
 # ------------ logging/exception handling configurations ------------
 
@@ -151,6 +215,97 @@ CELERY_TIMEZONE = TIME_ZONE
 CELERY_TASK_TIME_LIMIT = env.int('CELERY_TASK_TIME_LIMIT')
 CELERY_BROKER_URL = env.str('REDIS_URL')
 CELERY_RESULT_BACKEND = env.str('REDIS_URL')
+# every stage of the website creation has its own queue, so that its workers can be scaled independently
+CELERY_TASK_ROUTES = {
+    "dashboard.tasks.scrap_listing": {"queue": "scraping"},
+    "dashboard.tasks.convert_listing": {"queue": "conversion"},
+    "dashboard.tasks.store_website_media": {"queue": "media"},
+    "dashboard.tasks.create_website": {"queue": "persistence"},
+    "dashboard.tasks.ingest_website_media": {"queue": "media"},
+    "dashboard.tasks.publish_website_pages": {"queue": "media"},
+    "dashboard.tasks.finalize_website": {"queue": "persistence"},
+    "dashboard.tasks.recover_website_media": {"queue": "persistence"},
+}
+CELERY_BEAT_SCHEDULE = {
+    "sync-stale-websites": {
+        "task": "dashboard.tasks.sync_stale_websites",
+        "schedule": WEBSITES_SYNC_INTERVAL,
+    },
+    "expire-pending-media": {
+        "task": "dashboard.tasks.expire_pending_media",
+        "schedule": WEBSITES_MEDIA_PENDING_TIMEOUT / 4,
+    },
+}
+
+# ------------ Cache configurations ------------
+
+USE_REDIS_CACHE = env.bool("USE_REDIS_CACHE", default=False)
+
+# raw data received from the scrapper are kept 24 hours by default
+SCRAPING_CACHE_TIMEOUT = env.int("SCRAPING_CACHE_TIMEOUT", default=24 * 3600)
+# maximum number of listings kept by the local memory cache.
+# With Redis, the eviction is done by the server according to its `maxmemory-policy` (allkeys-lru).
+SCRAPING_CACHE_MAX_ENTRIES = env.int("SCRAPING_CACHE_MAX_ENTRIES", default=100)
+# rendered website pages are kept 24 hours by default, or until the website changes (see websites/page_cache.py)
+WEBSITES_PAGES_CACHE_TIMEOUT = env.int("WEBSITES_PAGES_CACHE_TIMEOUT", default=24 * 3600)
+# duration (in seconds) the website pages are kept by a CDN, unless purged by their surrogate keys
+WEBSITES_PAGES_CDN_MAX_AGE = env.int("WEBSITES_PAGES_CDN_MAX_AGE", default=24 * 3600)
+# export the pages of the websites into static bundles in the public media storage (see websites/export.py)
+WEBSITES_EXPORT = env.bool("WEBSITES_EXPORT", default=True)
+# redirect the website pages to their static export, once exported
+WEBSITES_SERVE_EXPORTS = env.bool("WEBSITES_SERVE_EXPORTS", default=False)
+# number of websites rendered again by each task/process when the templates change
+WEBSITES_RERENDER_CHUNK_SIZE = env.int("WEBSITES_RERENDER_CHUNK_SIZE", default=50)
+
+# budget and locks of the periodic sync, and state of the circuit breakers (scrapper.resilience), shared by all the
+# processes: always on the Redis instance of the broker
+SYNC_CACHE = {
+    "BACKEND": "django.core.cache.backends.redis.RedisCache",
+    "LOCATION": env.str('REDIS_URL'),
+    "KEY_PREFIX": "sync",
+}
+if IS_TESTS_IN_PROGRESS:
+    # no Redis instance for the tests: a local memory cache stands for it
+    SYNC_CACHE = {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "sync"}
+
+if USE_REDIS_CACHE:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": env.str('REDIS_URL'),
+        },
+        "scrapper": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": env.str('REDIS_URL'),
+            "KEY_PREFIX": "scrapper",
+            "TIMEOUT": SCRAPING_CACHE_TIMEOUT,
+        },
+        "pages": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": env.str('REDIS_URL'),
+            "KEY_PREFIX": "pages",
+            "TIMEOUT": WEBSITES_PAGES_CACHE_TIMEOUT,
+        },
+        "sync": SYNC_CACHE,
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+        "scrapper": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "scrapper",
+            "TIMEOUT": SCRAPING_CACHE_TIMEOUT,
+            "OPTIONS": {"MAX_ENTRIES": SCRAPING_CACHE_MAX_ENTRIES},
+        },
+        # the pages are invalidated by the Celery workers: a local memory cache would keep
+        # serving them from the web processes, so they are not cached without Redis
+        "pages": {
+            "BACKEND": "django.core.cache.backends.dummy.DummyCache",
+        },
+        "sync": SYNC_CACHE,
+    }
 
 # ------------ Application definition ------------
 
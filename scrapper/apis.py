@@ -1,12 +1,27 @@
 import airbnb
+import heapq
 import logging
 import re
+import redis
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 
 from django.conf import settings
+from django.core.cache import caches
 
 from websites.utils import save_debug_data
 
+from .clients import ClientPool
+from .ratelimit import LocalTokenBucket, RateLimiter, RedisTokenBucket
+from .resilience import CircuitBreaker, call_with_retry, is_transient_error
+from .schema import At, Field, Items, Record, compile_schema
+
 REVIEWS_COUNT = 5
+# reviews are fetched page by page, until `REVIEWS_COUNT` reviews can be selected
+REVIEWS_PAGE_SIZE = 20
+REVIEWS_MAX_PAGES = 5
+
+AIRBNB_LOCALE = "fr"
+AIRBNB_CURRENCY = "EUR"
 
 _logger = logging.getLogger('scrapper')
 
@@ -15,182 +30,298 @@ _logger = logging.getLogger('scrapper')
 # ---------------------------------------------------------------
 
 
-def scrap_airbnb_data(id):
-    try:
-        api = airbnb.Api(
-            randomize=True,
-            api_key=settings.AIRBNB_API_KEY,
-            currency="EUR",
-            locale="fr",
-            country="fr",
-            language="fr-fr",
-            proxy=settings.SCRAPING_PROXY,
-        )
-        details = api.get_listing_details(id)
-        reviews = api.get_reviews(id)
+def _create_airbnb_api(api_key, proxy):
+    return airbnb.Api(
+        randomize=True,
+        api_key=api_key,
+        currency=AIRBNB_CURRENCY,
+        locale=AIRBNB_LOCALE,
+        country="fr",
+        language="fr-fr",
+        proxy=proxy,
+    )
 
-        # backup received data for debugging purpose
-        if settings.USE_DEBUG_DATA_STORAGE:  # pragma: no cover
-            save_debug_data(f"scrapper/{id}/details.json", details)
-            save_debug_data(f"scrapper/{id}/reviews.json", reviews)
 
-        return (details, reviews)
-    except Exception as e:
-        _logger.exception(str(e))
-        return None
+airbnb_clients = ClientPool(_create_airbnb_api)
 
 
-def _get_airbnb_name(data):
-    return data.get("p3_summary_title") if data else None
+def _get_scraping_credentials():
+    """ pair every api key with a proxy, the shortest list being repeated """
+    keys, proxies = settings.AIRBNB_API_KEYS, settings.SCRAPING_PROXIES
+    return [(keys[i % len(keys)], proxies[i % len(proxies)]) for i in range(max(len(keys), len(proxies)))]
 
 
-def _get_airbnb_host_info(data):
-    if not data or "primary_host" not in data:
-        return None
+def _create_rate_limiter():
+    if settings.USE_DISTRIBUTED_RATE_LIMIT:
+        bucket = RedisTokenBucket(
+            redis.Redis.from_url(settings.CELERY_BROKER_URL),
+            settings.SCRAPING_RATE_LIMIT,
+            settings.SCRAPING_RATE_LIMIT_BURST,
+            prefix="scrapper:ratelimit",
+        )
+    else:
+        bucket = LocalTokenBucket(settings.SCRAPING_RATE_LIMIT, settings.SCRAPING_RATE_LIMIT_BURST)
+    return RateLimiter(bucket, _get_scraping_credentials(), settings.SCRAPING_RATE_LIMIT_MAX_WAIT)
+
 
-    host_data = data["primary_host"]
-    return {
-        "name": host_data.get("name"),
-        "picture_url": host_data.get("picture_large_url"),
-        "description": host_data.get("about"),
-        "languages": host_data.get("languages"),
-    }
+airbnb_rate_limiter = _create_rate_limiter()
 
 
-def _get_airbnb_general_info(data):
-    def _extract_count(value):
-        v = re.split(r"\D+", value)[0] if value else 0
-        return v if v and v.isnumeric() else 0
+airbnb_circuit_breaker = CircuitBreaker(
+    "airbnb",
+    failure_threshold=settings.SCRAPING_CIRCUIT_FAILURE_THRESHOLD,
+    recovery_timeout=settings.SCRAPING_CIRCUIT_RECOVERY_TIMEOUT,
+)
 
-    return {
-        "bathroom_count": _extract_count(data.get("bathroom_label")),
-        "bed_count": _extract_count(data.get("bed_label")),
-        "bedroom_count": _extract_count(data.get("bedroom_label")),
-        "guest_count": _extract_count(data.get("guest_label")),
-    } if data is not None else None
 
+def _call_airbnb_api(credentials, method, *args):
+    """
+    call the Airbnb API `method` with a client (for `credentials`) taken from the pool.
+    The call is retried on transient errors, with new credentials taken from the rate limiter.
+    """
+    def _call(attempt):
+        with airbnb_clients.client(*(airbnb_rate_limiter.acquire() if attempt else credentials)) as api:
+            return getattr(api, method)(*args)
 
-def _get_airbnb_location(data):
-    return {
-        "title": data.get("location_title"),
-        "coords": {
-            "lat": data.get("lat"),
-            "lng": data.get("lng"),
-        },
-    } if data is not None else None
+    return call_with_retry(
+        _call,
+        retries=settings.SCRAPING_RETRIES,
+        base_delay=settings.SCRAPING_RETRY_BASE_DELAY,
+        max_delay=settings.SCRAPING_RETRY_MAX_DELAY,
+    )
 
 
-def _get_airbnb_photos(data):
-    if not data or "photos" not in data:
+def _call_concurrently(calls, timeout):
+    """
+    run every function of `calls` in its own thread and return their results in the same order.
+    All the calls share the same deadline (`timeout` seconds): as soon as one of them fails or
+    the deadline is reached, the pending calls are cancelled and an exception is raised.
+    """
+    executor = ThreadPoolExecutor(max_workers=len(calls))
+    try:
+        futures = [executor.submit(call) for call in calls]
+        done, not_done = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+        for future in futures:
+            if future in done and future.exception():
+                raise future.exception()
+        if not_done:
+            raise TimeoutError(f"provider calls not completed after {timeout}s")
+        return [future.result() for future in futures]
+    finally:
+        # threads already running can't be interrupted, their results are just ignored
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _fetch_airbnb_reviews(credentials, id):
+    """
+    get the reviews of the listing `id`, page by page.
+    The fetch stops as soon as enough reviews can be selected, when the last page is reached
+    or after `REVIEWS_MAX_PAGES` pages. Each new page takes new credentials from the rate limiter.
+    """
+    data = _call_airbnb_api(credentials, "get_reviews", id, 0, REVIEWS_PAGE_SIZE)
+    reviews = page = data.get("reviews") or []
+    selectable_count = sum(1 for review in page if _is_airbnb_review_selectable(review))
+
+    pages = 1
+    while selectable_count < REVIEWS_COUNT and len(page) == REVIEWS_PAGE_SIZE and pages < REVIEWS_MAX_PAGES:
+        page = _call_airbnb_api(
+            airbnb_rate_limiter.acquire(), "get_reviews", id, pages * REVIEWS_PAGE_SIZE, REVIEWS_PAGE_SIZE
+        ).get("reviews") or []
+        reviews = reviews + page
+        selectable_count += sum(1 for review in page if _is_airbnb_review_selectable(review))
+        pages += 1
+
+    _logger.info("reviews fetched {'id': %s, 'pages': %s, 'count': %s}", id, pages, len(reviews))
+    return data if pages == 1 else {**data, "reviews": reviews}
+
+
+def _get_cache_key(id):
+    return f"airbnb:{id}:{AIRBNB_LOCALE}:{AIRBNB_CURRENCY}"
+
+
+def scrap_airbnb_data(id, use_cache=True):
+    """
+    get the raw (details, reviews) data of the listing `id`.
+    Data already received for this listing are reused from the cache, unless `use_cache` is False.
+    """
+    cache = caches["scrapper"]
+    if use_cache:
+        data = cache.get(_get_cache_key(id))
+        if data:
+            _logger.info("scrapped data found in cache {'id': %s}", id)
+            return tuple(data)
+
+    # fail fast while the provider is down
+    if not airbnb_circuit_breaker.allow_request():
+        _logger.warning("provider unavailable, circuit is open {'id': %s}", id)
         return None
-    return [
-        {
-            "url": photo["large"].split("?")[0] if "large" in photo else None,
-            "caption": photo.get("caption")
-        }
-        for photo in data["photos"]
-    ]
 
+    try:
+        # wait for the rate limiter before the calls, it's not part of their deadline
+        details_credentials = airbnb_rate_limiter.acquire()
+        reviews_credentials = airbnb_rate_limiter.acquire()
+        details, reviews = _call_concurrently(
+            [
+                lambda: _call_airbnb_api(details_credentials, "get_listing_details", id),
+                lambda: _fetch_airbnb_reviews(reviews_credentials, id),
+            ],
+            timeout=settings.SCRAPING_TIMEOUT,
+        )
 
-def _get_airbnb_description(data):
-    if not data or "sectioned_description" not in data or "description" not in data["sectioned_description"]:
+        # backup received data for debugging purpose
+        if settings.USE_DEBUG_DATA_STORAGE:  # pragma: no cover
+            save_debug_data(f"scrapper/{id}/details.json", details)
+            save_debug_data(f"scrapper/{id}/reviews.json", reviews)
+    except Exception as e:
+        _logger.exception(str(e))
+        if is_transient_error(e) or isinstance(e, TimeoutError):
+            airbnb_circuit_breaker.record_failure()
         return None
 
-    return data["sectioned_description"]["description"].split("\n")
-
-
-def _get_airbnb_equipment_areas(data):
-    return [
-        {
-            "name": area["title"],
-            "equipments": [str(e) for e in area.get("amenity_ids", [])]
-        }
-        for area in data
-        if all(x in area for x in ["title", "amenity_ids"]) and area["amenity_ids"]
-    ] if data else []
-
-
-def _get_airbnb_equipments(data):
-    return {
-        str(eq["id"]): {
-            "name": eq["name"],
-            "description": eq["description"]
-        }
-        for eq in data
-        if all(x in eq for x in ["id", "name", "description"])
-    } if data else {}
-
-
-def _get_airbnb_equipments_per_area(data):
-    if not data or any(x not in data or not data[x] for x in ["see_all_amenity_sections", "listing_amenities"]):
-        return {}
-
-    return {
-        "areas": _get_airbnb_equipment_areas(data["see_all_amenity_sections"]),
-        "equipments": _get_airbnb_equipments(data["listing_amenities"]),
-    }
-
-
-def _get_airbnb_reviews(data):
-    def _to_date(d):
-        return d.split("T")[0]
-
-    return sorted(
-        [
-            {
-                "author_name": review["author"]["first_name"],
-                "author_picture_url": review["author"]["picture_url"],
-                "review": review["comments"],
-                "date": _to_date(review["created_at"]),
-                "language": review["language"],
-            }
-            for review in data
-            if all(x in review for x in ["author", "rating", "comments", "created_at", "language"])
-            and all(x in review["author"] for x in ["has_profile_pic", "first_name", "picture_url"])
-            and review["rating"] == 5
-        ],
-        key=lambda r: r["date"],
-        reverse=True,
-    )[:REVIEWS_COUNT] if data else []
-
-
-def _get_airbnb_prices(data):
-    return [
-        {
-            "label": price["label"],
-            "value": price["value"],
-        }
-        for price in data.get("price_details", [])
-        if all(x in price for x in ["label", "value"])
-    ] if data else []
-
-
-def _get_airbnb_highlights(data):
-    return [
-        {
-            "headline": highlight["headline"],
-            "message": highlight["message"]
-        }
-        for highlight in data.get("highlights", [])
-        if all(x in highlight for x in ["headline", "message"])
-    ] if data else []
-
-
-def _get_airbnb_house_rules(data):
-    if data and "guest_controls" in data and "structured_house_rules" in data["guest_controls"]:
-        return data["guest_controls"]["structured_house_rules"]
-    return []
-
-
-def _get_airbnb_rooms(data):
-    return [
-        {
-            "name": room["name_with_type"],
-            "details": room["highlights_hometour"],
-        }
-        for room in data.get("hometour_rooms", [])
-        if all(x in room for x in ["name_with_type", "highlights_hometour"])
-    ] if data else []
+    airbnb_circuit_breaker.record_success()
+    cache.set(_get_cache_key(id), (details, reviews))
+    return (details, reviews)
+
+
+def _extract_count(value):
+    v = re.split(r"\D+", value)[0] if value else 0
+    return v if v and v.isnumeric() else 0
+
+
+def _is_airbnb_review_selectable(review):
+    """ only five-star reviews with all the displayed information are selected """
+    return (
+        all(x in review for x in ["author", "rating", "comments", "created_at", "language"])
+        and all(x in review["author"] for x in ["has_profile_pic", "first_name", "picture_url"])
+        and review["rating"] == 5
+    )
+
+
+# schemas of the data extracted from the `pdp_listing_detail` payload
+
+AIRBNB_NAME = Field("p3_summary_title")
+
+AIRBNB_HOST_INFO = Record({
+    "name": Field("name"),
+    "picture_url": Field("picture_large_url"),
+    "description": Field("about"),
+    "languages": Field("languages"),
+}, path="primary_host")
+
+AIRBNB_GENERAL_INFO = Record({
+    "bathroom_count": Field("bathroom_label", convert=_extract_count, default=0),
+    "bed_count": Field("bed_label", convert=_extract_count, default=0),
+    "bedroom_count": Field("bedroom_label", convert=_extract_count, default=0),
+    "guest_count": Field("guest_label", convert=_extract_count, default=0),
+})
+
+AIRBNB_LOCATION = Record({
+    "title": Field("location_title"),
+    "coords": Record({
+        "lat": Field("lat"),
+        "lng": Field("lng"),
+    }),
+})
+
+AIRBNB_PHOTOS = Items(Record({
+    "url": Field("large", convert=lambda url: url.split("?")[0]),
+    "caption": Field("caption"),
+}), path="photos")
+
+AIRBNB_DESCRIPTION = Field("sectioned_description.description", convert=lambda d: d.split("\n"))
+
+AIRBNB_EQUIPMENT_AREAS = Items(
+    Record({
+        "name": Field("title"),
+        "equipments": Field("amenity_ids", convert=lambda ids: [str(e) for e in ids]),
+    }),
+    required=["title", "amenity_ids"],
+    where=lambda area: area["amenity_ids"],
+    default=[],
+)
+
+AIRBNB_EQUIPMENTS = Items(
+    Record({
+        "name": Field("name"),
+        "description": Field("description"),
+    }),
+    required=["id", "name", "description"],
+    key=lambda eq: str(eq["id"]),
+    default={},
+)
+
+AIRBNB_EQUIPMENTS_PER_AREA = Record(
+    {
+        "areas": At("see_all_amenity_sections", AIRBNB_EQUIPMENT_AREAS),
+        "equipments": At("listing_amenities", AIRBNB_EQUIPMENTS),
+    },
+    where=lambda data: data.get("see_all_amenity_sections") and data.get("listing_amenities"),
+    default={},
+)
+
+AIRBNB_PRICES = Items(Record({
+    "label": Field("label"),
+    "value": Field("value"),
+}), path="price_details", required=["label", "value"], default=[])
+
+AIRBNB_HIGHLIGHTS = Items(Record({
+    "headline": Field("headline"),
+    "message": Field("message"),
+}), path="highlights", required=["headline", "message"], default=[])
+
+AIRBNB_HOUSE_RULES = Field("guest_controls.structured_house_rules", default=[])
+
+AIRBNB_ROOMS = Items(Record({
+    "name": Field("name_with_type"),
+    "details": Field("highlights_hometour"),
+}), path="hometour_rooms", required=["name_with_type", "highlights_hometour"], default=[])
+
+# schema of the data extracted from the `reviews` payload
+
+AIRBNB_REVIEWS = Items(
+    Record({
+        "author_name": Field("author.first_name"),
+        "author_picture_url": Field("author.picture_url"),
+        "review": Field("comments"),
+        "date": Field("created_at", convert=lambda d: d.split("T")[0]),
+        "language": Field("language"),
+    }),
+    where=_is_airbnb_review_selectable,
+    # keep the `REVIEWS_COUNT` most recent reviews without sorting all of them
+    select=lambda reviews: heapq.nlargest(REVIEWS_COUNT, reviews, key=lambda r: r["date"]),
+    default=[],
+)
+
+AIRBNB_DATA = Record({
+    "name": At("details", AIRBNB_NAME),
+    "general_info": At("details", AIRBNB_GENERAL_INFO),
+    "host": At("details", AIRBNB_HOST_INFO),
+    "location": At("details", AIRBNB_LOCATION),
+    "photos": At("details", AIRBNB_PHOTOS),
+    "description": At("details", AIRBNB_DESCRIPTION),
+    "equipments": At("details", AIRBNB_EQUIPMENTS_PER_AREA),
+    "reviews": At("reviews", AIRBNB_REVIEWS),
+    "prices": At("details", AIRBNB_PRICES),
+    "highlights": At("details", AIRBNB_HIGHLIGHTS),
+    "house_rules": At("details", AIRBNB_HOUSE_RULES),
+    "rooms": At("details", AIRBNB_ROOMS),
+})
+
+_get_airbnb_name = compile_schema(AIRBNB_NAME, "name")
+_get_airbnb_host_info = compile_schema(AIRBNB_HOST_INFO, "host")
+_get_airbnb_general_info = compile_schema(AIRBNB_GENERAL_INFO, "general_info")
+_get_airbnb_location = compile_schema(AIRBNB_LOCATION, "location")
+_get_airbnb_photos = compile_schema(AIRBNB_PHOTOS, "photos")
+_get_airbnb_description = compile_schema(AIRBNB_DESCRIPTION, "description")
+_get_airbnb_equipment_areas = compile_schema(AIRBNB_EQUIPMENT_AREAS, "equipments.areas")
+_get_airbnb_equipments = compile_schema(AIRBNB_EQUIPMENTS, "equipments.equipments")
+_get_airbnb_equipments_per_area = compile_schema(AIRBNB_EQUIPMENTS_PER_AREA, "equipments")
+_get_airbnb_reviews = compile_schema(AIRBNB_REVIEWS, "reviews")
+_get_airbnb_prices = compile_schema(AIRBNB_PRICES, "prices")
+_get_airbnb_highlights = compile_schema(AIRBNB_HIGHLIGHTS, "highlights")
+_get_airbnb_house_rules = compile_schema(AIRBNB_HOUSE_RULES, "house_rules")
+_get_airbnb_rooms = compile_schema(AIRBNB_ROOMS, "rooms")
+_extract_airbnb_data = compile_schema(AIRBNB_DATA)
 
 
 def _validate_data(data):
@@ -198,34 +329,42 @@ def _validate_data(data):
     return data if data and all(data.get(f) for f in mandatory_fields) else None
 
 
-def convert_airbnb_data(data):
+def _get_airbnb_payload(data):
+    details, reviews = data
+    return {"details": details["pdp_listing_detail"], "reviews": reviews["reviews"]}
+
+
+def convert_airbnb_data(data, missing=None):
+    """
+    convert the raw (details, reviews) `data` of a listing.
+    If `missing` is a set, the names of the fields missing in `data` are added to it.
+    """
     try:
-        details, reviews = data
-        details = details["pdp_listing_detail"]
-        reviews = reviews["reviews"]
-
-        data = {
-            "name": _get_airbnb_name(details),
-            "general_info": _get_airbnb_general_info(details),
-            "host": _get_airbnb_host_info(details),
-            "location": _get_airbnb_location(details),
-            "photos": _get_airbnb_photos(details),
-            "description": _get_airbnb_description(details),
-            "equipments": _get_airbnb_equipments_per_area(details),
-            "reviews": _get_airbnb_reviews(reviews),
-            "prices": _get_airbnb_prices(details),
-            "highlights": _get_airbnb_highlights(details),
-            "house_rules": _get_airbnb_house_rules(details),
-            "rooms": _get_airbnb_rooms(details),
-        }
-        return _validate_data(data)
+        return _validate_data(_extract_airbnb_data(_get_airbnb_payload(data), missing))
     except Exception:
         return None
 
 
-def scrap_and_convert(airbnb_id):
+def convert_airbnb_data_batch(data_list):
+    """
+    convert the raw (details, reviews) data of several listings in one pass.
+    Returns the list of converted data (None for invalid data) and, for each missing field,
+    the number of listings missing it.
+    """
+    payloads = []
+    for data in data_list:
+        try:
+            payloads.append(_get_airbnb_payload(data))
+        except Exception:
+            payloads.append(None)
+
+    results, missing_counts = _extract_airbnb_data.batch(payloads)
+    return [_validate_data(result) for result in results], missing_counts
+
+
+def scrap_and_convert(airbnb_id, use_cache=True):
     _logger.info("scrap airbnb data {'id': %s}", airbnb_id)
-    airbnb_data = scrap_airbnb_data(airbnb_id)
+    airbnb_data = scrap_airbnb_data(airbnb_id, use_cache=use_cache)
     if not airbnb_data:
         return None
 
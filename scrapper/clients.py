@@ -0,0 +1,70 @@
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+MAX_IDLE_CLIENTS = 4
+
+_logger = logging.getLogger('scrapper')
+
+
+def get_proxy_host(proxy):
+    """ host (and port) of the `proxy` url, without its credentials: the only part that can be logged """
+    if not proxy:
+        return None
+    url = urlsplit(proxy if "//" in proxy else f"//{proxy}")
+    return f"{url.hostname}:{url.port}" if url.port else url.hostname
+
+
+class ClientPool:
+    """
+    Process-wide pool of API clients.
+
+    Reusing a client keeps its HTTP session, and so the TLS/proxy connections it holds,
+    from one scrape to another. Clients are grouped by credentials (api key, proxy), so
+    rotating the credentials just makes the pool create clients for the new ones.
+    A client used by a failing call is dropped instead of being put back in the pool
+    (its session may be broken or its credentials revoked).
+    After a fork (Celery prefork pool), the child process starts with an empty pool:
+    sessions must not be shared between processes.
+    """
+
+    def __init__(self, factory, max_idle=MAX_IDLE_CLIENTS):
+        self._factory = factory
+        self._max_idle = max_idle
+        self.reset()
+        os.register_at_fork(after_in_child=self.reset)
+
+    def reset(self):
+        """ drop all the idle clients """
+        self._lock = threading.Lock()
+        self._idle = {}
+
+    def _acquire(self, credentials):
+        with self._lock:
+            idle = self._idle.get(credentials)
+            if idle:
+                return idle.pop()
+        _logger.info("create a new API client {'proxy': %s}", get_proxy_host(credentials[1]))
+        return self._factory(*credentials)
+
+    def _release(self, credentials, client):
+        with self._lock:
+            idle = self._idle.setdefault(credentials, [])
+            if len(idle) < self._max_idle:
+                idle.append(client)
+
+    @contextmanager
+    def client(self, api_key, proxy=None):
+        """
+        get a client for the given credentials, for the duration of the `with` block.
+
+        with pool.client(api_key, proxy) as api:
+            api.get_listing_details(id)
+        """
+        credentials = (api_key, proxy)
+        client = self._acquire(credentials)
+        yield client
+        # only reached when the block succeeded
+        self._release(credentials, client)
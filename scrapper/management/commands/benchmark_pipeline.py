@@ -0,0 +1,120 @@
+import json
+import shutil
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import override_settings
+
+from scrapper.apis import convert_airbnb_data
+from scrapper.replay import MediaServer, list_recorded_listings, load_listing, rewrite_media_urls
+from websites.models import Website
+from websites.utils import count_queries
+
+STAGES = ["replay", "convert", "create"]
+
+
+@contextmanager
+def _measure(measures, stage):
+    """ measure the duration, the SQL queries and the peak of memory allocated by the `with` block """
+    tracemalloc.reset_peak()
+    memory = tracemalloc.get_traced_memory()[0]
+    with count_queries() as queries:
+        start = time.perf_counter()
+        yield
+        duration = time.perf_counter() - start
+    measures[stage].append({
+        "duration": duration,
+        "queries": queries.count,
+        "memory": tracemalloc.get_traced_memory()[1] - memory,
+    })
+
+
+def _summarize(measures):
+    return {
+        stage: {
+            "runs": len(values),
+            "median_ms": statistics.median(v["duration"] for v in values) * 1000,
+            "max_ms": max(v["duration"] for v in values) * 1000,
+            "queries": max(v["queries"] for v in values),
+            "peak_memory_kb": max(v["memory"] for v in values) / 1024,
+        }
+        for stage, values in measures.items() if values
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay the listings of a corpus (see record_listings) through the scrap-to-website pipeline "
+        "and report the latency, SQL queries and peak memory of each stage"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--corpus", required=True, help="directory of the corpus")
+        parser.add_argument("--repeat", type=int, default=3, help="number of runs per listing")
+        parser.add_argument("--username", default="benchmark", help="owner of the generated websites")
+        parser.add_argument("--json", action="store_true", help="print the report as JSON")
+
+    def handle(self, *args, **options):
+        listing_ids = list_recorded_listings(options["corpus"])
+        if not listing_ids:
+            raise CommandError(f"no recorded listing in '{options['corpus']}'")
+
+        measures = {stage: [] for stage in STAGES}
+
+        # the benchmark leaves nothing behind: the websites and their owner are created in a transaction
+        # rolled back at the end, and their media files are stored in a temporary directory
+        media_root = tempfile.mkdtemp()
+        local_storage = override_settings(
+            MEDIA_ROOT=media_root,
+            DEFAULT_FILE_STORAGE="django.core.files.storage.FileSystemStorage",
+            USE_DEBUG_DATA_STORAGE=False,
+        )
+        tracemalloc.start()
+        try:
+            with local_storage, transaction.atomic():
+                user, _ = get_user_model().objects.get_or_create(username=options["username"])
+                with MediaServer(options["corpus"]) as server:
+                    for _ in range(options["repeat"]):
+                        for listing_id in listing_ids:
+                            self._run(server, user, listing_id, measures)
+                transaction.set_rollback(True)
+        finally:
+            tracemalloc.stop()
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        report = _summarize(measures)
+        if options["json"]:
+            self.stdout.write(json.dumps(report, indent=2))
+            return
+
+        self.stdout.write(f"{len(listing_ids)} listing(s), {options['repeat']} run(s)")
+        self.stdout.write(f"{'stage':<10}{'median ms':>12}{'max ms':>12}{'queries':>10}{'peak KB':>12}")
+        for stage, values in report.items():
+            self.stdout.write(
+                f"{stage:<10}{values['median_ms']:>12.1f}{values['max_ms']:>12.1f}"
+                f"{values['queries']:>10}{values['peak_memory_kb']:>12.0f}"
+            )
+
+    def _run(self, server, user, listing_id, measures):
+        with _measure(measures, "replay"):
+            airbnb_data, media_index = load_listing(server.corpus_dir, listing_id)
+            airbnb_data = rewrite_media_urls(airbnb_data, media_index, server.base_url)
+
+        with _measure(measures, "convert"):
+            data = convert_airbnb_data(airbnb_data)
+        if not data:
+            raise CommandError(f"{listing_id}: unable to convert the recorded data")
+
+        with _measure(measures, "create"):
+            website = Website.create(user.id, f"https://www.airbnb.fr/rooms/{listing_id}", data)
+        if not website:
+            raise CommandError(f"{listing_id}: unable to create a website from the converted data")
+
+        # the generated website is only needed for the measures
+        website.delete()
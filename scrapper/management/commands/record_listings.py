@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from scrapper.apis import convert_airbnb_data, scrap_airbnb_data
+from scrapper.replay import get_media_urls, record_listing
+
+
+class Command(BaseCommand):
+    help = "Record the provider data and media files of Airbnb listings in a corpus, to replay them offline"
+
+    def add_arguments(self, parser):
+        parser.add_argument("airbnb_ids", nargs="+", help="ids of the Airbnb listings to record")
+        parser.add_argument("--corpus", required=True, help="directory of the corpus")
+
+    def handle(self, *args, **options):
+        failures = 0
+        for airbnb_id in options["airbnb_ids"]:
+            airbnb_data = scrap_airbnb_data(airbnb_id, use_cache=False)
+            data = convert_airbnb_data(airbnb_data) if airbnb_data else None
+            if not data:
+                self.stderr.write(f"{airbnb_id}: unable to scrap the listing")
+                failures += 1
+                continue
+
+            count = record_listing(options["corpus"], airbnb_id, airbnb_data, get_media_urls(data))
+            self.stdout.write(f"{airbnb_id}: recorded with {count} media files")
+
+        if failures:
+            raise CommandError(f"{failures} listing(s) not recorded")
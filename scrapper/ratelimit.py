@@ -0,0 +1,121 @@
+import hashlib
+import itertools
+import logging
+import threading
+import time
+
+_logger = logging.getLogger('scrapper')
+
+# atomically refill the bucket stored in KEYS[1] and take one token if available.
+# Returns the time (in seconds) to wait before a token is available, "0" if one has been taken.
+# The Redis server time is used so that workers with drifting clocks share the same bucket.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'timestamp')
+local tokens = tonumber(state[1]) or capacity
+local timestamp = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - timestamp) * rate)
+
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'timestamp', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return tostring(wait)
+"""
+
+
+class RateLimitExceeded(Exception):
+    pass
+
+
+class LocalTokenBucket:
+    """
+    Token buckets kept in the memory of the current process.
+    Used by the tests and the development environment.
+    """
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def try_acquire(self, name):
+        """ take a token from the bucket `name`, returns the time to wait if no token is available """
+        with self._lock:
+            now = self._clock()
+            tokens, timestamp = self._buckets.get(name, (self.capacity, now))
+            tokens = min(self.capacity, tokens + max(0, now - timestamp) * self.rate)
+            wait = 0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / self.rate
+            self._buckets[name] = (tokens, now)
+            return wait
+
+
+class RedisTokenBucket:
+    """ Token buckets stored in Redis, shared by all the workers """
+
+    def __init__(self, client, rate, capacity, prefix="ratelimit"):
+        self.rate = rate
+        self.capacity = capacity
+        self._prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    def try_acquire(self, name):
+        """ take a token from the bucket `name`, returns the time to wait if no token is available """
+        return float(self._script(keys=[f"{self._prefix}:{name}"], args=[self.rate, self.capacity]))
+
+
+class RateLimiter:
+    """
+    Rate limiter spreading the provider calls over a set of credentials (api key, proxy),
+    each of them having its own token bucket.
+
+    `acquire` goes through the credentials in turn and returns the first ones having
+    an available token. If all the buckets are empty, it waits for the next token instead
+    of failing, up to `max_wait` seconds.
+    """
+
+    def __init__(self, bucket, credentials, max_wait, sleep=time.sleep, clock=time.monotonic):
+        self._bucket = bucket
+        self._credentials = credentials
+        self._max_wait = max_wait
+        self._sleep = sleep
+        self._clock = clock
+        self._rotation = itertools.count()
+
+    def _bucket_name(self, credentials):
+        # stable name which does not expose the credentials
+        return hashlib.sha1(repr(credentials).encode("utf-8")).hexdigest()
+
+    def acquire(self):
+        """ wait for a token and return the credentials (api key, proxy) to use """
+        deadline = self._clock() + self._max_wait
+        while True:
+            start = next(self._rotation)
+            waits = []
+            for i in range(len(self._credentials)):
+                credentials = self._credentials[(start + i) % len(self._credentials)]
+                wait = self._bucket.try_acquire(self._bucket_name(credentials))
+                if not wait:
+                    return credentials
+                waits.append(wait)
+
+            remaining = deadline - self._clock()
+            if remaining <= 0:
+                raise RateLimitExceeded(f"no token available after {self._max_wait}s")
+            _logger.info("rate limit reached, wait %.2fs", min(waits))
+            self._sleep(min(min(waits), remaining))
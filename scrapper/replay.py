@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import shutil
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+from websites.utils import download_media_file, get_extension_from_url
+
+_logger = logging.getLogger('scrapper')
+
+# a corpus contains one directory per recorded listing, with the same layout as the debug data:
+#   <corpus>/<id>/details.json
+#   <corpus>/<id>/reviews.json
+#   <corpus>/<id>/media.json   => {media url: media file path, relative to the corpus}
+#   <corpus>/<id>/media/<sha1 of the url><extension>
+DETAILS_FILENAME = "details.json"
+REVIEWS_FILENAME = "reviews.json"
+MEDIA_INDEX_FILENAME = "media.json"
+MEDIA_DIRNAME = "media"
+
+
+def get_media_urls(data):
+    """ get the urls of all the media files (photos, host and review pictures) of converted listing `data` """
+    urls = [photo["url"] for photo in data.get("photos") or [] if photo.get("url")]
+    if data.get("host") and data["host"].get("picture_url"):
+        urls.append(data["host"]["picture_url"])
+    urls += [review["author_picture_url"] for review in data.get("reviews") or [] if review.get("author_picture_url")]
+    return list(dict.fromkeys(urls))
+
+
+def _write_json(path, data):
+    path.write_text(json.dumps(data, indent=2), encoding="utf-8")
+
+
+def _read_json(path):
+    return json.loads(path.read_text(encoding="utf-8"))
+
+
+def _record_media_file(corpus_dir, listing_dir, url):
+    """ download the media file at `url` in the listing directory, returns its path relative to the corpus """
+    name = hashlib.sha1(url.encode("utf-8")).hexdigest() + get_extension_from_url(url)
+    path = listing_dir / MEDIA_DIRNAME / name
+    media_file = download_media_file(url, name)
+    if not media_file:
+        return None
+    with media_file, path.open("wb") as f:
+        shutil.copyfileobj(media_file, f)
+    return str(path.relative_to(corpus_dir))
+
+
+def record_listing(corpus_dir, id, airbnb_data, media_urls):
+    """
+    record the raw (details, reviews) `airbnb_data` of the listing `id` and
+    the media files at `media_urls` in the corpus directory `corpus_dir`.
+    Returns the number of recorded media files.
+    """
+    corpus_dir = Path(corpus_dir)
+    listing_dir = corpus_dir / str(id)
+    (listing_dir / MEDIA_DIRNAME).mkdir(parents=True, exist_ok=True)
+
+    details, reviews = airbnb_data
+    _write_json(listing_dir / DETAILS_FILENAME, details)
+    _write_json(listing_dir / REVIEWS_FILENAME, reviews)
+
+    media_index = {}
+    for url in media_urls:
+        path = _record_media_file(corpus_dir, listing_dir, url)
+        if path:
+            media_index[url] = path
+        else:
+            _logger.warning("unable to record the media file {'url': %s}", url)
+    _write_json(listing_dir / MEDIA_INDEX_FILENAME, media_index)
+    return len(media_index)
+
+
+def list_recorded_listings(corpus_dir):
+    """ get the ids of the listings recorded in `corpus_dir` """
+    return sorted(
+        path.parent.name
+        for path in Path(corpus_dir).glob(f"*/{DETAILS_FILENAME}")
+        if (path.parent / REVIEWS_FILENAME).exists()
+    )
+
+
+def load_listing(corpus_dir, id):
+    """ get the recorded (details, reviews) data and media index of the listing `id` """
+    listing_dir = Path(corpus_dir) / str(id)
+    media_index_path = listing_dir / MEDIA_INDEX_FILENAME
+    return (
+        (_read_json(listing_dir / DETAILS_FILENAME), _read_json(listing_dir / REVIEWS_FILENAME)),
+        _read_json(media_index_path) if media_index_path.exists() else {},
+    )
+
+
+def rewrite_media_urls(data, media_index, base_url):
+    """
+    replace, in the raw `data`, the urls of the recorded media files by their url on the media server.
+    Photo urls are recorded without their query string (it's dropped by the conversion).
+    """
+    if isinstance(data, dict):
+        return {key: rewrite_media_urls(value, media_index, base_url) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return type(data)(rewrite_media_urls(value, media_index, base_url) for value in data)
+    if isinstance(data, str):
+        path = media_index.get(data) or media_index.get(data.split("?")[0])
+        return f"{base_url}/{path}" if path else data
+    return data
+
+
+class _QuietRequestHandler(SimpleHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MediaServer:
+    """
+    Local HTTP server serving the media files of a corpus, on a free port of the loopback interface.
+
+    with MediaServer(corpus_dir) as server:
+        data = rewrite_media_urls(data, media_index, server.base_url)
+    """
+
+    def __init__(self, corpus_dir):
+        self.corpus_dir = corpus_dir
+        self._server = ThreadingHTTPServer(
+            ("127.0.0.1", 0),
+            partial(_QuietRequestHandler, directory=str(corpus_dir)),
+        )
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
@@ -0,0 +1,102 @@
+import logging
+import random
+import time
+
+import requests
+from django.core.cache import caches
+
+_logger = logging.getLogger('scrapper')
+
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+
+
+def is_transient_error(exception):
+    """
+    indicates if `exception` is a transient provider error (network error, throttling,
+    server error) worth a retry. Other errors (invalid listing, bad data, ...) are fatal.
+    """
+    if isinstance(exception, requests.exceptions.HTTPError):
+        response = exception.response
+        return response is not None and response.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(exception, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+def call_with_retry(func, retries, base_delay, max_delay, sleep=time.sleep):
+    """
+    call `func` (with the attempt number, starting at 0) and retry it up to `retries` times
+    when it fails with a transient error.
+    Retries are delayed with an exponential backoff and a "full jitter":
+    a random delay between 0 and min(max_delay, base_delay * 2^attempt).
+    """
+    for attempt in range(retries + 1):
+        try:
+            return func(attempt)
+        except Exception as e:
+            if attempt >= retries or not is_transient_error(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            _logger.warning("transient error (%s), retry in %.2fs", type(e).__name__, delay)
+            sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker shared by all the processes (web and workers) through the cache `cache_alias`,
+    always on Redis: a local memory cache would keep a state per process.
+
+    - closed: calls are allowed, consecutive failures are counted.
+    - open: after `failure_threshold` consecutive failures, calls are rejected
+      for `recovery_timeout` seconds.
+    - half-open: once the recovery timeout is over, a single call is allowed to probe
+      the provider: a success closes the circuit, a failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, name, failure_threshold, recovery_timeout, cache_alias="sync", clock=time.time):
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self._cache_alias = cache_alias
+        self._clock = clock
+        self._failures_key = f"circuit:{name}:failures"
+        self._opened_key = f"circuit:{name}:opened_at"
+        self._probe_key = f"circuit:{name}:probe"
+
+    @property
+    def _cache(self):
+        return caches[self._cache_alias]
+
+    @property
+    def state(self):
+        opened_at = self._cache.get(self._opened_key)
+        if opened_at is None:
+            return self.CLOSED
+        if self._clock() - opened_at < self.recovery_timeout:
+            return self.OPEN
+        return self.HALF_OPEN
+
+    def allow_request(self):
+        state = self.state
+        if state == self.HALF_OPEN:
+            # only one process gets the right to probe the provider
+            return self._cache.add(self._probe_key, True, timeout=self.recovery_timeout)
+        return state == self.CLOSED
+
+    def record_success(self):
+        if self._cache.get(self._opened_key) is not None:
+            _logger.info("circuit closed {'circuit': %s}", self._opened_key)
+        self._cache.delete_many([self._failures_key, self._opened_key, self._probe_key])
+
+    def record_failure(self):
+        if self.state == self.HALF_OPEN:
+            failures = self.failure_threshold
+        else:
+            self._cache.add(self._failures_key, 0, timeout=None)
+            failures = self._cache.incr(self._failures_key)
+
+        if failures >= self.failure_threshold:
+            _logger.warning("circuit opened {'circuit': %s}", self._opened_key)
+            self._cache.set(self._opened_key, self._clock(), timeout=None)
+            self._cache.delete(self._probe_key)
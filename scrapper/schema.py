@@ -0,0 +1,231 @@
+"""
+Declarative extraction schemas.
+
+A schema describes how to build the converted data from a provider payload:
+
+    HOST = Record({
+        "name": Field("name"),
+        "picture_url": Field("picture_large_url"),
+    }, path="primary_host")
+
+and is compiled once, with `compile_schema`, into nested closures: paths are split, defaults
+and sub-schemas are resolved at compile time, so converting a payload only walks it once.
+The names of the fields missing in the payload are collected while extracting the data.
+"""
+from collections import Counter
+
+MISSING = object()
+
+
+def _compile_path(path):
+    """ compile a dotted `path` into a function getting its value in nested dicts (or MISSING) """
+    if not path:
+        return lambda data: data
+
+    keys = tuple(path.split("."))
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda data: data.get(key, MISSING) if isinstance(data, dict) else MISSING
+
+    def _get(data):
+        for key in keys:
+            if not isinstance(data, dict) or key not in data:
+                return MISSING
+            data = data[key]
+        return data
+    return _get
+
+
+def _compile_default(default):
+    """ mutable defaults are copied, so that they are never shared between converted data """
+    if isinstance(default, (list, dict)):
+        return lambda: type(default)(default)
+    return lambda: default
+
+
+def _report_missing(missing, name):
+    if missing is not None and name:
+        missing.add(name)
+
+
+def _child_name(name, key):
+    return f"{name}.{key}" if name else key
+
+
+class Field:
+    """
+    value at `path`, optionally converted with `convert`.
+    `default` is used when the path is missing.
+    """
+
+    def __init__(self, path, convert=None, default=None):
+        self.path = path
+        self.convert = convert
+        self.default = default
+
+    def compile(self, name):
+        get = _compile_path(self.path)
+        convert = self.convert
+        default = _compile_default(self.default)
+
+        def _extract(data, missing):
+            value = get(data)
+            if value is MISSING:
+                _report_missing(missing, name)
+                return default()
+            return convert(value) if convert else value
+        return _extract
+
+
+class Record:
+    """
+    dict built from `fields` (a dict of output name => schema), applied on the value at `path`.
+    `default` is used when the value is missing, not a dict, or doesn't satisfy the `where` predicate.
+    """
+
+    def __init__(self, fields, path=None, where=None, default=None):
+        self.fields = fields
+        self.path = path
+        self.where = where
+        self.default = default
+
+    def compile(self, name):
+        get = _compile_path(self.path) if self.path else None
+        where = self.where
+        default = _compile_default(self.default)
+        extracts = tuple((key, schema.compile(_child_name(name, key))) for key, schema in self.fields.items())
+
+        def _extract(data, missing):
+            if get:
+                data = get(data)
+            if not isinstance(data, dict) or (where and not where(data)):
+                _report_missing(missing, name)
+                return default()
+            return {key: extract(data, missing) for key, extract in extracts}
+        return _extract
+
+
+class Items:
+    """
+    list built by applying the `item` schema on each dict of the list at `path`.
+
+    - `required`: paths which must be present in an item to keep it,
+    - `where`: predicate an item must satisfy to be kept,
+    - `key`: if set, a dict {key(item): item} is built instead of a list,
+    - `select`: function applied on the built list (or dict), e.g. to keep the best items.
+
+    `default` is used when the list is missing or None.
+    """
+
+    def __init__(self, item, path=None, required=(), where=None, key=None, select=None, default=None):
+        self.item = item
+        self.path = path
+        self.required = required
+        self.where = where
+        self.key = key
+        self.select = select
+        self.default = default
+
+    def compile(self, name):
+        get = _compile_path(self.path)
+        item_extract = self.item.compile(name)
+        required_keys = frozenset(path for path in self.required if "." not in path)
+        required_paths = tuple(_compile_path(path) for path in self.required if "." in path)
+        where = self.where
+        key = self.key
+        select = self.select
+        default = _compile_default(self.default)
+
+        # the conditions checked on every item are combined at compile time
+        conditions = [get_path for get_path in required_paths]
+        if where:
+            conditions.append(where)
+        if not conditions:
+            check = None
+        elif len(conditions) == 1 and where:
+            check = where
+        else:
+            def check(item):
+                return (
+                    all(get_path(item) is not MISSING for get_path in required_paths)
+                    and (not where or where(item))
+                )
+
+        def _select_items(items):
+            if check:
+                return (
+                    item for item in items
+                    if isinstance(item, dict) and required_keys <= item.keys() and check(item)
+                )
+            return (item for item in items if isinstance(item, dict) and required_keys <= item.keys())
+
+        def _extract(data, missing):
+            items = get(data)
+            if items is MISSING or items is None:
+                _report_missing(missing, name)
+                return default()
+
+            if key:
+                result = {key(item): item_extract(item, missing) for item in _select_items(items)}
+            else:
+                result = [item_extract(item, missing) for item in _select_items(items)]
+            return select(result) if select else result
+        return _extract
+
+
+class At:
+    """ apply the `schema` on the value at `path` (None if missing) """
+
+    def __init__(self, path, schema):
+        self.path = path
+        self.schema = schema
+
+    def compile(self, name):
+        get = _compile_path(self.path)
+        extract = self.schema.compile(name)
+
+        def _extract(data, missing):
+            data = get(data)
+            return extract(None if data is MISSING else data, missing)
+        return _extract
+
+
+class CompiledSchema:
+    """
+    schema compiled into an extractor.
+
+    extract = compile_schema(schema)
+    data = extract(payload)
+
+    missing = set()
+    data = extract(payload, missing)  # missing => names of the fields missing in the payload
+    """
+
+    def __init__(self, schema, name=""):
+        self._extract = schema.compile(name)
+
+    def __call__(self, data, missing=None):
+        return self._extract(data, missing)
+
+    def batch(self, payloads):
+        """
+        extract the data of all the `payloads`.
+        Returns the list of extracted data (None for a payload which can't be extracted) and,
+        for each missing field, the number of payloads missing it.
+        """
+        extract = self._extract
+        results = []
+        missing_counts = Counter()
+        for payload in payloads:
+            missing = set()
+            try:
+                results.append(extract(payload, missing))
+            except Exception:
+                results.append(None)
+                continue
+            missing_counts.update(missing)
+        return results, missing_counts
+
+
+def compile_schema(schema, name=""):
+    return CompiledSchema(schema, name)
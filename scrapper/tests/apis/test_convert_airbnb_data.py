@@ -1,7 +1,7 @@
 from parameterized import parameterized
 from unittest import TestCase
 
-from scrapper.apis import convert_airbnb_data
+from scrapper.apis import convert_airbnb_data, convert_airbnb_data_batch
 
 from .common import full_input_details, full_input_reviews, full_converted_data
 
@@ -25,3 +25,26 @@ class ConvertTestCase(TestCase):
     def test_returns_none_on_invalid_input_data(self, input_data, expected_data):
         response = convert_airbnb_data(input_data)
         self.assertEqual(response, expected_data)
+
+    def test_reports_missing_fields(self):
+        details = {"pdp_listing_detail": full_input_details["pdp_listing_detail"] | {"highlights": None}}
+        del details["pdp_listing_detail"]["primary_host"]
+        full_missing = set()
+        missing = set()
+
+        convert_airbnb_data((full_input_details, full_input_reviews), full_missing)
+        response = convert_airbnb_data((details, full_input_reviews), missing)
+
+        self.assertEqual(response, full_converted_data | {"host": None, "highlights": []})
+        self.assertEqual(missing - full_missing, {"host", "highlights"})
+
+    def test_converts_a_batch(self):
+        responses, missing_counts = convert_airbnb_data_batch([
+            (full_input_details, full_input_reviews),
+            ({}, {}),
+            ({"pdp_listing_detail": {}}, {"reviews": {}}),
+            (full_input_details, {"reviews": []}),
+        ])
+
+        self.assertEqual(responses, [full_converted_data, None, None, full_converted_data | {"reviews": []}])
+        self.assertEqual(missing_counts["name"], 1)
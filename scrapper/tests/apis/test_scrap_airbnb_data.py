@@ -1,14 +1,58 @@
 import logging
+import threading
+import time
 from unittest import TestCase
 from unittest.mock import patch
 
 from django.conf import settings
+from django.core.cache import caches
+from django.test import override_settings
 
-from scrapper.apis import scrap_airbnb_data
+import requests
+from scrapper.apis import (
+    REVIEWS_COUNT,
+    REVIEWS_MAX_PAGES,
+    REVIEWS_PAGE_SIZE,
+    _create_rate_limiter,
+    _get_scraping_credentials,
+    airbnb_circuit_breaker,
+    airbnb_clients,
+    scrap_airbnb_data,
+)
+
+
+def _review(rating=5):
+    return {
+        "author": {"has_profile_pic": True, "first_name": "name", "picture_url": "url"},
+        "rating": rating,
+        "comments": "comments",
+        "created_at": "2020-01-01T00:00:00Z",
+        "language": "fr",
+    }
+
+
+def _reviews_page(*ratings):
+    return {"reviews": [_review(rating) for rating in ratings], "metadata": {}}
+
+
+def _http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(response=response)
 
 
 class ScrapTestCase(TestCase):
 
+    def setUp(self):
+        caches["scrapper"].clear()
+        caches["sync"].clear()
+        airbnb_clients.reset()
+        # the rate limiting is not under test here
+        with override_settings(SCRAPING_RATE_LIMIT=1000, SCRAPING_RATE_LIMIT_BURST=1000):
+            patcher = patch("scrapper.apis.airbnb_rate_limiter", _create_rate_limiter())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @patch("scrapper.apis.airbnb.Api")
     def test_returns_none_when_airbnb_api_exception(self, mock_api):
         logging.disable(logging.CRITICAL)
@@ -51,4 +95,196 @@ class ScrapTestCase(TestCase):
             proxy=None,
         )
         mock_api.return_value.get_listing_details.assert_called_with(airbnb_id)
-        mock_api.return_value.get_reviews.assert_called_with(airbnb_id)
+        mock_api.return_value.get_reviews.assert_called_with(airbnb_id, 0, REVIEWS_PAGE_SIZE)
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_fetches_details_and_reviews_concurrently(self, mock_api):
+        """
+        details and reviews are requested at the same time
+        """
+        barrier = threading.Barrier(2, timeout=5)
+
+        def _fetch(*args):
+            barrier.wait()
+            return {"data": "value"}
+
+        mock_api.return_value.get_listing_details.side_effect = _fetch
+        mock_api.return_value.get_reviews.side_effect = _fetch
+
+        response = scrap_airbnb_data("1234")
+
+        self.assertEqual(response, ({"data": "value"}, {"data": "value"}))
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_fails_fast_when_one_call_fails(self, mock_api):
+        """
+        a failing call does not wait for the other ones
+        """
+        logging.disable(logging.CRITICAL)
+        release = threading.Event()
+
+        mock_api.return_value.get_listing_details.side_effect = Exception()
+        mock_api.return_value.get_reviews.side_effect = lambda *args: release.wait(5)
+
+        start = time.time()
+        response = scrap_airbnb_data("1234")
+        release.set()
+
+        self.assertEqual(response, None)
+        self.assertLess(time.time() - start, 2)
+
+    @override_settings(SCRAPING_TIMEOUT=0.1)
+    @patch("scrapper.apis.airbnb.Api")
+    def test_returns_none_when_deadline_is_reached(self, mock_api):
+        logging.disable(logging.CRITICAL)
+        release = threading.Event()
+
+        mock_api.return_value.get_listing_details.return_value = {"data": "details"}
+        mock_api.return_value.get_reviews.side_effect = lambda *args: release.wait(5)
+
+        response = scrap_airbnb_data("1234")
+        release.set()
+
+        self.assertEqual(response, None)
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_returns_cached_data(self, mock_api):
+        """
+        data of a listing already scrapped are not requested again
+        """
+        details = {"data": "details"}
+        reviews = {"data": "reviews"}
+        mock_api.return_value.get_listing_details.return_value = details
+        mock_api.return_value.get_reviews.return_value = reviews
+
+        scrap_airbnb_data("1234")
+        response = scrap_airbnb_data("1234")
+
+        self.assertEqual(response, (details, reviews))
+        mock_api.return_value.get_listing_details.assert_called_once_with("1234")
+        mock_api.return_value.get_reviews.assert_called_once_with("1234", 0, REVIEWS_PAGE_SIZE)
+        self.assertEqual(caches["scrapper"].get("airbnb:1234:fr:EUR"), (details, reviews))
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_bypasses_cache(self, mock_api):
+        mock_api.return_value.get_listing_details.return_value = {"data": "details"}
+        mock_api.return_value.get_reviews.return_value = {"data": "reviews"}
+
+        scrap_airbnb_data("1234")
+        scrap_airbnb_data("1234", use_cache=False)
+
+        self.assertEqual(mock_api.return_value.get_listing_details.call_count, 2)
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_does_not_cache_errors(self, mock_api):
+        logging.disable(logging.CRITICAL)
+        mock_api.return_value.get_listing_details.side_effect = [Exception(), {"data": "details"}]
+        mock_api.return_value.get_reviews.return_value = {"data": "reviews"}
+
+        self.assertEqual(scrap_airbnb_data("1234"), None)
+        self.assertEqual(scrap_airbnb_data("1234"), ({"data": "details"}, {"data": "reviews"}))
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_reuses_api_clients(self, mock_api):
+        """
+        API clients are reused from one scrape to another
+        """
+        mock_api.return_value.get_listing_details.return_value = {"data": "details"}
+        mock_api.return_value.get_reviews.return_value = {"data": "reviews"}
+
+        scrap_airbnb_data("1234")
+        created = mock_api.call_count
+        scrap_airbnb_data("5678")
+
+        self.assertEqual(mock_api.call_count, created)
+
+    @override_settings(AIRBNB_API_KEYS=["k1", "k2", "k3"], SCRAPING_PROXIES=["p1", "p2"])
+    def test_pairs_api_keys_with_proxies(self):
+        self.assertEqual(_get_scraping_credentials(), [("k1", "p1"), ("k2", "p2"), ("k3", "p1")])
+
+    @override_settings(SCRAPING_RETRY_BASE_DELAY=0)
+    @patch("scrapper.apis.airbnb.Api")
+    def test_retries_transient_errors(self, mock_api):
+        logging.disable(logging.CRITICAL)
+        mock_api.return_value.get_listing_details.side_effect = [_http_error(503), {"data": "details"}]
+        mock_api.return_value.get_reviews.return_value = {"data": "reviews"}
+
+        response = scrap_airbnb_data("1234")
+
+        self.assertEqual(response, ({"data": "details"}, {"data": "reviews"}))
+        self.assertEqual(mock_api.return_value.get_listing_details.call_count, 2)
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_does_not_retry_fatal_errors(self, mock_api):
+        logging.disable(logging.CRITICAL)
+        mock_api.return_value.get_listing_details.side_effect = _http_error(404)
+        mock_api.return_value.get_reviews.return_value = {"data": "reviews"}
+
+        self.assertEqual(scrap_airbnb_data("1234"), None)
+        self.assertEqual(mock_api.return_value.get_listing_details.call_count, 1)
+        self.assertEqual(airbnb_circuit_breaker.state, airbnb_circuit_breaker.CLOSED)
+
+    @override_settings(SCRAPING_RETRIES=0)
+    @patch.object(airbnb_circuit_breaker, "failure_threshold", 2)
+    @patch("scrapper.apis.airbnb.Api")
+    def test_fails_fast_when_circuit_is_open(self, mock_api):
+        logging.disable(logging.CRITICAL)
+        mock_api.return_value.get_listing_details.side_effect = _http_error(503)
+        mock_api.return_value.get_reviews.return_value = {"data": "reviews"}
+
+        for _ in range(airbnb_circuit_breaker.failure_threshold):
+            scrap_airbnb_data("1234")
+        calls = mock_api.return_value.get_listing_details.call_count
+
+        self.assertEqual(airbnb_circuit_breaker.state, airbnb_circuit_breaker.OPEN)
+        self.assertEqual(scrap_airbnb_data("1234"), None)
+        self.assertEqual(mock_api.return_value.get_listing_details.call_count, calls)
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_fetches_a_single_page_of_reviews_when_enough(self, mock_api):
+        mock_api.return_value.get_listing_details.return_value = {"data": "details"}
+        page = _reviews_page(*[5] * REVIEWS_PAGE_SIZE)
+        mock_api.return_value.get_reviews.return_value = page
+
+        self.assertEqual(scrap_airbnb_data("1234"), ({"data": "details"}, page))
+        mock_api.return_value.get_reviews.assert_called_once_with("1234", 0, REVIEWS_PAGE_SIZE)
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_fetches_reviews_until_enough(self, mock_api):
+        mock_api.return_value.get_listing_details.return_value = {"data": "details"}
+        mock_api.return_value.get_reviews.side_effect = [
+            _reviews_page(*[4] * (REVIEWS_PAGE_SIZE - 2), 5, 5),
+            _reviews_page(*[3] * (REVIEWS_PAGE_SIZE - REVIEWS_COUNT), *[5] * REVIEWS_COUNT),
+            _reviews_page(*[5] * REVIEWS_PAGE_SIZE),
+        ]
+
+        _, reviews = scrap_airbnb_data("1234")
+
+        self.assertEqual(len(reviews["reviews"]), 2 * REVIEWS_PAGE_SIZE)
+        self.assertEqual(
+            [c.args for c in mock_api.return_value.get_reviews.call_args_list],
+            [("1234", 0, REVIEWS_PAGE_SIZE), ("1234", REVIEWS_PAGE_SIZE, REVIEWS_PAGE_SIZE)],
+        )
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_stops_at_last_page_of_reviews(self, mock_api):
+        mock_api.return_value.get_listing_details.return_value = {"data": "details"}
+        mock_api.return_value.get_reviews.side_effect = [
+            _reviews_page(*[4] * REVIEWS_PAGE_SIZE),
+            _reviews_page(5, 4),
+            _reviews_page(5),
+        ]
+
+        _, reviews = scrap_airbnb_data("1234")
+
+        self.assertEqual(len(reviews["reviews"]), REVIEWS_PAGE_SIZE + 2)
+        self.assertEqual(mock_api.return_value.get_reviews.call_count, 2)
+
+    @patch("scrapper.apis.airbnb.Api")
+    def test_stops_after_max_pages_of_reviews(self, mock_api):
+        mock_api.return_value.get_listing_details.return_value = {"data": "details"}
+        mock_api.return_value.get_reviews.return_value = _reviews_page(*[4] * REVIEWS_PAGE_SIZE)
+
+        scrap_airbnb_data("1234")
+
+        self.assertEqual(mock_api.return_value.get_reviews.call_count, REVIEWS_MAX_PAGES)
@@ -15,7 +15,7 @@ class ScrapAndConvertTestCase(TestCase):
         response = scrap_and_convert(airbnb_id)
 
         self.assertEqual(response, None)
-        mock_scrap.assert_called_with(airbnb_id)
+        mock_scrap.assert_called_with(airbnb_id, use_cache=True)
 
     @patch("scrapper.apis.convert_airbnb_data")
     @patch("scrapper.apis.scrap_airbnb_data")
@@ -29,7 +29,7 @@ class ScrapAndConvertTestCase(TestCase):
         response = scrap_and_convert(airbnb_id)
 
         self.assertEqual(response, None)
-        mock_scrap.assert_called_with(airbnb_id)
+        mock_scrap.assert_called_with(airbnb_id, use_cache=True)
         mock_convert.assert_called_with(scrapped_data)
 
     @patch("scrapper.apis.convert_airbnb_data")
@@ -45,5 +45,5 @@ class ScrapAndConvertTestCase(TestCase):
         response = scrap_and_convert(airbnb_id)
 
         self.assertEqual(response, converted_data)
-        mock_scrap.assert_called_with(airbnb_id)
+        mock_scrap.assert_called_with(airbnb_id, use_cache=True)
         mock_convert.assert_called_with(scrapped_data)
@@ -0,0 +1,96 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+from scrapper.ratelimit import LocalTokenBucket, RateLimiter, RateLimitExceeded, RedisTokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, duration):
+        self.now += duration
+
+
+class LocalTokenBucketTestCase(TestCase):
+
+    def test_allows_bursts(self):
+        clock = FakeClock()
+        bucket = LocalTokenBucket(rate=1, capacity=3, clock=clock)
+
+        self.assertEqual([bucket.try_acquire("b") for _ in range(3)], [0, 0, 0])
+        self.assertEqual(bucket.try_acquire("b"), 1)
+
+    def test_refills_over_time(self):
+        clock = FakeClock()
+        bucket = LocalTokenBucket(rate=2, capacity=1, clock=clock)
+
+        self.assertEqual(bucket.try_acquire("b"), 0)
+        self.assertEqual(bucket.try_acquire("b"), 0.5)
+        clock.now += 0.5
+        self.assertEqual(bucket.try_acquire("b"), 0)
+
+    def test_buckets_are_independent(self):
+        bucket = LocalTokenBucket(rate=1, capacity=1, clock=FakeClock())
+
+        self.assertEqual(bucket.try_acquire("b1"), 0)
+        self.assertEqual(bucket.try_acquire("b2"), 0)
+
+
+class RedisTokenBucketTestCase(TestCase):
+
+    def test_runs_script_on_prefixed_key(self):
+        client = Mock()
+        client.register_script.return_value.return_value = b"0.25"
+        bucket = RedisTokenBucket(client, rate=4, capacity=2, prefix="prefix")
+
+        self.assertEqual(bucket.try_acquire("b"), 0.25)
+        client.register_script.return_value.assert_called_once_with(keys=["prefix:b"], args=[4, 2])
+
+
+class RateLimiterTestCase(TestCase):
+
+    credentials = [("key1", "proxy1"), ("key2", "proxy2")]
+
+    def test_rotates_credentials(self):
+        clock = FakeClock()
+        limiter = RateLimiter(
+            LocalTokenBucket(rate=1, capacity=10, clock=clock), self.credentials, 10,
+            sleep=clock.sleep, clock=clock,
+        )
+
+        self.assertEqual([limiter.acquire() for _ in range(4)], self.credentials * 2)
+
+    def test_uses_credentials_with_available_token(self):
+        clock = FakeClock()
+        bucket = LocalTokenBucket(rate=1, capacity=1, clock=clock)
+        limiter = RateLimiter(bucket, self.credentials, 10, sleep=clock.sleep, clock=clock)
+
+        self.assertEqual({limiter.acquire(), limiter.acquire()}, set(self.credentials))
+        self.assertEqual(clock.now, 0)
+
+    def test_waits_for_a_token(self):
+        clock = FakeClock()
+        limiter = RateLimiter(
+            LocalTokenBucket(rate=0.5, capacity=1, clock=clock), self.credentials[:1], 10,
+            sleep=clock.sleep, clock=clock,
+        )
+
+        limiter.acquire()
+        self.assertEqual(limiter.acquire(), self.credentials[0])
+        self.assertEqual(clock.now, 2)
+
+    def test_gives_up_after_max_wait(self):
+        clock = FakeClock()
+        limiter = RateLimiter(
+            LocalTokenBucket(rate=0.1, capacity=1, clock=clock), self.credentials[:1], 5,
+            sleep=clock.sleep, clock=clock,
+        )
+
+        limiter.acquire()
+        with self.assertRaises(RateLimitExceeded):
+            limiter.acquire()
+        self.assertEqual(clock.now, 5)
@@ -0,0 +1,128 @@
+import json
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import TestCase
+from unittest.mock import patch
+
+import requests
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.test import TestCase as DjangoTestCase, override_settings
+
+from scrapper.apis import convert_airbnb_data
+from scrapper.replay import (
+    MediaServer,
+    get_media_urls,
+    list_recorded_listings,
+    load_listing,
+    record_listing,
+    rewrite_media_urls,
+)
+from websites.models import Website
+
+FAKE_DATA_DIR = Path(settings.BASE_DIR) / "scrapper" / "fake_data"
+
+
+def _load_fake_data():
+    return (
+        json.loads((FAKE_DATA_DIR / "details.json").read_text()),
+        json.loads((FAKE_DATA_DIR / "reviews.json").read_text()),
+    )
+
+
+class ReplayTestCase(TestCase):
+
+    def setUp(self):
+        self.corpus_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.corpus_dir)
+
+    def test_get_media_urls(self):
+        data = {
+            "photos": [{"url": "p1"}, {"url": None}, {"url": "p2"}],
+            "host": {"picture_url": "h1"},
+            "reviews": [{"author_picture_url": "r1"}, {"author_picture_url": "p1"}],
+        }
+        self.assertEqual(get_media_urls(data), ["p1", "p2", "h1", "r1"])
+
+    @patch("scrapper.replay.download_media_file")
+    def test_record_and_load_listing(self, mock_download):
+        mock_download.side_effect = lambda url, name: BytesIO(url.encode()) if url != "https://x/3.jpg" else None
+        airbnb_data = ({"details": 1}, {"reviews": 2})
+
+        count = record_listing(self.corpus_dir, "1234", airbnb_data, ["https://x/1.jpg", "https://x/3.jpg"])
+
+        self.assertEqual(count, 1)
+        self.assertEqual(list_recorded_listings(self.corpus_dir), ["1234"])
+        loaded_data, media_index = load_listing(self.corpus_dir, "1234")
+        self.assertEqual(loaded_data, airbnb_data)
+        self.assertEqual(list(media_index), ["https://x/1.jpg"])
+        self.assertEqual((self.corpus_dir / media_index["https://x/1.jpg"]).read_bytes(), b"https://x/1.jpg")
+
+    def test_rewrite_media_urls(self):
+        data = {"photos": [{"large": "https://x/1.jpg?size=large", "id": 1}], "other": "https://x/2.jpg"}
+
+        rewritten = rewrite_media_urls(data, {"https://x/1.jpg": "1234/media/a.jpg"}, "http://local")
+
+        self.assertEqual(
+            rewritten,
+            {"photos": [{"large": "http://local/1234/media/a.jpg", "id": 1}], "other": "https://x/2.jpg"}
+        )
+
+    def test_media_server(self):
+        (self.corpus_dir / "a.jpg").write_bytes(b"content")
+
+        with MediaServer(self.corpus_dir) as server:
+            response = requests.get(f"{server.base_url}/a.jpg", timeout=5)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"content")
+
+
+class BenchmarkPipelineTestCase(DjangoTestCase):
+
+    def setUp(self):
+        self.corpus_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.corpus_dir)
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        override = override_settings(MEDIA_ROOT=media_root, USE_DEBUG_DATA_STORAGE=False)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def _record_fake_listing(self):
+        airbnb_data = _load_fake_data()
+        media_urls = get_media_urls(convert_airbnb_data(airbnb_data))
+        with patch("scrapper.replay.download_media_file", side_effect=lambda url, name: BytesIO(b"image")):
+            record_listing(self.corpus_dir, "1234", airbnb_data, media_urls)
+        return media_urls
+
+    def test_benchmark_replays_recorded_listings(self):
+        media_urls = self._record_fake_listing()
+        out = StringIO()
+
+        with patch("websites.utils.requests.get", wraps=requests.get) as mock_get:
+            call_command("benchmark_pipeline", corpus=str(self.corpus_dir), repeat=2, json=True, stdout=out)
+
+        report = json.loads(out.getvalue())
+        self.assertEqual(list(report), ["replay", "convert", "create"])
+        self.assertEqual(report["create"]["runs"], 2)
+        self.assertGreater(report["create"]["queries"], 0)
+        self.assertEqual(report["convert"]["queries"], 0)
+        # media files are only downloaded from the local media server
+        self.assertEqual(mock_get.call_count, 2 * len(media_urls))
+        self.assertTrue(all(c.args[0].startswith("http://127.0.0.1:") for c in mock_get.call_args_list))
+        # generated websites, their owner and their media files are removed
+        self.assertFalse(Website.objects.exists())
+        self.assertFalse(get_user_model().objects.filter(username="benchmark").exists())
+        self.assertEqual(list(Path(settings.MEDIA_ROOT).iterdir()), [])
+
+    @patch("scrapper.management.commands.benchmark_pipeline.Website.create")
+    def test_benchmark_create_error(self, mock_create):
+        self._record_fake_listing()
+        mock_create.return_value = False
+
+        with self.assertRaisesMessage(CommandError, "1234: unable to create a website"):
+            call_command("benchmark_pipeline", corpus=str(self.corpus_dir), repeat=1, stdout=StringIO())
@@ -0,0 +1,136 @@
+from unittest import TestCase
+from unittest.mock import Mock
+
+import requests
+from django.core.cache import caches
+from parameterized import parameterized
+
+from scrapper.resilience import CircuitBreaker, call_with_retry, is_transient_error
+
+
+def _http_error(status_code):
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.exceptions.HTTPError(response=response)
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class RetryTestCase(TestCase):
+
+    @parameterized.expand([
+        (_http_error(429), True),
+        (_http_error(503), True),
+        (_http_error(404), False),
+        (_http_error(403), False),
+        (requests.exceptions.ConnectionError(), True),
+        (requests.exceptions.ReadTimeout(), True),
+        (ValueError(), False),
+    ])
+    def test_is_transient_error(self, exception, expected):
+        self.assertEqual(is_transient_error(exception), expected)
+
+    def test_returns_first_success(self):
+        func = Mock(side_effect=[_http_error(503), _http_error(502), "data"])
+        sleep = Mock()
+
+        self.assertEqual(call_with_retry(func, retries=3, base_delay=1, max_delay=10, sleep=sleep), "data")
+        self.assertEqual([c.args[0] for c in func.call_args_list], [0, 1, 2])
+        self.assertEqual(sleep.call_count, 2)
+
+    def test_backoff_is_bounded(self):
+        func = Mock(side_effect=_http_error(503))
+        sleep = Mock()
+
+        with self.assertRaises(requests.exceptions.HTTPError):
+            call_with_retry(func, retries=5, base_delay=1, max_delay=3, sleep=sleep)
+
+        self.assertEqual(func.call_count, 6)
+        delays = [c.args[0] for c in sleep.call_args_list]
+        for attempt, delay in enumerate(delays):
+            self.assertTrue(0 <= delay <= min(3, 2 ** attempt))
+
+    def test_fatal_errors_are_not_retried(self):
+        func = Mock(side_effect=ValueError())
+        sleep = Mock()
+
+        with self.assertRaises(ValueError):
+            call_with_retry(func, retries=3, base_delay=1, max_delay=10, sleep=sleep)
+
+        self.assertEqual(func.call_count, 1)
+        sleep.assert_not_called()
+
+
+class CircuitBreakerTestCase(TestCase):
+
+    def setUp(self):
+        caches["sync"].clear()
+        self.clock = FakeClock()
+        self.circuit = CircuitBreaker("test", failure_threshold=3, recovery_timeout=60, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        for _ in range(2):
+            self.circuit.record_failure()
+        self.assertTrue(self.circuit.allow_request())
+
+        self.circuit.record_failure()
+
+        self.assertEqual(self.circuit.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.circuit.allow_request())
+
+    def test_success_resets_failures(self):
+        for _ in range(2):
+            self.circuit.record_failure()
+        self.circuit.record_success()
+        for _ in range(2):
+            self.circuit.record_failure()
+
+        self.assertEqual(self.circuit.state, CircuitBreaker.CLOSED)
+
+    def test_half_open_allows_a_single_probe(self):
+        for _ in range(3):
+            self.circuit.record_failure()
+        self.clock.now += 60
+
+        self.assertEqual(self.circuit.state, CircuitBreaker.HALF_OPEN)
+        self.assertTrue(self.circuit.allow_request())
+        self.assertFalse(self.circuit.allow_request())
+
+    def test_probe_success_closes_circuit(self):
+        for _ in range(3):
+            self.circuit.record_failure()
+        self.clock.now += 60
+        self.circuit.allow_request()
+
+        self.circuit.record_success()
+
+        self.assertEqual(self.circuit.state, CircuitBreaker.CLOSED)
+        self.assertTrue(self.circuit.allow_request())
+
+    def test_probe_failure_opens_circuit_again(self):
+        for _ in range(3):
+            self.circuit.record_failure()
+        self.clock.now += 60
+        self.circuit.allow_request()
+
+        self.circuit.record_failure()
+
+        self.assertEqual(self.circuit.state, CircuitBreaker.OPEN)
+        self.clock.now += 60
+        self.assertTrue(self.circuit.allow_request())
+
+    def test_state_is_shared_through_the_sync_cache(self):
+        # the web processes check the state written by the workers: the "sync" cache is always on Redis
+        for _ in range(3):
+            self.circuit.record_failure()
+
+        other = CircuitBreaker("test", failure_threshold=3, recovery_timeout=60, clock=self.clock)
+        self.assertEqual(other.state, CircuitBreaker.OPEN)
+        self.assertIsNotNone(caches["sync"].get("circuit:test:opened_at"))
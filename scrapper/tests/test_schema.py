@@ -0,0 +1,98 @@
+from parameterized import parameterized
+from unittest import TestCase
+
+from scrapper.schema import At, Field, Items, Record, compile_schema
+
+
+class SchemaTestCase(TestCase):
+
+    @parameterized.expand([
+        (None, None),
+        ({}, None),
+        ({"a": 1}, 1),
+        ({"a": {"b": 2}}, {"b": 2}),
+    ])
+    def test_field(self, data, expected):
+        self.assertEqual(compile_schema(Field("a"))(data), expected)
+
+    @parameterized.expand([
+        (None, "default"),
+        ({"a": "value"}, "default"),
+        ({"a": {"c": 1}}, "default"),
+        ({"a": {"b": "value"}}, "VALUE"),
+    ])
+    def test_field_with_nested_path(self, data, expected):
+        extract = compile_schema(Field("a.b", convert=str.upper, default="default"))
+        self.assertEqual(extract(data), expected)
+
+    def test_mutable_defaults_are_not_shared(self):
+        extract = compile_schema(Field("a", default=[]))
+
+        extract({}).append(1)
+
+        self.assertEqual(extract({}), [])
+
+    @parameterized.expand([
+        (None, None),
+        ({}, {"x": None, "y": {"z": None}}),
+        ({"a": 1, "b": 2}, {"x": 1, "y": {"z": 2}}),
+    ])
+    def test_record(self, data, expected):
+        extract = compile_schema(Record({"x": Field("a"), "y": Record({"z": Field("b")})}))
+        self.assertEqual(extract(data), expected)
+
+    @parameterized.expand([
+        ({"r": {"a": 1}}, {"x": 1}),
+        ({"r": {"a": 0}}, {}),
+        ({"r": None}, {}),
+        ({}, {}),
+    ])
+    def test_record_with_path_and_predicate(self, data, expected):
+        extract = compile_schema(Record({"x": Field("a")}, path="r", where=lambda r: r.get("a"), default={}))
+        self.assertEqual(extract(data), expected)
+
+    @parameterized.expand([
+        (None, []),
+        ({"l": None}, []),
+        ({"l": []}, []),
+        ({"l": ["a", {"b": 1}, {"a": 1}, {"a": 2}, {"a": 3}]}, [{"x": 3}, {"x": 1}]),
+    ])
+    def test_items(self, data, expected):
+        extract = compile_schema(Items(
+            Record({"x": Field("a")}),
+            path="l",
+            required=["a"],
+            where=lambda item: item["a"] != 2,
+            select=lambda items: sorted(items, key=lambda i: i["x"], reverse=True),
+            default=[],
+        ))
+        self.assertEqual(extract(data), expected)
+
+    def test_items_as_dict(self):
+        extract = compile_schema(Items(Field("v"), key=lambda item: str(item["id"]), required=["id"]))
+        self.assertEqual(extract([{"id": 1, "v": "a"}, {"v": "b"}, {"id": 2, "v": "c"}]), {"1": "a", "2": "c"})
+
+    def test_at(self):
+        extract = compile_schema(Record({"x": At("a", Field("b")), "y": At("c", Record({"z": Field("d")}))}))
+        self.assertEqual(extract({"a": {"b": 1}}), {"x": 1, "y": None})
+
+    def test_reports_missing_fields(self):
+        extract = compile_schema(Record({
+            "name": Field("name"),
+            "host": Record({"name": Field("name"), "about": Field("about")}, path="host"),
+            "photos": Items(Record({"url": Field("url"), "caption": Field("caption")}), path="photos"),
+            "rules": Field("rules"),
+        }))
+        missing = set()
+
+        extract({"name": "n", "host": {"name": "h"}, "photos": [{"url": "u"}, {"url": "v", "caption": "c"}]}, missing)
+
+        self.assertEqual(missing, {"host.about", "photos.caption", "rules"})
+
+    def test_batch(self):
+        extract = compile_schema(Record({"x": Field("a", convert=int), "y": Field("b")}))
+
+        results, missing_counts = extract.batch([{"a": "1", "b": 2}, {"a": "2"}, {"a": "x"}, {}])
+
+        self.assertEqual(results, [{"x": 1, "y": 2}, {"x": 2, "y": None}, None, {"x": None, "y": None}])
+        self.assertEqual(missing_counts, {"x": 1, "y": 2})
@@ -95,7 +95,7 @@ function generateWebsite(action_url, csrftoken, rental_url) {
   fetch(request)
   .then(handleErrors)
   .then((data) => {
-    getTaskStatus(data.task_id);
+    followTaskProgress(data.task_id);
   })
   .catch((data) => {
     console.log(data.error);
@@ -106,82 +106,132 @@ function generateWebsite(action_url, csrftoken, rental_url) {
   });
 }
 
-function getTaskStatus(taskID) {
-  const csrftoken = document.querySelector("[name=csrfmiddlewaretoken]").value;
-  const request = new Request(`/dashboard/task/${taskID}/`, {
-    method: "GET",
-    credentials: "same-origin",
-    headers: {
-      Accept: "application/json",
-      "X-Requested-With": "XMLHttpRequest",
-      "X-CSRFToken": csrftoken,
-    },
-  });
+function resetGenerateForm() {
+  let generateBtn = document.getElementById("generate-btn")
+  document.getElementById("id_rental_url").value = "";
+  generateBtn.innerHTML = "Ajouter";
+  generateBtn.disabled = false;
+}
 
-  fetch(request)
-  .then(handleErrors)
-  .then((res) => {
-    const taskStatus = res.task_status;
-
-    if (taskStatus === 'SUCCESS') {
-      const data = res.data;
-      let generateBtn = document.getElementById("generate-btn")
-
-      if (data.result === "success") {
-        // refresh the table
-        let tableContainer = document.getElementById("websites-table-container");
-        let table = document.getElementById("websites-table");
-        let tbody = table.getElementsByTagName('tbody')[0];
-        
-        newRow = tbody.insertRow()
-        newRow.setAttribute("id", `website_${data.key}`);
-        newRow.innerHTML = `
-          <td class="border-0"><a target="_blank" href='${data.url}'>${data.name}</a></td>
-          <td class="border-0">${data.key}</td>
-          <td class="border-0">${data.generated_date}</td>
-          <td class="border-0">
-              <a data-url='${data.delete_url}' class='website-delete-btn text-tertiary'>
-                <span class="fas fa-trash-alt me-2"></span>
-                Supprimer
-              </a>
-          </td>
-        `;
-        if (table.rows.length > 1) {
-          tableContainer.style.display = "block";
-        }
+function progressLabel(event) {
+  switch (event.stage) {
+    case "scraped":
+      return "Annonce récupérée";
+    case "converted":
+      return "Annonce analysée";
+    case "media":
+      return `${event.done}/${event.total} photos`;
+    default:
+      return "";
+  }
+}
+
+function addWebsiteRow(data) {
+  let tableContainer = document.getElementById("websites-table-container");
+  let table = document.getElementById("websites-table");
+  let tbody = table.getElementsByTagName('tbody')[0];
 
-        addMessage("success", "Votre site web a été généré avec succès!");
+  newRow = tbody.insertRow()
+  newRow.setAttribute("id", `website_${data.key}`);
+  newRow.innerHTML = `
+    <td class="border-0">
+      <a target="_blank" href='${data.url}'>${data.name}</a>
+      <small id="progress_${data.key}" class="ms-2 text-muted"></small>
+    </td>
+    <td class="border-0">${data.key}</td>
+    <td class="border-0">${data.generated_date}</td>
+    <td class="border-0">
+        <a data-url='${data.delete_url}' class='website-delete-btn text-tertiary'>
+          <span class="fas fa-trash-alt me-2"></span>
+          Supprimer
+        </a>
+    </td>
+  `;
+  if (table.rows.length > 1) {
+    tableContainer.style.display = "block";
+  }
+}
 
-        document.getElementById("id_rental_url").value = "";
-        generateBtn.innerHTML = "Ajouter";
-        generateBtn.disabled = false;
+// delay (in ms) before polling the progress again after a failed poll, multiplied by the number of failures
+const PROGRESS_RETRY_DELAY = 1000;
+// the progress is not followed anymore after this number of failed polls in a row
+const PROGRESS_MAX_FAILURES = 5;
+
+function followTaskProgress(taskID) {
+  // progress events are long-polled (see TaskProgressView): every poll gets the events not received yet
+  let generateBtn = document.getElementById("generate-btn")
+  let websiteKey = null;
+  let received = 0;
+  let failures = 0;
+
+  // handle a progress event, returns true once the creation is over
+  const handleEvent = (event) => {
+    switch (event.stage) {
+      case "published":
+        // the website is online, its photos are still being ingested
+        websiteKey = event.data.key;
+        if (!document.getElementById(`website_${websiteKey}`)) {
+          addWebsiteRow(event.data);
+          addMessage("success", "Votre site web a été généré avec succès!");
+          resetGenerateForm();
+        }
+        return false;
+      case "media": {
+        let progress = websiteKey && document.getElementById(`progress_${websiteKey}`);
+        if (progress) {
+          progress.textContent = progressLabel(event);
+        }
+        return false;
       }
-      else {
-        console.log(data.msg);
-        addMessage("danger", `${data.msg}`.replace("Error: ", ""));
-        document.getElementById("id_rental_url").value = "";
-        generateBtn.innerHTML = "Ajouter";
-        generateBtn.disabled = false;
+      case "done": {
+        let progress = websiteKey && document.getElementById(`progress_${websiteKey}`);
+        if (progress) {
+          progress.textContent = event.media_status === "failed" ? "Photos incomplètes" : "";
+        }
+        return true;
       }
-      return false;
+      case "error":
+        console.log(event.data.msg);
+        addMessage("danger", `${event.data.msg}`.replace("Error: ", ""));
+        resetGenerateForm();
+        return true;
+      default:
+        generateBtn.innerHTML = `
+          <span class="spinner-border spinner-border-sm" role="status" aria-hidden="true"></span>
+          ${progressLabel(event)}
+        `;
+        return false;
     }
+  };
 
-    if (taskStatus === 'FAILURE') {
-      /* TODO */
-      return false;
-    }
+  const poll = () => {
+    fetch(`/dashboard/task/${taskID}/progress/?after=${received}`, {
+      credentials: "same-origin",
+      headers: {Accept: "application/json"},
+    })
+    .then(handleErrors)
+    .then((data) => {
+      failures = 0;
+      received += data.events.length;
+      if (!data.events.some(handleEvent)) {
+        poll();
+      }
+    })
+    .catch(() => {
+      failures += 1;
+      if (failures < PROGRESS_MAX_FAILURES) {
+        setTimeout(poll, PROGRESS_RETRY_DELAY * failures);
+        return;
+      }
+      // give up: the website still appears in the list once the dashboard is reloaded
+      addMessage("danger", "Impossible de suivre la génération de votre site web, rechargez la page plus tard");
+      if (!websiteKey) {
+        resetGenerateForm();
+      }
+    });
+  };
 
-    setTimeout(function() {
-      getTaskStatus(res.task_id);
-    }, 1000);
-  })
-  .catch((data) => {
-    console.log(data.error);
-    addMessage("danger", `${data.error}`.replace("Error: ", ""));
-    document.getElementById("id_rental_url").value = "";
-    generateBtn.innerHTML = origInnerHTML;
-    generateBtn.disabled = false;
-  });
+  poll();
 }
 
 //========================================================
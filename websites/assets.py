@@ -0,0 +1,92 @@
+"""
+Static files of the website pages.
+
+The pages reference static files with the `static` template tag, and the stylesheets reference other
+static files (fonts, images, imported stylesheets) with `url(...)`: both are bundled with the exported
+pages (see `websites.export`), and part of the fingerprint of the templates (see `websites.page_cache`).
+"""
+import posixpath
+import re
+
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import staticfiles_storage
+
+# static files referenced by a template
+STATIC_TAG_RE = re.compile(r"""{%\s*static\s+["']([^"']+)["']\s*%}""")
+# files referenced by a stylesheet
+CSS_URL_RE = re.compile(r"""url\(\s*(["']?)([^"')]+)\1\s*\)""")
+
+
+def read_static_file(name):
+    """ content of the static file `name`, from the app directories or else from the collected static files """
+    path = finders.find(name)
+    if path:
+        with open(path, "rb") as f:
+            return f.read()
+    with staticfiles_storage.open(name) as f:
+        return f.read()
+
+
+def is_stylesheet(name):
+    return name.endswith(".css")
+
+
+def _resolve_css_url(stylesheet, url):
+    """
+    name of the static file referenced by `url` in the `stylesheet`, or None if it's not a static file
+    (external url, data url, ...)
+    """
+    url = url.strip().split("?")[0].split("#")[0]
+    if not url or url.startswith(("data:", "//")) or re.match(r"^[a-z]+:", url):
+        return None
+    if url.startswith(settings.STATIC_URL):
+        return url[len(settings.STATIC_URL):]
+    if url.startswith("/"):
+        return None
+    name = posixpath.normpath(posixpath.join(posixpath.dirname(stylesheet), url))
+    return None if name.startswith("../") else name
+
+
+def rewrite_stylesheet(stylesheet, content, assets):
+    """
+    rewrite the urls of the static files referenced by the `stylesheet` into urls relative to it,
+    their names are added to `assets`
+    """
+    def _rewrite_url(match):
+        name = _resolve_css_url(stylesheet, match.group(2))
+        if name is None:
+            return match.group(0)
+        assets.add(name)
+        url = posixpath.relpath(name, posixpath.dirname(stylesheet) or ".")
+        return f"url({match.group(1)}{url}{match.group(1)})"
+
+    return CSS_URL_RE.sub(_rewrite_url, content.decode("utf-8")).encode("utf-8")
+
+
+def get_static_references(template_dirs):
+    """
+    names of the static files referenced by the templates in `template_dirs` (paths),
+    with the files referenced by their stylesheets
+    """
+    names = set()
+    for template_dir in template_dirs:
+        for path in template_dir.rglob("*.html"):
+            names.update(STATIC_TAG_RE.findall(path.read_text("utf-8")))
+
+    references = set()
+    pending = sorted(names)
+    while pending:
+        name = pending.pop()
+        if name in references:
+            continue
+        references.add(name)
+        if is_stylesheet(name):
+            try:
+                content = read_static_file(name)
+            except OSError:
+                continue
+            referenced = set()
+            rewrite_stylesheet(name, content, referenced)
+            pending.extend(referenced - references)
+    return references
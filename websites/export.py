@@ -0,0 +1,143 @@
+"""
+Static export of the websites.
+
+The pages of a website are rendered into a self-contained bundle stored in the public media storage,
+so that they can be served by S3/a CDN instead of the web dynos:
+
+    sites/<key>/<version>/index.html
+    sites/<key>/<version>/photos.html
+    sites/<key>/<version>/details.html
+    sites/<key>/<version>/contact.html
+    sites/<key>/<version>/assets/<static file>
+
+The links between the pages and the urls of the static files (with the files referenced by the
+stylesheets, see `websites.assets`) are rewritten into relative urls, media files are still served
+from their url in the storage. The version of a bundle is the hash of its content: the files of a
+bundle never change, and are cached as such (see `PublicMediaStorage`).
+
+When the templates change, the exported websites are rendered again with `rerender_websites`:
+the websites already rendered with the current templates are skipped, so an interrupted re-rendering
+is resumed where it stopped, and unchanged bundles are not uploaded again.
+"""
+import hashlib
+import logging
+import re
+import time
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.urls import reverse
+
+from .assets import is_stylesheet, read_static_file, rewrite_stylesheet
+from .loaders import PAGE_FILENAMES
+from .models import EXPORTS_DIR, Website, WebsitePhoto
+from .page_cache import get_templates_fingerprint
+from .utils import delete_storage_prefix
+from .views import PAGE_VIEWS, render_website_page
+
+_logger = logging.getLogger('websites')
+
+ASSETS_DIR = "assets"
+
+
+def _rewrite_page(content, key, assets):
+    """
+    rewrite the urls of the pages of the website `key` and of the static files into urls relative
+    to the bundle. The names of the referenced static files are added to `assets`.
+    """
+    html = content.decode("utf-8")
+    for page, filename in PAGE_FILENAMES.items():
+        url = re.escape(reverse(f"website_{page}", args=[key]).rstrip("/"))
+        html = re.sub(rf"""(href=["']){url}/?(["'])""", rf"\g<1>{filename}\g<2>", html)
+
+    def _rewrite_static_url(match):
+        assets.add(match.group(2))
+        return f"{match.group(1)}{ASSETS_DIR}/{match.group(2)}"
+
+    static_url = re.escape(settings.STATIC_URL)
+    html = re.sub(rf"""((?:href|src)=["']){static_url}([^"'?#]+)""", _rewrite_static_url, html)
+    return html.encode("utf-8")
+
+
+def build_bundle(key):
+    """ render the pages of the website `key` into a bundle: {path in the bundle: content} """
+    files = {}
+    assets = set()
+    for view_class in PAGE_VIEWS:
+        files[PAGE_FILENAMES[view_class.page]] = _rewrite_page(render_website_page(key, view_class), key, assets)
+
+    # the files referenced by the bundled stylesheets are bundled too
+    pending = sorted(assets)
+    while pending:
+        name = pending.pop()
+        if f"{ASSETS_DIR}/{name}" in files:
+            continue
+        content = read_static_file(name)
+        if is_stylesheet(name):
+            referenced = set()
+            content = rewrite_stylesheet(name, content, referenced)
+            pending.extend(sorted(referenced))
+        files[f"{ASSETS_DIR}/{name}"] = content
+    return files
+
+
+def get_bundle_version(files):
+    digest = hashlib.sha256()
+    for path in sorted(files):
+        digest.update(path.encode("utf-8"))
+        digest.update(files[path])
+    return digest.hexdigest()[:16]
+
+
+def export_website(website):
+    """
+    export the pages of the `website` into a static bundle in the public media storage, the previous
+    bundle of the website is deleted. Returns the directory of the bundle.
+    """
+    storage = WebsitePhoto._meta.get_field("image").storage
+    fingerprint = get_templates_fingerprint()
+    files = build_bundle(website.key)
+    export_path = f"{EXPORTS_DIR}/{website.key}/{get_bundle_version(files)}/"
+    previous_path = website.export_path
+
+    if export_path != previous_path:
+        for path, content in files.items():
+            # bundles are immutable: an existing file is the same file
+            if not storage.exists(export_path + path):
+                storage.save(export_path + path, ContentFile(content))
+        _logger.info("website exported {'key': %s, 'path': %s, 'files': %s}", website.key, export_path, len(files))
+
+    if (export_path, fingerprint) != (previous_path, website.export_fingerprint):
+        website.export_path = export_path
+        website.export_fingerprint = fingerprint
+        website.save(update_fields=["export_path", "export_fingerprint"])
+    if previous_path and previous_path != export_path:
+        delete_storage_prefix(storage, previous_path)
+    return export_path
+
+
+def get_websites_to_rerender(force=False):
+    """ ids of the exported websites not rendered with the current templates yet (all of them with `force`) """
+    websites = Website.objects.exclude(export_path="")
+    if not force:
+        websites = websites.exclude(export_fingerprint=get_templates_fingerprint())
+    return list(websites.order_by("id").values_list("id", flat=True))
+
+
+def rerender_websites(ids):
+    """
+    export again the websites `ids` with the current templates.
+    Returns the number of rendered websites, of websites whose bundle changed and of failures.
+    """
+    stats = {"rendered": 0, "changed": 0, "failed": 0}
+    start = time.time()
+    for website in Website.objects.filter(id__in=ids).order_by("id"):
+        previous_path = website.export_path
+        try:
+            stats["changed"] += export_website(website) != previous_path
+            stats["rendered"] += 1
+        except Exception as e:
+            _logger.exception("unable to render the website {'key': %s}: %s", website.key, e)
+            stats["failed"] += 1
+    _logger.info("websites rendered: %s, duration: %s", stats, time.time() - start)
+    return stats
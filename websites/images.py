@@ -0,0 +1,139 @@
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+_logger = logging.getLogger("utils")
+
+VARIANT_FORMAT = "WEBP"
+VARIANT_EXTENSION = ".webp"
+
+_executor = None
+_executor_disabled = False
+_executor_lock = threading.Lock()
+
+
+def get_variant_name(name, width):
+    """ name of the variant of the image `name` resized to `width`, stored next to it """
+    return f"{os.path.splitext(name)[0]}_{width}w{VARIANT_EXTENSION}"
+
+
+def is_variant_of(variant_name, name):
+    return variant_name.startswith(f"{os.path.splitext(name)[0]}_") and variant_name.endswith(VARIANT_EXTENSION)
+
+
+def resize_image(content, widths, quality):
+    """
+    resize the image `content` (bytes) to every width of `widths` and encode them in WebP.
+    Returns a list of (width, bytes). Run in the worker processes, so it must only use its arguments.
+    """
+    variants = []
+    with Image.open(io.BytesIO(content)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGB")
+        for width in widths:
+            resized = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            output = io.BytesIO()
+            resized.save(output, VARIANT_FORMAT, quality=quality, method=4)
+            variants.append((width, output.getvalue()))
+    return variants
+
+
+def _get_executor():
+    """
+    process pool shared by the ingestion threads, None if the variants have to be generated
+    in the calling thread (no worker configured, or no child process allowed).
+    Its processes are spawned: forking the multithreaded ingestion workers could copy the locks held
+    by their other threads.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None and not _executor_disabled and settings.IMAGE_VARIANTS_MAX_WORKERS != 0:
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_VARIANTS_MAX_WORKERS or None,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _executor
+
+
+def _reset_executor(executor):
+    """ drop the broken process pool `executor` (a child process died), a new one is created for the next images """
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _disable_executor():
+    global _executor, _executor_disabled
+    with _executor_lock:
+        _executor_disabled = True
+        if _executor:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+
+def _resize(content, widths):
+    """ resize the image `content` in the process pool: resizing/encoding images is CPU bound """
+    executor = _get_executor()
+    if executor:
+        try:
+            return executor.submit(resize_image, content, widths, settings.IMAGE_VARIANT_QUALITY).result()
+        except AssertionError as e:
+            # daemonic processes (e.g. the prefork Celery workers) are not allowed to have children
+            _logger.warning("image variants generated without process pool (%s)", str(e))
+            _disable_executor()
+        except BrokenProcessPool as e:
+            # a child process was killed (e.g. out of memory): the image is resized in this thread
+            _logger.warning("image variants process pool broken (%s)", str(e))
+            _reset_executor(executor)
+    return resize_image(content, widths, settings.IMAGE_VARIANT_QUALITY)
+
+
+def store_image_variants(storage, name, media_file):
+    """
+    generate the resized WebP variants of the image `media_file`, stored as `name` in the `storage`,
+    and store them next to it. Only widths smaller than the image are generated, and variants already
+    stored (the image is shared by several websites) are not generated again.
+    Returns the variants [{"width": ..., "name": ...}], the smallest first.
+    Doesn't access the database, so it can be called from the ingestion threads.
+    """
+    try:
+        with Image.open(media_file) as image:
+            image_width = image.width
+        media_file.seek(0)
+    except Exception:
+        _logger.warning("unable to read the image '%s'", name)
+        media_file.seek(0)
+        return []
+
+    variants = [
+        {"width": width, "name": get_variant_name(name, width)}
+        for width in sorted(set(settings.IMAGE_VARIANT_WIDTHS)) if width < image_width
+    ]
+    missing = [v for v in variants if not storage.exists(v["name"])]
+    if missing:
+        content = media_file.read()
+        media_file.seek(0)
+        try:
+            resized = dict(_resize(content, [v["width"] for v in missing]))
+        except Exception as e:
+            _logger.exception("exception: %s, type: %s", str(e), type(e).__name__)
+            return []
+        for variant in missing:
+            storage.save(variant["name"], ContentFile(resized[variant["width"]]))
+    return variants
+
+
+def get_srcset(storage, variants):
+    """ `srcset` attribute of the image variants """
+    return ", ".join(f"{storage.url(v['name'])} {v['width']}w" for v in variants)
@@ -0,0 +1,116 @@
+"""
+Loading of the data displayed by the website pages.
+
+Every page loads its website with `get_page_queryset(page)`: the website (with its location) and
+each of its related sets are fetched with one query, with only the columns displayed by the page,
+so the number of queries of a page is fixed whatever the number of photos, rooms or equipments.
+"""
+from django.db.models import Prefetch
+
+from .models import (
+    Equipment,
+    EquipmentArea,
+    Highlight,
+    Review,
+    Room,
+    RoomDetail,
+    Rule,
+    Website,
+    WebsiteHost,
+    WebsitePhoto,
+)
+
+HOME_PAGE = "home"
+PHOTOS_PAGE = "photos"
+DETAILS_PAGE = "details"
+CONTACT_PAGE = "contact"
+
+# file of every page in the static export of a website (see `websites.export`)
+PAGE_FILENAMES = {
+    HOME_PAGE: "index.html",
+    PHOTOS_PAGE: "photos.html",
+    DETAILS_PAGE: "details.html",
+    CONTACT_PAGE: "contact.html",
+}
+
+# columns of the website displayed by all the pages, and dating them
+WEBSITE_FIELDS = ["key", "name", "media_status", "generated_date", "refreshed_date"]
+
+
+def _hosts(*fields):
+    return Prefetch("websitehost_set", WebsiteHost.objects.only("website_id", "name", *fields), to_attr="hosts")
+
+
+def _photos(limit=None):
+    photos = WebsitePhoto.objects.only("website_id", "image", "variants", "caption").order_by("position", "id")
+    return Prefetch("websitephoto_set", photos[:limit], to_attr="photos")
+
+
+def _home_page():
+    return [
+        "description", "bathroom_count", "bed_count", "bedroom_count", "guest_count",
+        "location__title", "location__latitude", "location__longitude",
+    ], [
+        _hosts(),
+        # the main photo only
+        _photos(limit=1),
+        Prefetch(
+            "review_set",
+            Review.objects.only(
+                "website_id", "author_name", "author_picture", "variants", "review", "date", "language",
+            ).order_by("-date", "id"),
+            to_attr="reviews",
+        ),
+        Prefetch("highlight_set", Highlight.objects.only("website_id", "title", "message"), to_attr="highlights"),
+    ]
+
+
+def _photos_page():
+    return [], [_hosts(), _photos()]
+
+
+def _details_page():
+    return [], [
+        _hosts(),
+        Prefetch(
+            "equipmentarea_set",
+            EquipmentArea.objects.only("website_id", "name").order_by("id").prefetch_related(
+                Prefetch("equipments", Equipment.objects.only("name", "description").order_by("id")),
+            ),
+            to_attr="equipment_areas",
+        ),
+        Prefetch("rule_set", Rule.objects.only("website_id", "name").order_by("id"), to_attr="rules"),
+        Prefetch(
+            "room_set",
+            Room.objects.only("website_id", "name").order_by("id").prefetch_related(
+                Prefetch(
+                    "roomdetail_set", RoomDetail.objects.only("room_id", "detail").order_by("id"), to_attr="details"
+                ),
+            ),
+            to_attr="rooms",
+        ),
+    ]
+
+
+def _contact_page():
+    return [], [_hosts("description", "languages", "picture", "variants")]
+
+
+PAGES = {
+    HOME_PAGE: _home_page,
+    PHOTOS_PAGE: _photos_page,
+    DETAILS_PAGE: _details_page,
+    CONTACT_PAGE: _contact_page,
+}
+
+
+def get_page_queryset(page):
+    """
+    queryset of the websites loading everything displayed by `page`:
+    the related sets are stored in lists named after them (`hosts`, `photos`, `reviews`, ...)
+    """
+    fields, prefetches = PAGES[page]()
+    queryset = Website.objects.only(*WEBSITE_FIELDS, *fields).prefetch_related(*prefetches)
+    if any(field.startswith("location__") for field in fields):
+        queryset = queryset.select_related("location")
+    return queryset
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("websites", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="website",
+            name="refreshed_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="website",
+            name="section_hashes",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name="websitephoto",
+            name="position",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="websitephoto",
+            name="source_url",
+            field=models.URLField(blank=True, default="", max_length=500),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("websites", "0003_media_blob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="review",
+            name="variants",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="websitehost",
+            name="variants",
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name="websitephoto",
+            name="variants",
+            field=models.JSONField(blank=True, default=list),
+        ),
+    ]
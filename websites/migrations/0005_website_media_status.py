@@ -0,0 +1,25 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("websites", "0004_image_variants"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="website",
+            name="media_status",
+            field=models.CharField(
+                choices=[
+                    ("pending", "pending"),
+                    ("ready", "ready"),
+                    ("failed", "failed"),
+                ],
+                default="ready",
+                max_length=16,
+            ),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("websites", "0005_website_media_status"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="website",
+            name="deleted_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("websites", "0006_website_deleted_date"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="website",
+            name="export_path",
+            field=models.CharField(blank=True, default="", max_length=255),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("websites", "0007_website_export_path"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="website",
+            name="export_fingerprint",
+            field=models.CharField(blank=True, default="", max_length=16),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("websites", "0008_website_export_fingerprint"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="website",
+            name="content_version",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.5 on 2026-10-18 10:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("websites", "0009_website_content_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="website",
+            name="sync_attempt_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="website",
+            name="sync_failures",
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
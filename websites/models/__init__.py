@@ -2,6 +2,7 @@ from .equipment import *  # noqa: F401, F403
 from .highlight import *  # noqa: F401, F403
 from .host import *  # noqa: F401, F403
 from .location import *  # noqa: F401, F403
+from .media import *  # noqa: F401, F403
 from .photo import *  # noqa: F401, F403
 from .review import *  # noqa: F401, F403
 from .room import *  # noqa: F401, F403
@@ -3,6 +3,8 @@ from django.db.models.signals import pre_delete
 from django.dispatch import receiver
 
 from websites.utils import get_photo_dir_path
+from websites.images import get_srcset
+from .media import MediaBlob
 
 
 HOST_NAME_LENGTH = 64
@@ -15,6 +17,8 @@ class WebsiteHost(models.Model):
     languages = models.CharField(max_length=HOST_LANGUAGES_LENGTH)
     website = models.ForeignKey("websites.Website", on_delete=models.CASCADE)
     picture = models.ImageField(upload_to=get_photo_dir_path)
+    # resized WebP variants of the image [{"width": ..., "name": ...}], the smallest first
+    variants = models.JSONField(default=list, blank=True)
 
     def __str__(self):
         return self.name
@@ -22,8 +26,13 @@ class WebsiteHost(models.Model):
     def picture_url(self):
         return self.picture.url
 
+    def srcset(self):
+        return get_srcset(self.picture.storage, self.variants)
+
 
 @receiver(pre_delete, sender=WebsiteHost)
 def delete_host(sender, instance, **kwargs):
     if instance.picture:
-        instance.picture.delete(save=False)
+        MediaBlob.release(
+            [instance.picture.name], instance.picture.storage, [v["name"] for v in instance.variants]
+        )
@@ -0,0 +1,100 @@
+from collections import Counter
+
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from websites.images import is_variant_of
+from websites.utils import delete_storage_files
+
+MEDIA_NAME_LENGTH = 255
+
+
+def _group_by_count(counts):
+    """ group the names of `counts` ({name: count}) by count, to update them with one query per count """
+    groups = {}
+    for name, count in counts.items():
+        groups.setdefault(count, []).append(name)
+    return groups.items()
+
+
+def _with_variants(names, variants):
+    """ the files `names` and, among `variants`, their variants """
+    return names + [v for v in variants if any(is_variant_of(v, name) for name in names)]
+
+
+class MediaBlob(models.Model):
+    """
+    Media file stored once, under the hash of its content (see `store_media_file`), and shared
+    by all the records (photos, review and host pictures) referencing it.
+    The file is removed from the storage when its last reference is released.
+
+    Files are stored before being referenced: a file is only deleted while its blob is locked, and a file
+    referenced for the first time is checked while its blob is locked, so that a file deleted meanwhile
+    by the release of its last reference is never referenced.
+    """
+    name = models.CharField(max_length=MEDIA_NAME_LENGTH, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count})"
+
+    def acquire(names, storage):
+        """
+        add a reference to the media files `names` (a name can be repeated), stored in the `storage`.
+        Raises FileNotFoundError if a file isn't stored anymore: must be called in the transaction
+        saving the records, so that they're rolled back.
+        """
+        counts = Counter(name for name in names if name)
+        if not counts:
+            return
+        with transaction.atomic():
+            MediaBlob.objects.bulk_create([MediaBlob(name=name) for name in counts], ignore_conflicts=True)
+            # the files of the locked blobs can't be deleted until the transaction is committed
+            unreferenced = list(
+                MediaBlob.objects.select_for_update().filter(name__in=counts)
+                .filter(ref_count=0).values_list("name", flat=True)
+            )
+            missing = [name for name in unreferenced if not storage.exists(name)]
+            if missing:
+                raise FileNotFoundError(f"media files deleted while being referenced: {missing}")
+            for count, group in _group_by_count(counts):
+                MediaBlob.objects.filter(name__in=group).update(ref_count=F("ref_count") + count)
+
+    def _delete_unreferenced(names, storage, variants):
+        """
+        delete the media files `names` (and their `variants`) which are not referenced, while their blob is
+        locked: a concurrent `acquire` of the same files waits for the deletion, and sees them missing
+        """
+        with transaction.atomic():
+            MediaBlob.objects.bulk_create([MediaBlob(name=name) for name in names], ignore_conflicts=True)
+            unreferenced = list(
+                MediaBlob.objects.select_for_update().filter(name__in=names, ref_count=0)
+                .values_list("name", flat=True)
+            )
+            delete_storage_files(storage, _with_variants(unreferenced, variants))
+            MediaBlob.objects.filter(name__in=unreferenced).delete()
+
+    def release(names, storage, variants=()):
+        """
+        remove a reference to the media files `names` and delete, once the transaction is committed,
+        the files which are no more referenced, with their `variants`.
+        Files stored before the media store (without blob) belong to a single record: they are deleted.
+        """
+        counts = Counter(name for name in names if name)
+        if not counts:
+            return
+        for count, group in _group_by_count(counts):
+            MediaBlob.objects.filter(name__in=group).update(
+                ref_count=Greatest(F("ref_count") - count, 0)
+            )
+        transaction.on_commit(lambda: MediaBlob._delete_unreferenced(list(counts), storage, list(variants)))
+
+    def discard(names, storage, variants=()):
+        """
+        delete the media files `names` (and their `variants`), stored but never referenced,
+        unless they are referenced meanwhile
+        """
+        names = list(set(name for name in names if name))
+        if names:
+            MediaBlob._delete_unreferenced(names, storage, list(variants))
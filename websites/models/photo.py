@@ -3,14 +3,22 @@ from django.db.models.signals import pre_delete
 from django.dispatch import receiver
 
 from websites.utils import get_photo_dir_path
+from websites.images import get_srcset
+from .media import MediaBlob
 
 CAPTION_LENGTH = 255
+SOURCE_URL_LENGTH = 500
 
 
 class WebsitePhoto(models.Model):
     image = models.ImageField(upload_to=get_photo_dir_path)
     website = models.ForeignKey("websites.Website", on_delete=models.CASCADE)
     caption = models.CharField(max_length=CAPTION_LENGTH)
+    # resized WebP variants of the image [{"width": ..., "name": ...}], the smallest first
+    variants = models.JSONField(default=list, blank=True)
+    # url of the photo on the rental platform, used to diff the photos on refresh
+    source_url = models.URLField(max_length=SOURCE_URL_LENGTH, blank=True, default="")
+    position = models.IntegerField(default=0)
 
     def __str__(self):
         return self.image.name
@@ -18,7 +26,13 @@ class WebsitePhoto(models.Model):
     def url(self):
         return self.image.url
 
+    def srcset(self):
+        return get_srcset(self.image.storage, self.variants)
+
+
 @receiver(pre_delete, sender=WebsitePhoto)
 def delete_photo(sender, instance, **kwargs):
     if instance.image:
-        instance.image.delete(save=False)
+        MediaBlob.release(
+            [instance.image.name], instance.image.storage, [v["name"] for v in instance.variants]
+        )
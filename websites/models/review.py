@@ -3,6 +3,8 @@ from django.db.models.signals import pre_delete
 from django.dispatch import receiver
 
 from websites.utils import get_review_dir_path
+from websites.images import get_srcset
+from .media import MediaBlob
 
 AUTHOR_NAME_LENGTH = 64
 LANGUAGE_LENGTH = 8
@@ -11,6 +13,8 @@ LANGUAGE_LENGTH = 8
 class Review(models.Model):
     author_name = models.CharField(max_length=AUTHOR_NAME_LENGTH)
     author_picture = models.ImageField(upload_to=get_review_dir_path)
+    # resized WebP variants of the image [{"width": ..., "name": ...}], the smallest first
+    variants = models.JSONField(default=list, blank=True)
     review = models.TextField()
     date = models.DateField()
     language = models.CharField(max_length=LANGUAGE_LENGTH)
@@ -22,8 +26,13 @@ class Review(models.Model):
     def picture_url(self):
         return self.author_picture.url
 
+    def srcset(self):
+        return get_srcset(self.author_picture.storage, self.variants)
+
 
 @receiver(pre_delete, sender=Review)
 def delete_review(sender, instance, **kwargs):
     if instance.author_picture:
-        instance.author_picture.delete(save=False)
+        MediaBlob.release(
+            [instance.author_picture.name], instance.author_picture.storage, [v["name"] for v in instance.variants]
+        )
@@ -1,23 +1,33 @@
+import hashlib
+import json
 import logging
 from shortuuid import ShortUUID
 import time
 
 from django.conf import settings
-from django.db import models
+from django.core.files.storage import default_storage
+from django.db import models, transaction
 from django.db.models.signals import pre_delete
 from django.dispatch import receiver
-from django.utils import html
-from django.core.files import File
+from django.utils import html, timezone
 
 from allauth.utils import get_user_model
 
 from websites.config import MAX_WEBSITES_COUNT
 from websites.utils import (
+    count_queries,
+    delete_storage_prefix,
     get_filename_from_url,
     download_media_file,
+    get_extension_from_url,
+    ingest_concurrently,
     save_debug_data,
+    store_media_file,
 )
+from websites.images import store_image_variants
+from websites.page_cache import forget_website_pages, invalidate_website_pages
 from .location import WebsiteLocation
+from .media import MediaBlob
 from .photo import WebsitePhoto
 from .review import Review
 from .host import WebsiteHost
@@ -26,7 +36,7 @@ from .room import Room, RoomDetail
 from .rule import Rule
 from .equipment import Equipment, EquipmentArea
 
-from ..utils import delete_debug_data
+from ..storage_backends import private_storage
 
 User = get_user_model()
 
@@ -36,15 +46,79 @@ NAME_LENGTH = 255
 HOST_PICTURE_FILENAME = "host.jpg"
 EXPECTED_DATA_KEYS = ["name", "description", "photos"]
 
+# status of the media files of a website, whose ingestion may be deferred (see `Website.create`)
+MEDIA_STATUS_PENDING = "pending"
+MEDIA_STATUS_READY = "ready"
+MEDIA_STATUS_FAILED = "failed"
+MEDIA_STATUS_CHOICES = [
+    (MEDIA_STATUS_PENDING, "pending"),
+    (MEDIA_STATUS_READY, "ready"),
+    (MEDIA_STATUS_FAILED, "failed"),
+]
+# sections whose media files are ingested in background when the ingestion is deferred
+DEFERRED_MEDIA_SECTIONS = ["photos", "reviews"]
+
+# directory of the static exports of the websites in the public media storage (see `websites.export`)
+EXPORTS_DIR = "sites"
+
+# sections of the scrapped data refreshed independently => keys of the data in the section
+SECTIONS = {
+    "general": ["name", "description", "general_info", "location"],
+    "host": ["host"],
+    "photos": ["photos"],
+    "reviews": ["reviews"],
+    "equipments": ["equipments"],
+    "rooms": ["rooms"],
+    "house_rules": ["house_rules"],
+    "highlights": ["highlights"],
+}
+
 _logger = logging.getLogger('websites')
 
 
+class WebsiteManager(models.Manager):
+    """ websites being deleted in background are hidden """
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_date=None)
+
+
+def _delete_without_signals(queryset):
+    """
+    delete the rows of `queryset` with a single SQL delete, without sending the delete signals.
+    Their related rows must be deleted before: nothing is cascaded.
+
+    `QuerySet.delete` has no public way to skip the signals: `QuerySet._raw_delete` is the private bulk delete
+    it uses when there are neither signals nor cascades. It's checked by `test_delete_without_signals`,
+    pinned to the Django version of the requirements: check it again when upgrading Django.
+    """
+    return queryset._raw_delete(queryset.db)
+
+
 class Website(models.Model):
     key = models.CharField(max_length=KEY_LENGTH)
     rental_url = models.URLField()
     name = models.CharField(max_length=NAME_LENGTH, default="")
     description = models.TextField()
     generated_date = models.DateTimeField(auto_now_add=True)
+    refreshed_date = models.DateTimeField(null=True, blank=True)
+    # content hash of each section of the scrapped data, to skip unchanged sections on refresh
+    section_hashes = models.JSONField(default=dict, blank=True)
+    media_status = models.CharField(max_length=16, choices=MEDIA_STATUS_CHOICES, default=MEDIA_STATUS_READY)
+    # set when the website is hidden, before being deleted in background (see `purge`)
+    deleted_date = models.DateTimeField(null=True, blank=True)
+    # directory of the last static export of the website in the public media storage
+    export_path = models.CharField(max_length=255, blank=True, default="")
+    # fingerprint of the templates the last static export was rendered with
+    export_fingerprint = models.CharField(max_length=16, blank=True, default="")
+    # incremented every time the content of the pages changes, part of their version (see `get_page_versions`)
+    content_version = models.PositiveIntegerField(default=0)
+    # last attempt of the periodic sync to refresh the website, and the number of its consecutive failures
+    sync_attempt_date = models.DateTimeField(null=True, blank=True)
+    sync_failures = models.PositiveIntegerField(default=0)
+
+    objects = WebsiteManager()
+    all_objects = models.Manager()
 
     bedroom_count = models.IntegerField()
     bed_count = models.IntegerField()
@@ -77,96 +151,254 @@ class Website(models.Model):
         )
 
     def _create_photo(self, filename, content, caption):
-        photo = WebsitePhoto.objects.create(caption=caption, website=self)
-        photo.image.save(filename, File(content))
-        photo.save()
-
-    def _create_photos(self, photos):
-        for p in photos:
-            if all(f in p for f in ["url", "caption"]):
-                filename = get_filename_from_url(p["url"])
-                photo_content = download_media_file(p["url"], filename)
-                if photo_content:
-                    self._create_photo(filename, photo_content, p["caption"])
-
-    def _create_reviews(self, reviews):
-        for r in reviews:
-            filename = get_filename_from_url(r["author_picture_url"])
-            media_file = download_media_file(r["author_picture_url"], filename)
-            if media_file:
-                review = Review(
-                    author_name=r["author_name"],
-                    review=r["review"],
-                    date=r["date"],
-                    language=r["language"],
-                    website=self
-                )
-                review.save()
-                review.author_picture.save(filename, File(media_file))
-                review.save()
-
-    def _create_location(location_data):
-        location = WebsiteLocation(
-            title=location_data["title"],
-            latitude=location_data["coords"]["lat"],
-            longitude=location_data["coords"]["lng"],
+        """
+        upload the photo `content` in the storage and return the related record, not yet saved.
+        Called from the ingestion threads so it must not access the database.
+        """
+        photo = WebsitePhoto(caption=caption, website=self)
+        photo.image.name = store_media_file(photo.image.storage, content, get_extension_from_url(filename))
+        photo.variants = store_image_variants(photo.image.storage, photo.image.name, content)
+        return photo
+
+    def _use_stored_media(record, media_file, stored_media, url):
+        """
+        use for the `media_file` of `record` the media file of `url` already stored by `store_media`.
+        Returns False if it couldn't be stored.
+        """
+        stored = stored_media.get(url)
+        if not stored:
+            return False
+        media_file.name = stored["name"]
+        record.variants = stored["variants"]
+        return True
+
+    def _ingest_photo(self, photo_data, stored_media=None):
+        """
+        download and upload a photo described by `photo_data`,
+        or use its media file already stored when `stored_media` is given (see `store_media`)
+        """
+        if stored_media is not None:
+            photo = WebsitePhoto(caption=photo_data["caption"], website=self, source_url=photo_data["url"])
+            return photo if Website._use_stored_media(photo, photo.image, stored_media, photo_data["url"]) else None
+
+        filename = get_filename_from_url(photo_data["url"])
+        photo_content = download_media_file(photo_data["url"], filename)
+        if not photo_content:
+            return None
+        with photo_content:
+            photo = self._create_photo(filename, photo_content, photo_data["caption"])
+        photo.source_url = photo_data["url"]
+        return photo
+
+    def _ingest_photos(self, photos, stored_media=None):
+        """
+        download/upload all the photos concurrently and return the records, not yet saved,
+        in the same order as `photos` (the first one being the main photo).
+        """
+        photos = Website._valid_photos(photos)
+        if stored_media is not None:
+            return [p for p in (self._ingest_photo(p, stored_media) for p in photos) if p]
+        return [p for p in ingest_concurrently(self._ingest_photo, photos) if p]
+
+    def _valid_photos(photos):
+        return [p for p in photos if all(f in p for f in ["url", "caption"])]
+
+    def _ingest_review(self, review_data, stored_media=None):
+        """
+        download/upload the author picture of a review and return the review record, not yet saved.
+        The picture already stored is used when `stored_media` is given (see `store_media`).
+        """
+        review = Review(
+            author_name=review_data["author_name"],
+            review=review_data["review"],
+            date=review_data["date"],
+            language=review_data["language"],
+            website=self
         )
-        location.save()
-        return location
+        if stored_media is not None:
+            url = review_data["author_picture_url"]
+            return review if Website._use_stored_media(review, review.author_picture, stored_media, url) else None
+
+        filename = get_filename_from_url(review_data["author_picture_url"])
+        media_file = download_media_file(review_data["author_picture_url"], filename)
+        if not media_file:
+            return None
+
+        with media_file:
+            review.author_picture.name = store_media_file(
+                review.author_picture.storage, media_file, get_extension_from_url(filename)
+            )
+            review.variants = store_image_variants(
+                review.author_picture.storage, review.author_picture.name, media_file
+            )
+        return review
+
+    def _ingest_reviews(self, reviews, stored_media=None):
+        if stored_media is not None:
+            return [r for r in (self._ingest_review(r, stored_media) for r in reviews) if r]
+        return [r for r in ingest_concurrently(self._ingest_review, reviews) if r]
+
+    def _ingest_host(self, host_data, stored_media=None):
+        """
+        download/upload the host picture and return the host record, not yet saved.
+        The picture already stored is used when `stored_media` is given (see `store_media`).
+        """
+        if not host_data:
+            return None
+
+        host = WebsiteHost(
+            name=host_data["name"],
+            description=host_data["description"],
+            languages=",".join(host_data["languages"] or []),
+            website=self,
+        )
+        if stored_media is not None:
+            url = host_data["picture_url"]
+            return host if Website._use_stored_media(host, host.picture, stored_media, url) else None
 
-    def _create_host(self, host_data):
         media_file = download_media_file(host_data["picture_url"], HOST_PICTURE_FILENAME)
-        if media_file:
-            host = WebsiteHost(
-                name=host_data["name"],
-                description=host_data["description"],
-                languages=",".join(host_data["languages"]),
-                website=self,
+        if not media_file:
+            return None
+
+        with media_file:
+            host.picture.name = store_media_file(
+                host.picture.storage, media_file, get_extension_from_url(HOST_PICTURE_FILENAME)
             )
-            host.save()
-            host.picture.save(HOST_PICTURE_FILENAME, File(media_file))
+            host.variants = store_image_variants(host.picture.storage, host.picture.name, media_file)
+        return host
+
+    def _build_location(location_data):
+        return WebsiteLocation(
+            title=location_data["title"],
+            latitude=location_data["coords"]["lat"],
+            longitude=location_data["coords"]["lng"],
+        )
 
     def _create_equipments(self, equipment_data):
         # create equipments
-        equipments = dict()
-        for id, equipment in equipment_data["equipments"].items():
-            equipments[id] = Equipment(
-                name=equipment["name"], description=equipment["description"]
-            )
-            equipments[id].save()
-
-        # create areas
-        for area in equipment_data["areas"]:
-            new_area = EquipmentArea(name=area["name"], website=self)
-            new_area.save()
-            for id in area["equipments"]:
-                if id in equipments:
-                    new_area.equipments.add(equipments[id])
+        equipments = dict(zip(
+            equipment_data.get("equipments", {}).keys(),
+            Equipment.objects.bulk_create([
+                Equipment(name=e["name"], description=e["description"])
+                for e in equipment_data.get("equipments", {}).values()
+            ]),
+        ))
+
+        # create areas and link them to their equipments
+        areas_data = equipment_data.get("areas", [])
+        areas = EquipmentArea.objects.bulk_create([
+            EquipmentArea(name=area["name"], website=self) for area in areas_data
+        ])
+        EquipmentArea.equipments.through.objects.bulk_create([
+            EquipmentArea.equipments.through(equipmentarea_id=area.id, equipment_id=equipments[id].id)
+            for area, area_data in zip(areas, areas_data)
+            for id in dict.fromkeys(area_data["equipments"])
+            if id in equipments
+        ])
 
     def _create_highlights(self, highlight_data):
-        for h in highlight_data:
-            Highlight(title=h["headline"], message=h["message"], website=self).save()
+        Highlight.objects.bulk_create([
+            Highlight(title=h["headline"], message=h["message"], website=self) for h in highlight_data
+        ])
 
     def _create_rules(self, rules_data):
-        for r in rules_data:
-            Rule(name=r, website=self).save()
+        Rule.objects.bulk_create([Rule(name=r, website=self) for r in rules_data])
 
     def _create_rooms(self, rooms_data):
-        for r in rooms_data:
-            new_room = Room(name=r["name"], website=self)
-            new_room.save()
-            for d in r["details"]:
-                RoomDetail(detail=d, room=new_room).save()
+        rooms = Room.objects.bulk_create([Room(name=r["name"], website=self) for r in rooms_data])
+        RoomDetail.objects.bulk_create([
+            RoomDetail(detail=d, room=room)
+            for room, room_data in zip(rooms, rooms_data)
+            for d in room_data["details"]
+        ])
+
+    def _get_media_files(records):
+        """ get the media files of `records` """
+        return [
+            getattr(record, field.name)
+            for record in records
+            for field in record._meta.fields
+            if isinstance(field, models.FileField) and getattr(record, field.name)
+        ]
+
+    def _acquire_media_files(records):
+        """ reference the media files of `records`, shared by the websites, in the media store """
+        media_files = Website._get_media_files(records)
+        if media_files:
+            MediaBlob.acquire([media.name for media in media_files], media_files[0].storage)
+
+    def _delete_media_files(records):
+        """ remove from the storage the media files uploaded for `records` (not saved), unless they're shared """
+        media_files = Website._get_media_files(records)
+        if media_files:
+            MediaBlob.discard(
+                [media.name for media in media_files],
+                media_files[0].storage,
+                [v["name"] for record in records for v in record.variants],
+            )
+
+    def _get_created_media(data, defer_media):
+        """ media files ingested by `create`: [(url, filename)] """
+        media = []
+        if data.get("host"):
+            media.append((data["host"]["picture_url"], HOST_PICTURE_FILENAME))
+        photos = Website._valid_photos(data.get("photos") or [])
+        media += [(p["url"], get_filename_from_url(p["url"])) for p in (photos[:1] if defer_media else photos)]
+        if not defer_media:
+            media += [
+                (r["author_picture_url"], get_filename_from_url(r["author_picture_url"]))
+                for r in data.get("reviews") or []
+            ]
+        return media
+
+    def _store_media_file(media):
+        """ download/upload the media file `media` (url, filename), returns its name and variants or None """
+        url, filename = media
+        media_file = download_media_file(url, filename)
+        if not media_file:
+            return None
+        with media_file:
+            name = store_media_file(default_storage, media_file, get_extension_from_url(filename))
+            return {"name": name, "variants": store_image_variants(default_storage, name, media_file)}
 
-    def create(user_id, url, data):
-        """create a new website based on data received from the scrapper"""
+    def store_media(data, defer_media=False):
+        """
+        download/upload the media files ingested by `create`, without any database access: used to ingest them
+        on the media queue before the website is created. Returns {url: {"name": ..., "variants": ...}},
+        to give to `create` as `stored_media`, without the media files which couldn't be ingested.
+        """
+        media = Website._get_created_media(data, defer_media)
+        stored = ingest_concurrently(Website._store_media_file, media)
+        return {url: m for (url, _), m in zip(media, stored) if m}
+
+    def discard_stored_media(stored_media):
+        """ remove from the storage the media files stored by `store_media`, unless they're shared """
+        if stored_media:
+            MediaBlob.discard(
+                [m["name"] for m in stored_media.values()],
+                default_storage,
+                [v["name"] for m in stored_media.values() for v in m["variants"]],
+            )
+
+    def create(user_id, url, data, defer_media=False, stored_media=None):
+        """
+        create a new website based on data received from the scrapper.
+
+        Media files are first downloaded/uploaded, then all the records are inserted in bulk
+        inside a single transaction: a failure does not leave a half-created website.
+        A website whose host (with its picture) can't be ingested is not created: ValueError is raised.
+        When they're already stored by `store_media`, given as `stored_media`, no media file is downloaded
+        (the caller discards them if the website isn't created, see `discard_stored_media`).
+
+        With `defer_media`, only the host picture and the main photo are ingested: the website
+        is published with a pending media status, and `ingest_deferred_media` must be called
+        (in background) to ingest the other photos and the reviews.
+        """
 
         # sanity checks
         if not all([k in data for k in EXPECTED_DATA_KEYS]):
             return False
 
-        # create the website
-        location = Website._create_location(data["location"])
         website = Website(
             key=Website._generate_key(),
             user=User.objects.get(id=user_id),
@@ -177,21 +409,50 @@ class Website(models.Model):
             bedroom_count=data["general_info"]["bedroom_count"],
             bed_count=data["general_info"]["bed_count"],
             bathroom_count=data["general_info"]["bathroom_count"],
-            location=location,
+            location=Website._build_location(data["location"]),
+            section_hashes=Website._compute_section_hashes(data),
         )
-        website.save()
-        website._create_host(data["host"])
+        if defer_media:
+            # deferred sections are not up-to-date until their media files are ingested
+            website.media_status = MEDIA_STATUS_PENDING
+            for section in DEFERRED_MEDIA_SECTIONS:
+                del website.section_hashes[section]
 
+        # download/upload media files, no database access is done here
         start = time.time()
-        website._create_photos(data["photos"])
+        host = website._ingest_host(data["host"], stored_media)
+        photos = website._ingest_photos(
+            Website._valid_photos(data["photos"])[:1] if defer_media else data["photos"], stored_media
+        )
+        for position, photo in enumerate(photos):
+            photo.position = position
+        reviews = website._ingest_reviews([] if defer_media else data["reviews"], stored_media)
+        media_records = ([host] if host else []) + photos + reviews
         end = time.time()
-        _logger.info("create_photo: %s", end - start)
+        _logger.info("ingest media: %s", end - start)
 
-        website._create_reviews(data["reviews"])
-        website._create_equipments(data["equipments"])
-        website._create_highlights(data["highlights"])
-        website._create_rules(data["house_rules"])
-        website._create_rooms(data["rooms"])
+        # persist all the records
+        try:
+            # the pages of a website can't be rendered without its host
+            if not host:
+                raise ValueError(f"unable to ingest the host of the website {{'url': {url}}}")
+            start = time.time()
+            with count_queries() as queries, transaction.atomic():
+                website.location.save()
+                website.save()
+                host.save()
+                WebsitePhoto.objects.bulk_create(photos)
+                Review.objects.bulk_create(reviews)
+                Website._acquire_media_files(media_records)
+                website._create_equipments(data["equipments"])
+                website._create_highlights(data["highlights"])
+                website._create_rules(data["house_rules"])
+                website._create_rooms(data["rooms"])
+            end = time.time()
+        except Exception:
+            Website._delete_media_files(media_records)
+            raise
+        _logger.info("persist: %s, queries: %s", end - start, queries.count)
 
         # for debugging purpose, store data received from the scrapper
         if settings.USE_DEBUG_DATA_STORAGE:
@@ -199,6 +460,398 @@ class Website(models.Model):
 
         return website
 
+    def _compute_section_hashes(data):
+        """ compute the content hash of each section of the scrapped `data` """
+        return {
+            section: hashlib.sha1(
+                json.dumps([data.get(k) for k in keys], sort_keys=True, default=str).encode("utf-8")
+            ).hexdigest()
+            for section, keys in SECTIONS.items()
+        }
+
+    def _diff_records(records, items, record_key, item_key):
+        """
+        diff the existing `records` with the new `items`, matched by their key (duplicates included).
+        Returns the records to delete and the items to create.
+        """
+        remaining = {}
+        for record in records:
+            remaining.setdefault(record_key(record), []).append(record)
+
+        to_create = []
+        for item in items:
+            matching = remaining.get(item_key(item))
+            if matching:
+                matching.pop()
+            else:
+                to_create.append(item)
+        return [r for records in remaining.values() for r in records], to_create
+
+    def _refresh_general(self, data):
+        self.name = data["name"]
+        self.description = Website._generate_description(data["description"])
+        self.guest_count = data["general_info"]["guest_count"]
+        self.bedroom_count = data["general_info"]["bedroom_count"]
+        self.bed_count = data["general_info"]["bed_count"]
+        self.bathroom_count = data["general_info"]["bathroom_count"]
+
+        location = Website._build_location(data["location"])
+        location.id = self.location_id
+        self.location = location
+
+    def _diff_photos(self, photos_data):
+        """
+        diff the existing photos with `photos_data` by their source url: only new photos are ingested.
+        Returns the photos to create, to update (caption or position) and to delete.
+
+        Photos without source url (created before it was stored) can't be matched: they are replaced.
+        """
+        photos_data = Website._valid_photos(photos_data)
+        existing = {}
+        unmatched = []
+        for photo in WebsitePhoto.objects.filter(website=self):
+            if photo.source_url and photo.source_url not in existing:
+                existing[photo.source_url] = photo
+            else:
+                unmatched.append(photo)
+        new_photos = {
+            p.source_url: p
+            for p in self._ingest_photos([p for p in photos_data if p["url"] not in existing])
+        }
+
+        to_update = []
+        for position, photo_data in enumerate(photos_data):
+            photo = existing.get(photo_data["url"])
+            if photo is None:
+                photo = new_photos.get(photo_data["url"])
+                if photo:
+                    photo.position = position
+            elif (photo.caption, photo.position) != (photo_data["caption"], position):
+                photo.caption = photo_data["caption"]
+                photo.position = position
+                to_update.append(photo)
+
+        urls = {p["url"] for p in photos_data}
+        to_delete = unmatched + [p for url, p in existing.items() if url not in urls]
+        complete = len(new_photos) == len([p for p in photos_data if p["url"] not in existing])
+        return list(new_photos.values()), to_update, to_delete, complete
+
+    def _diff_reviews(self, reviews_data):
+        """ diff the existing reviews with `reviews_data`: only new reviews are ingested """
+        to_delete, to_create = Website._diff_records(
+            Review.objects.filter(website=self),
+            reviews_data,
+            lambda r: (r.author_name, str(r.date), r.review),
+            lambda r: (r["author_name"], str(r["date"]), r["review"]),
+        )
+        new_reviews = self._ingest_reviews(to_create)
+        return new_reviews, to_delete, len(new_reviews) == len(to_create)
+
+    def _refresh_equipments(self, equipment_data):
+        def _area_key(name, equipments):
+            return (name, tuple(sorted(equipments)))
+
+        equipments_data = equipment_data.get("equipments", {})
+        to_delete, to_create = Website._diff_records(
+            EquipmentArea.objects.filter(website=self).prefetch_related("equipments"),
+            equipment_data.get("areas", []),
+            lambda a: _area_key(a.name, [(e.name, e.description) for e in a.equipments.all()]),
+            lambda a: _area_key(a["name"], [
+                (equipments_data[id]["name"], equipments_data[id]["description"])
+                for id in dict.fromkeys(a["equipments"]) if id in equipments_data
+            ]),
+        )
+
+        # equipments are shared by the areas of the website: only orphan equipments are deleted
+        if to_delete:
+            equipment_ids = list(
+                Equipment.objects.filter(equipmentarea__in=to_delete).values_list("id", flat=True)
+            )
+            EquipmentArea.objects.filter(id__in=[a.id for a in to_delete]).delete()
+            Equipment.objects.filter(id__in=equipment_ids, equipmentarea=None).delete()
+
+        if to_create:
+            used_ids = {id for area in to_create for id in area["equipments"]}
+            self._create_equipments({
+                "areas": to_create,
+                "equipments": {id: e for id, e in equipments_data.items() if id in used_ids},
+            })
+
+    def _refresh_highlights(self, highlight_data):
+        to_delete, to_create = Website._diff_records(
+            Highlight.objects.filter(website=self),
+            highlight_data,
+            lambda h: (h.title, h.message),
+            lambda h: (h["headline"], h["message"]),
+        )
+        Highlight.objects.filter(id__in=[h.id for h in to_delete]).delete()
+        self._create_highlights(to_create)
+
+    def _refresh_rules(self, rules_data):
+        to_delete, to_create = Website._diff_records(
+            Rule.objects.filter(website=self), rules_data, lambda r: r.name, lambda r: r,
+        )
+        Rule.objects.filter(id__in=[r.id for r in to_delete]).delete()
+        self._create_rules(to_create)
+
+    def _refresh_rooms(self, rooms_data):
+        to_delete, to_create = Website._diff_records(
+            Room.objects.filter(website=self).prefetch_related("roomdetail_set"),
+            rooms_data,
+            lambda r: (r.name, tuple(d.detail for d in r.roomdetail_set.all())),
+            lambda r: (r["name"], tuple(r["details"])),
+        )
+        Room.objects.filter(id__in=[r.id for r in to_delete]).delete()
+        self._create_rooms(to_create)
+
+    def refresh(self, data):
+        """
+        update the website with new data received from the scrapper.
+
+        Sections whose content hash didn't change are skipped. The other ones are diffed with
+        the existing records: only new media files are downloaded and only changed rows are
+        written or deleted. Returns the names of the refreshed sections (None if the data is invalid).
+        """
+
+        # sanity checks
+        if not all([k in data for k in EXPECTED_DATA_KEYS]):
+            return None
+
+        hashes = Website._compute_section_hashes(data)
+        changed = [s for s, h in hashes.items() if self.section_hashes.get(s) != h]
+        if not changed:
+            self.refreshed_date = timezone.now()
+            self.save(update_fields=["refreshed_date"])
+            return []
+
+        # download/upload the new media files
+        start = time.time()
+        incomplete = set()
+        host = None
+        if "host" in changed:
+            host = self._ingest_host(data["host"])
+            if not host:
+                # keep the current host until its new picture can be downloaded
+                incomplete.add("host")
+        new_photos, updated_photos, deleted_photos = [], [], []
+        if "photos" in changed:
+            new_photos, updated_photos, deleted_photos, complete = self._diff_photos(data["photos"])
+            if not complete:
+                incomplete.add("photos")
+        new_reviews, deleted_reviews = [], []
+        if "reviews" in changed:
+            new_reviews, deleted_reviews, complete = self._diff_reviews(data["reviews"])
+            if not complete:
+                incomplete.add("reviews")
+        media_records = ([host] if host else []) + new_photos + new_reviews
+        end = time.time()
+        _logger.info("refresh media: %s", end - start)
+
+        # persist the changes, the sections which couldn't be fully refreshed keep their previous
+        # hash so that they are refreshed again the next time
+        try:
+            start = time.time()
+            with count_queries() as queries, transaction.atomic():
+                # the new media files are referenced before releasing the old ones, which may be the same
+                Website._acquire_media_files(media_records)
+                update_fields = ["section_hashes", "refreshed_date"]
+                if "general" in changed:
+                    self._refresh_general(data)
+                    self.location.save()
+                    update_fields += [
+                        "name", "description", "guest_count", "bedroom_count", "bed_count", "bathroom_count"
+                    ]
+                if "host" in changed and "host" not in incomplete:
+                    WebsiteHost.objects.filter(website=self).delete()
+                    host.save()
+                WebsitePhoto.objects.bulk_create(new_photos)
+                WebsitePhoto.objects.bulk_update(updated_photos, ["caption", "position"])
+                Review.objects.bulk_create(new_reviews)
+                WebsitePhoto.objects.filter(id__in=[p.id for p in deleted_photos]).delete()
+                Review.objects.filter(id__in=[r.id for r in deleted_reviews]).delete()
+                if "equipments" in changed:
+                    self._refresh_equipments(data["equipments"])
+                if "highlights" in changed:
+                    self._refresh_highlights(data["highlights"])
+                if "house_rules" in changed:
+                    self._refresh_rules(data["house_rules"])
+                if "rooms" in changed:
+                    self._refresh_rooms(data["rooms"])
+
+                self.section_hashes = {
+                    s: self.section_hashes.get(s) if s in incomplete else h for s, h in hashes.items()
+                }
+                self.refreshed_date = timezone.now()
+                self.save(update_fields=update_fields)
+                self._content_changed()
+            end = time.time()
+        except Exception:
+            Website._delete_media_files(media_records)
+            raise
+        refreshed = [s for s in changed if s not in incomplete]
+        _logger.info("refresh: %s, sections: %s, queries: %s", end - start, refreshed, queries.count)
+
+        return refreshed
+
+    def ingest_media(self, photos_data, reviews_data):
+        """
+        ingest the photos and the reviews not stored yet, with their media files.
+        Used to ingest the deferred media files by chunks, in parallel: the order of the photos
+        is restored by `ingest_deferred_media`. Returns the number of ingested records.
+        """
+        stored_urls = set(WebsitePhoto.objects.filter(website=self).values_list("source_url", flat=True))
+        photos = self._ingest_photos([p for p in Website._valid_photos(photos_data) if p["url"] not in stored_urls])
+        _, reviews_data = Website._diff_records(
+            Review.objects.filter(website=self),
+            reviews_data,
+            lambda r: (r.author_name, str(r.date), r.review),
+            lambda r: (r["author_name"], str(r["date"]), r["review"]),
+        )
+        reviews = self._ingest_reviews(reviews_data)
+        media_records = photos + reviews
+
+        try:
+            with transaction.atomic():
+                WebsitePhoto.objects.bulk_create(photos)
+                Review.objects.bulk_create(reviews)
+                Website._acquire_media_files(media_records)
+                self._content_changed()
+        except Exception:
+            Website._delete_media_files(media_records)
+            raise
+        return len(media_records)
+
+    def ingest_deferred_media(self, data):
+        """
+        ingest the media files deferred by `create`: the photos and the reviews are refreshed
+        (media files already stored are not ingested again) and the media status is updated
+        """
+        try:
+            self.refresh(data)
+        except Exception:
+            self.media_status = MEDIA_STATUS_FAILED
+            self.save(update_fields=["media_status"])
+            self._content_changed()
+            raise
+        self.media_status = MEDIA_STATUS_READY
+        self.save(update_fields=["media_status"])
+        self._content_changed()
+
+    def expire_pending_media(date):
+        """
+        mark as failed the media files of the websites still pending since `date`: their ingestion died
+        without being finalized (lost worker, ...). Returns the keys of the websites.
+        """
+        keys = list(
+            Website.objects.filter(media_status=MEDIA_STATUS_PENDING, generated_date__lt=date)
+            .values_list("key", flat=True)
+        )
+        Website.objects.filter(key__in=keys, media_status=MEDIA_STATUS_PENDING).update(
+            media_status=MEDIA_STATUS_FAILED, content_version=models.F("content_version") + 1
+        )
+        Website._invalidate_pages(keys)
+        return keys
+
+    def record_sync_attempt(self, succeeded):
+        """ record the outcome of an attempt to refresh the website with the data of its listing """
+        self.sync_attempt_date = timezone.now()
+        self.sync_failures = 0 if succeeded else self.sync_failures + 1
+        self.save(update_fields=["sync_attempt_date", "sync_failures"])
+
+    def get_page_versions(keys):
+        """
+        version of the pages of the websites `keys` (hidden websites excluded), from their generation date
+        and their content version: {key: {"version": ..., "last_modified": ...}}
+        """
+        return {
+            key: {
+                "version": f"{int(generated_date.timestamp())}.{content_version}",
+                "last_modified": int((refreshed_date or generated_date).timestamp()),
+            }
+            for key, generated_date, refreshed_date, content_version in Website.objects.filter(key__in=keys)
+            .values_list("key", "generated_date", "refreshed_date", "content_version")
+        }
+
+    def _invalidate_pages(keys):
+        """ invalidate the cached pages of the websites `keys` once the changes are committed """
+        transaction.on_commit(lambda: invalidate_website_pages(keys, Website.get_page_versions(keys)))
+
+    def _content_changed(self):
+        """ the content of the pages of the website changed: new content version, its cached pages are invalidated """
+        Website.all_objects.filter(id=self.id).update(content_version=models.F("content_version") + 1)
+        Website._invalidate_pages([self.key])
+
+    def hide(websites):
+        """ hide the `websites` (a queryset) until they are purged, returns the ids of the hidden websites """
+        websites = list(websites.values_list("id", "key"))
+        ids = [id for id, _ in websites]
+        Website.all_objects.filter(id__in=ids).update(deleted_date=timezone.now())
+        # their cached pages are not served anymore
+        Website._invalidate_pages([key for _, key in websites])
+        return ids
+
+    def _delete_leftovers(key, rental_url):
+        """ delete the files of a website not referenced by its records: legacy media folder and debug data """
+        delete_storage_prefix(WebsitePhoto._meta.get_field("image").storage, f"websites/{key}/")
+        delete_storage_prefix(WebsitePhoto._meta.get_field("image").storage, f"{EXPORTS_DIR}/{key}/")
+        if settings.USE_DEBUG_DATA_STORAGE:
+            id = rental_url.split('/')[-1]
+            delete_storage_prefix(private_storage, f"debug/scrapper/{id}/")
+            delete_storage_prefix(private_storage, f"debug/api/{key}/")
+
+    def purge(ids):
+        """
+        delete the websites `ids` with all their records and media files.
+        Rows are deleted with bulk SQL deletes, the records with media files without their per-instance
+        delete signals: the media files are released all together and deleted from the storage
+        with multi-object deletes.
+        """
+        websites = list(Website.all_objects.filter(id__in=ids).values_list("id", "key", "rental_url", "location_id"))
+        if not websites:
+            return 0
+        ids = [id for id, _, _, _ in websites]
+
+        with transaction.atomic():
+            media = [
+                (name, variants)
+                for model, field in [(WebsitePhoto, "image"), (Review, "author_picture"), (WebsiteHost, "picture")]
+                for name, variants in model.objects.filter(website_id__in=ids).values_list(field, "variants")
+            ]
+            area_ids = list(EquipmentArea.objects.filter(website_id__in=ids).values_list("id", flat=True))
+            equipment_ids = list(
+                EquipmentArea.equipments.through.objects
+                .filter(equipmentarea_id__in=area_ids).values_list("equipment_id", flat=True)
+            )
+
+            # the records are deleted leaves first, so that there is nothing left to cascade
+            RoomDetail.objects.filter(room__website_id__in=ids).delete()
+            Room.objects.filter(website_id__in=ids).delete()
+            EquipmentArea.equipments.through.objects.filter(equipmentarea_id__in=area_ids).delete()
+            Equipment.objects.filter(id__in=equipment_ids).delete()
+            EquipmentArea.objects.filter(id__in=area_ids).delete()
+            Highlight.objects.filter(website_id__in=ids).delete()
+            Rule.objects.filter(website_id__in=ids).delete()
+            # their delete signals release the media files one by one, they're released all together below
+            for queryset in [
+                WebsitePhoto.objects.filter(website_id__in=ids),
+                Review.objects.filter(website_id__in=ids),
+                WebsiteHost.objects.filter(website_id__in=ids),
+                Website.all_objects.filter(id__in=ids),
+            ]:
+                _delete_without_signals(queryset)
+            WebsiteLocation.objects.filter(id__in=[location_id for _, _, _, location_id in websites]).delete()
+
+            MediaBlob.release(
+                [name for name, _ in media],
+                WebsitePhoto._meta.get_field("image").storage,
+                [v["name"] for _, variants in media for v in variants],
+            )
+
+        for _, key, rental_url, _ in websites:
+            Website._delete_leftovers(key, rental_url)
+        forget_website_pages([key for _, key, _, _ in websites])
+        return len(websites)
+
     def get_website(key):
         """ get the website record identified by `key` """
         try:
@@ -206,24 +859,12 @@ class Website(models.Model):
         except Website.DoesNotExist:
             return None
 
-    def has_reached_resource_limits(user):
-        """ indicates if resource limits have been reached for the `user` """
-        return Website.objects.filter(user=user).count() >= MAX_WEBSITES_COUNT
+    def has_reached_resource_limits(user, count=1):
+        """ indicates if resource limits would be exceeded by creating `count` new websites for the `user` """
+        return Website.objects.filter(user=user).count() + count > MAX_WEBSITES_COUNT
+
 
 @receiver(pre_delete, sender=Website)
 def delete_website(sender, instance, **kwargs):
-
-    # remove website.key folder
-    # try:
-    #     private_storage.delete(filename)
-    # except Exception as e:
-    #     _logger.exception("exception: %s, type: %s", str(e), type(e).__name__)
-
-    # remove debug data if any
-    if settings.USE_DEBUG_DATA_STORAGE:
-        id = instance.rental_url.split('/')[-1]
-        delete_debug_data(f"scrapper/{id}/details.json")
-        delete_debug_data(f"scrapper/{id}/reviews.json")
-        delete_debug_data(f"api/{instance.key}/api_data.json")
-        delete_debug_data(f"scrapper/{id}")
-        delete_debug_data(f"api/{instance.key}")
+    Website._delete_leftovers(instance.key, instance.rental_url)
+    transaction.on_commit(lambda: forget_website_pages([instance.key]))
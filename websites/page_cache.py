@@ -0,0 +1,106 @@
+"""
+Cache of the rendered website pages.
+
+The pages of a website only change with the website (refresh, ingestion of its media files, deletion):
+they are cached under the version of the website, made of its generation date and of its content version
+incremented by every change (see `Website.get_page_versions`). The versions are cached too, so that the
+pages and their validators are served without querying the database. Invalidating the pages of a
+website is caching its new version, once the change is committed: the pages of the previous versions
+are never read again and expire. Deleted websites keep a version without pages until they're forgotten.
+
+The pages also change with their templates: the fingerprint of the templates is part of the versions,
+so that the pages rendered by a previous deployment are not served anymore.
+
+The pages are invalidated by the Celery workers and served by the web processes: they are only cached
+by a cache shared by all of them (Redis), the "pages" cache is a dummy cache otherwise.
+"""
+import functools
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .assets import get_static_references, read_static_file
+
+PAGES_CACHE = "pages"
+# templates and static files of the website pages (relative to BASE_DIR)
+TEMPLATE_SOURCES = ["templates/websites", "static/websites"]
+
+
+def _cache():
+    return caches[PAGES_CACHE]
+
+
+@functools.cache
+def get_templates_fingerprint():
+    """
+    hash of the templates and static files of the website pages, with every static file they reference
+    (bundled with the exported pages), even outside of TEMPLATE_SOURCES
+    """
+    digest = hashlib.sha256()
+    for source in TEMPLATE_SOURCES:
+        for path in sorted((settings.BASE_DIR / source).rglob("*")):
+            if path.is_file():
+                digest.update(str(path.relative_to(settings.BASE_DIR)).encode("utf-8"))
+                digest.update(path.read_bytes())
+    for name in sorted(get_static_references([settings.BASE_DIR / source for source in TEMPLATE_SOURCES])):
+        digest.update(name.encode("utf-8"))
+        try:
+            digest.update(read_static_file(name))
+        except OSError:
+            # a missing file is not bundled either
+            pass
+    return digest.hexdigest()[:16]
+
+
+# version of the deleted websites
+DELETED_VERSION = {"version": None, "last_modified": None}
+
+
+def _version_key(key):
+    return f"{key}:version"
+
+
+def _page_key(key, page, version):
+    return f"{key}:{version}-{get_templates_fingerprint()}:{page}"
+
+
+def get_page_etag(version):
+    """ strong validator of the pages of a website at `version` """
+    return f'"{version["version"]}-{get_templates_fingerprint()}"'
+
+
+def get_cached_version(key):
+    """
+    get the cached version of the website `key`: {"version": ..., "last_modified": ...}
+    (`DELETED_VERSION` if the website is deleted, None if not cached)
+    """
+    return _cache().get(_version_key(key))
+
+
+def cache_version(key, version):
+    """ cache the `version` of the website `key` loaded from the database, unless changed meanwhile """
+    _cache().add(_version_key(key), version, timeout=settings.WEBSITES_PAGES_CACHE_TIMEOUT)
+
+
+def get_cached_page(key, page, version):
+    """ get the `page` of the website `key` rendered at `version` (None if not cached) """
+    return _cache().get(_page_key(key, page, version["version"]))
+
+
+def cache_page(key, page, version, content):
+    """ cache the `page` of the website `key` rendered at `version` """
+    _cache().set(_page_key(key, page, version["version"]), content, timeout=settings.WEBSITES_PAGES_CACHE_TIMEOUT)
+
+
+def invalidate_website_pages(keys, versions):
+    """ invalidate the cached pages of the websites `keys` by caching their `versions` (missing ones are deleted) """
+    _cache().set_many(
+        {_version_key(key): versions.get(key, DELETED_VERSION) for key in keys},
+        timeout=settings.WEBSITES_PAGES_CACHE_TIMEOUT,
+    )
+
+
+def forget_website_pages(keys):
+    """ forget the versions of the deleted websites `keys`, their pages expire by themselves """
+    _cache().delete_many([_version_key(key) for key in keys])
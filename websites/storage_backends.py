@@ -12,6 +12,8 @@ class PublicMediaStorage(S3Boto3Storage):
     location = settings.PUBLIC_MEDIA_LOCATION
     default_acl = 'public-read'
     file_overwrite = False
+    # media files are stored under the hash of their content (see `get_media_blob_path`): they never change
+    object_parameters = {'CacheControl': 'public, max-age=31536000, immutable'}
 
 
 class PrivateMediaStorage(S3Boto3Storage):
@@ -0,0 +1,45 @@
+import shutil
+import tempfile
+
+from django.test import override_settings
+
+
+def use_temporary_media_root(test_class):
+    """ store the media files of the tests of `test_class` in a temporary directory, deleted after them """
+    media_root = tempfile.mkdtemp()
+    test_class.addClassCleanup(shutil.rmtree, media_root)
+    override = override_settings(MEDIA_ROOT=media_root)
+    override.enable()
+    test_class.addClassCleanup(override.disable)
+
+
+def listing_data(size):
+    """ data of a listing whose rooms, equipments, photos, ... grow with `size` """
+    return {
+        "name": "a name",
+        "description": ["a description"],
+        "general_info": {"guest_count": 4, "bedroom_count": 2, "bed_count": 3, "bathroom_count": 1},
+        "location": {"title": "my_title", "coords": {"lat": 12.34, "lng": 56.78}},
+        "host": {
+            "name": "host", "description": "a description", "languages": ["fr", "en"],
+            "picture_url": "https://media.fr/host.jpg",
+        },
+        "photos": [{"url": f"https://media.fr/photo_{i}.jpg", "caption": f"caption {i}"} for i in range(size)],
+        "reviews": [
+            {
+                "author_name": f"author {i}",
+                "author_picture_url": f"https://media.fr/author_{i}.jpg",
+                "review": f"review {i}",
+                "date": "2023-01-01",
+                "language": "fr",
+            }
+            for i in range(size)
+        ],
+        "equipments": {
+            "areas": [{"name": f"area {i}", "equipments": [str(j) for j in range(size)]} for i in range(size)],
+            "equipments": {str(j): {"name": f"eq{j}", "description": f"desc{j}"} for j in range(size)},
+        },
+        "highlights": [{"headline": f"h{i}", "message": f"m{i}"} for i in range(size)],
+        "house_rules": [f"rule {i}" for i in range(size)],
+        "rooms": [{"name": f"room {i}", "details": [f"d{i}", f"d{i + 1}"]} for i in range(size)],
+    }
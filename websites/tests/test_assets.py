@@ -0,0 +1,63 @@
+import shutil
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+
+from websites.assets import get_static_references, rewrite_stylesheet
+
+STYLESHEETS = {
+    "websites/css/style.css": (
+        b'@import url("theme.css");\n'
+        b'body { background: url(../images/bg.png?v=1); }\n'
+        b"@font-face { src: url('/static/fonts/font.woff2'); }\n"
+        b'.icon { background: url(data:image/png;base64,AAAA); }\n'
+        b'.map { background: url(https://maps.fr/tile.png); }\n'
+    ),
+    "websites/css/theme.css": b".logo { background: url(logo.svg); }\n",
+}
+
+
+def _read_static_file(name):
+    return STYLESHEETS.get(name, b"")
+
+
+@override_settings(STATIC_URL="/static/")
+class AssetsTestCase(SimpleTestCase):
+
+    def test_rewrite_stylesheet(self):
+        assets = set()
+
+        content = rewrite_stylesheet("websites/css/style.css", STYLESHEETS["websites/css/style.css"], assets)
+
+        # the static files are referenced relatively to the stylesheet, the other urls are kept
+        self.assertEqual(assets, {"websites/css/theme.css", "websites/images/bg.png", "fonts/font.woff2"})
+        self.assertIn(b'url("theme.css")', content)
+        self.assertIn(b"url(../images/bg.png)", content)
+        self.assertIn(b"url('../../fonts/font.woff2')", content)
+        self.assertIn(b"url(data:image/png;base64,AAAA)", content)
+        self.assertIn(b"url(https://maps.fr/tile.png)", content)
+
+    @patch("websites.assets.read_static_file", side_effect=_read_static_file)
+    def test_get_static_references(self, mock_read):
+        template_dir = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, template_dir)
+        (template_dir / "head.html").write_text(
+            "{% load static %}"
+            "<link href=\"{% static 'websites/css/style.css' %}\">"
+            '<link rel="icon" href="{% static "images/favicon.ico" %}">'
+        )
+
+        self.assertEqual(
+            get_static_references([template_dir]),
+            {
+                "websites/css/style.css",
+                "images/favicon.ico",
+                # referenced by the stylesheets
+                "websites/css/theme.css",
+                "websites/css/logo.svg",
+                "websites/images/bg.png",
+                "fonts/font.woff2",
+            },
+        )
@@ -0,0 +1,127 @@
+import io
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.contrib.staticfiles import finders
+from django.core.files.storage import default_storage
+from django.test import TestCase as DjangoTestCase, override_settings
+from django.urls import reverse
+
+from websites import export
+from websites.export import export_website, get_websites_to_rerender, rerender_websites
+from websites.models import Website
+
+from .common import listing_data, use_temporary_media_root
+
+
+@override_settings(STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage")
+class ExportTestCase(DjangoTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        use_temporary_media_root(cls)
+        super().setUpClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="user", email="user@eroo.fr")
+        patcher = patch("websites.models.website.download_media_file", side_effect=lambda *_: io.BytesIO(b"content"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.data = listing_data(2)
+        self.website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", self.data)
+
+    def _read(self, path):
+        with default_storage.open(path) as f:
+            return f.read().decode()
+
+    def test_export_website(self):
+        export_path = export_website(self.website)
+
+        self.assertTrue(export_path.startswith(f"sites/{self.website.key}/"))
+        self.assertEqual(Website.objects.get(id=self.website.id).export_path, export_path)
+        _, files = default_storage.listdir(export_path)
+        self.assertEqual(sorted(files), ["contact.html", "details.html", "index.html", "photos.html"])
+
+        # the links and the static files are relative to the bundle
+        index = self._read(export_path + "index.html")
+        self.assertIn('href="photos.html"', index)
+        self.assertIn('href="index.html"', index)
+        self.assertNotIn(f"/websites/{self.website.key}", index)
+        self.assertIn('href="assets/websites/css/style.css"', index)
+        with open(finders.find("websites/css/style.css")) as f:
+            self.assertEqual(self._read(export_path + "assets/websites/css/style.css"), f.read())
+
+    def test_export_files_referenced_by_the_stylesheets(self):
+        read_static_file = export.read_static_file
+
+        def _read_static_file(name):
+            if name == "websites/css/style.css":
+                return b".hero { background: url('/static/images/hero.png'); }"
+            return b"hero" if name == "images/hero.png" else read_static_file(name)
+
+        with override_settings(STATIC_URL="/static/"), \
+                patch("websites.export.read_static_file", side_effect=_read_static_file):
+            export_path = export_website(self.website)
+
+        # the files referenced by the stylesheets are bundled, relatively to them
+        self.assertEqual(
+            self._read(export_path + "assets/websites/css/style.css"),
+            ".hero { background: url('../../images/hero.png'); }",
+        )
+        self.assertEqual(self._read(export_path + "assets/images/hero.png"), "hero")
+
+    def test_export_unchanged_website(self):
+        export_path = export_website(self.website)
+
+        with patch.object(default_storage, "save") as mock_save:
+            self.assertEqual(export_website(self.website), export_path)
+        mock_save.assert_not_called()
+
+    def test_export_changed_website(self):
+        previous_path = export_website(self.website)
+
+        self.data["name"] = "a new name"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.website.refresh(self.data)
+        export_path = export_website(self.website)
+
+        self.assertNotEqual(export_path, previous_path)
+        self.assertIn("a new name", self._read(export_path + "index.html"))
+        self.assertFalse(default_storage.exists(previous_path + "index.html"))
+
+    def test_serve_export(self):
+        url = reverse("website_details", args=[self.website.key])
+        self.client.force_login(self.user)
+
+        with override_settings(WEBSITES_SERVE_EXPORTS=True):
+            # not exported yet
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+            export_path = export_website(self.website)
+            response = self.client.get(url)
+
+        self.assertRedirects(
+            response, default_storage.url(export_path + "details.html"), fetch_redirect_response=False,
+        )
+
+    def test_rerender_websites(self):
+        export_path = export_website(self.website)
+        # already rendered with the current templates
+        self.assertEqual(get_websites_to_rerender(), [])
+        self.assertEqual(get_websites_to_rerender(force=True), [self.website.id])
+
+        with patch("websites.export.get_templates_fingerprint", return_value="new-templates"):
+            self.assertEqual(get_websites_to_rerender(), [self.website.id])
+            with patch.object(default_storage, "save") as mock_save:
+                stats = rerender_websites([self.website.id])
+            self.assertEqual(get_websites_to_rerender(), [])
+
+        # same pages: the bundle is not uploaded again
+        self.assertEqual(stats, {"rendered": 1, "changed": 0, "failed": 0})
+        mock_save.assert_not_called()
+        website = Website.objects.get(id=self.website.id)
+        self.assertEqual((website.export_path, website.export_fingerprint), (export_path, "new-templates"))
+
+    @patch("websites.export.export_website", side_effect=Exception("storage error"))
+    def test_rerender_websites_error(self, mock_export):
+        self.assertEqual(rerender_websites([self.website.id]), {"rendered": 0, "changed": 0, "failed": 1})
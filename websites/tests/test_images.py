@@ -0,0 +1,89 @@
+import io
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import MagicMock, patch
+
+from django.test import SimpleTestCase, override_settings
+from PIL import Image
+
+from websites import images
+from websites.images import get_srcset, get_variant_name, is_variant_of, resize_image, store_image_variants
+
+
+def _image_content(width, height):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "red").save(output, "JPEG")
+    return output.getvalue()
+
+
+@override_settings(IMAGE_VARIANT_WIDTHS=[100, 200, 400], IMAGE_VARIANT_QUALITY=80, IMAGE_VARIANTS_MAX_WORKERS=0)
+class ImagesTestCase(SimpleTestCase):
+
+    def test_variant_name(self):
+        name = get_variant_name("blobs/ab/abcdef.jpg", 320)
+
+        self.assertEqual(name, "blobs/ab/abcdef_320w.webp")
+        self.assertTrue(is_variant_of(name, "blobs/ab/abcdef.jpg"))
+        self.assertFalse(is_variant_of(name, "blobs/ab/abc.jpg"))
+
+    def test_resize_image(self):
+        variants = resize_image(_image_content(300, 150), [100, 200], 80)
+
+        self.assertEqual([width for width, _ in variants], [100, 200])
+        for width, content in variants:
+            with Image.open(io.BytesIO(content)) as image:
+                self.assertEqual((image.format, image.size), ("WEBP", (width, width // 2)))
+
+    def test_store_image_variants(self):
+        storage = MagicMock()
+        storage.exists.return_value = False
+
+        variants = store_image_variants(storage, "blobs/ab/abcdef.jpg", io.BytesIO(_image_content(300, 150)))
+
+        # the image is never upscaled
+        self.assertEqual(variants, [
+            {"width": 100, "name": "blobs/ab/abcdef_100w.webp"},
+            {"width": 200, "name": "blobs/ab/abcdef_200w.webp"},
+        ])
+        self.assertEqual([c.args[0] for c in storage.save.call_args_list], [v["name"] for v in variants])
+
+    @patch("websites.images.resize_image")
+    def test_store_image_variants_already_stored(self, mock_resize):
+        storage = MagicMock()
+        storage.exists.return_value = True
+
+        variants = store_image_variants(storage, "blobs/ab/abcdef.jpg", io.BytesIO(_image_content(300, 150)))
+
+        self.assertEqual(len(variants), 2)
+        mock_resize.assert_not_called()
+        storage.save.assert_not_called()
+
+    def test_store_image_variants_broken_pool(self):
+        storage = MagicMock()
+        storage.exists.return_value = False
+        executor = MagicMock()
+        executor.submit.return_value.result.side_effect = BrokenProcessPool()
+
+        with patch.object(images, "_executor", executor), patch("websites.images._get_executor", return_value=executor):
+            variants = store_image_variants(storage, "blobs/ab/abcdef.jpg", io.BytesIO(_image_content(300, 150)))
+
+            # resized in the current thread, the broken pool is replaced for the next images
+            self.assertEqual(len(variants), 2)
+            self.assertEqual(storage.save.call_count, 2)
+            self.assertIsNone(images._executor)
+        executor.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+
+    def test_store_image_variants_not_an_image(self):
+        storage = MagicMock()
+        media_file = io.BytesIO(b"content")
+
+        self.assertEqual(store_image_variants(storage, "blobs/ab/abcdef.jpg", media_file), [])
+        self.assertEqual(media_file.read(), b"content")
+        storage.save.assert_not_called()
+
+    def test_get_srcset(self):
+        storage = MagicMock()
+        storage.url.side_effect = lambda name: f"https://media.fr/{name}"
+
+        srcset = get_srcset(storage, [{"width": 100, "name": "a_100w.webp"}, {"width": 200, "name": "a_200w.webp"}])
+
+        self.assertEqual(srcset, "https://media.fr/a_100w.webp 100w, https://media.fr/a_200w.webp 200w")
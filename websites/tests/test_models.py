@@ -1,15 +1,34 @@
+import copy
+import io
+import django
 from parameterized import parameterized
+from PIL import Image
 from unittest import TestCase
-from unittest.mock import Mock, patch, call
+from unittest.mock import MagicMock, Mock, patch, call
 
-from django.core.files import File
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase as DjangoTestCase, override_settings
+from django.utils import timezone
 
 from websites.models import (
+    Equipment,
+    EquipmentArea,
+    Highlight,
+    MediaBlob,
+    Review,
+    Room,
+    RoomDetail,
+    Rule,
     Website,
+    WebsiteLocation,
     WebsitePhoto,
     KEY_LENGTH
 )
 from websites.config import MAX_WEBSITES_COUNT
+from websites.models.website import _delete_without_signals
+
+from .common import use_temporary_media_root
 
 
 class ModelTestCase(TestCase):
@@ -44,6 +63,18 @@ class ModelTestCase(TestCase):
         self.assertEqual(Website.has_reached_resource_limits(1), expected)
         mock_filter.assert_called_once_with(user=1)
 
+    @parameterized.expand([
+        (0, MAX_WEBSITES_COUNT, False),
+        (0, MAX_WEBSITES_COUNT + 1, True),
+        (MAX_WEBSITES_COUNT - 2, 2, False),
+        (MAX_WEBSITES_COUNT - 2, 3, True),
+    ])
+    @patch('websites.models.Website.objects.filter.return_value.count')
+    @patch('websites.models.Website.objects.filter')
+    def test_has_reached_resource_limits_for_many_websites(self, existing, count, expected, mock_filter, mock_count):
+        mock_count.return_value = existing
+        self.assertEqual(Website.has_reached_resource_limits(1, count), expected)
+
     @patch('websites.models.Website.objects.filter.return_value.count')
     @patch('websites.models.Website.objects.filter')
     @patch('websites.models.ShortUUID.random')
@@ -85,73 +116,579 @@ class ModelTestCase(TestCase):
         ([{"caption": "toto"}],),
     ])
     @patch('websites.models.website.download_media_file')
-    def test_create_photos_error_cases(self, photos, mock_download):
+    def test_ingest_photos_error_cases(self, photos, mock_download):
         website = Mock(spec=Website)
-        Website._create_photos(website, photos)
+        self.assertEqual(Website._ingest_photos(website, photos), [])
         website._create_photo.assert_not_called()
         mock_download.assert_not_called()
 
     @patch('websites.models.website.download_media_file')
-    def test_create_photos_one_photo_download_error(self, mock_download):
+    def test_ingest_photo_download_error(self, mock_download):
         website = Mock(spec=Website)
         mock_download.return_value = False
 
-        Website._create_photos(website, [{"url": self.url, "caption": self.caption}])
+        photo = Website._ingest_photo(website, {"url": self.url, "caption": self.caption})
 
+        self.assertEqual(photo, None)
         mock_download.assert_called_once_with(self.url, self.filename)
         website._create_photo.assert_not_called()
 
     @patch('websites.models.website.download_media_file')
-    def test_create_photos_one_photo_download_success(self, mock_download):
-
+    def test_ingest_photo_download_success(self, mock_download):
         website = Mock(spec=Website)
-        mock_download.return_value = self.image_content
+        media_file = MagicMock()
+        mock_download.return_value = media_file
 
-        Website._create_photos(website, [{"url": self.url, "caption": self.caption}])
+        photo = Website._ingest_photo(website, {"url": self.url, "caption": self.caption})
 
+        self.assertEqual(photo, website._create_photo.return_value)
         mock_download.assert_called_once_with(self.url, self.filename)
-        website._create_photo.assert_called_once_with(self.filename, self.image_content, self.caption)
+        website._create_photo.assert_called_once_with(self.filename, media_file, self.caption)
+        media_file.__exit__.assert_called_once()
 
-    @patch('websites.models.website.download_media_file')
-    def test_create_photos_several_photos(self, mock_download):
+    def test_ingest_photos_keeps_order(self):
         website = Mock(spec=Website)
-        photos_content = []
-        photos = []
-        expected_download_calls = []
-        expected_photo_calls = []
-        for i in range(4):
-            filename = f"file_{i}.jpg"
-            url = f"https://media.fr/{filename}?debug=1"
-            caption = f"caption_{i}"
-            content = [i * v for v in self.image_content]
-            photos_content.append(content)
-            photos.append({"url": url, "caption": caption})
-            expected_download_calls.append(call(url, filename))
-            expected_photo_calls.append(call(filename, content, caption))
-
-        mock_download.side_effect = photos_content
-
-        Website._create_photos(website, photos)
-
-        mock_download.assert_has_calls(expected_download_calls)
-        website._create_photo.assert_has_calls(expected_photo_calls)
-
-    @patch('websites.models.WebsitePhoto.objects.create')
-    def test_create_photo(self, mock_photo):
+        photos = [{"url": f"https://media.fr/file_{i}.jpg", "caption": f"caption_{i}"} for i in range(10)]
+        records = [Mock(spec=WebsitePhoto) for _ in photos]
+        website._ingest_photo.side_effect = lambda p: records[photos.index(p)]
+
+        result = Website._ingest_photos(website, photos)
+
+        website._ingest_photo.assert_has_calls([call(p) for p in photos], any_order=True)
+        self.assertEqual(result, records)
+
+    def test_ingest_photos_skips_failed_photos(self):
+        website = Mock(spec=Website)
+        photos = [{"url": f"https://media.fr/file_{i}.jpg", "caption": f"caption_{i}"} for i in range(3)]
+        records = {p["url"]: Mock(spec=WebsitePhoto) for p in photos}
+        records[photos[1]["url"]] = None
+        website._ingest_photo.side_effect = lambda p: records[p["url"]]
+
+        result = Website._ingest_photos(website, photos)
+
+        self.assertEqual(result, [records[photos[0]["url"]], records[photos[2]["url"]]])
+
+    @patch('websites.models.website.store_image_variants')
+    @patch('websites.models.website.store_media_file')
+    @patch('websites.models.website.WebsitePhoto')
+    def test_create_photo(self, mock_photo, mock_store, mock_store_variants):
         website = Mock(spec=Website)
-        photo = Mock(spec=WebsitePhoto)
-        mock_photo.return_value = photo
 
-        Website._create_photo(website, "filename", [1, 2, 3], "caption")
+        photo = Website._create_photo(website, "filename.jpg", [1, 2, 3], "caption")
+
+        self.assertEqual(photo, mock_photo.return_value)
         mock_photo.assert_called_once_with(caption="caption", website=website)
-#        photo.image.save.assert_called_once_with("filename", File([1, 2, 3]))
-        photo.save.assert_has_calls([call()])
+        mock_store.assert_called_once_with(photo.image.storage, [1, 2, 3], ".jpg")
+        self.assertEqual(photo.image.name, mock_store.return_value)
+        mock_store_variants.assert_called_once_with(photo.image.storage, photo.image.name, [1, 2, 3])
+        self.assertEqual(photo.variants, mock_store_variants.return_value)
+        photo.save.assert_not_called()
+
+    @patch('websites.models.website.download_media_file')
+    def test_ingest_host_without_host(self, mock_download):
+        website = Mock(spec=Website)
+        self.assertEqual(Website._ingest_host(website, None), None)
+        mock_download.assert_not_called()
+
+    @patch('websites.models.Rule.objects.bulk_create')
+    def test_create_rules(self, mock_bulk_create):
+        website = Website(key="1234")
+
+        Website._create_rules(website, ["rule 1", "rule 2"])
+
+        mock_bulk_create.assert_called_once()
+        rules = mock_bulk_create.call_args.args[0]
+        self.assertEqual([(r.name, r.website) for r in rules], [("rule 1", website), ("rule 2", website)])
 
-    # _create_reviews
-    # _create_location
-    # _create_host
+    @patch('websites.models.Highlight.objects.bulk_create')
+    def test_create_highlights(self, mock_bulk_create):
+        website = Website(key="1234")
+
+        Website._create_highlights(website, [{"headline": "h1", "message": "m1"}])
+
+        mock_bulk_create.assert_called_once()
+        highlights = mock_bulk_create.call_args.args[0]
+        self.assertEqual([(h.title, h.message) for h in highlights], [("h1", "m1")])
+
+    # _ingest_reviews
     # _create_equipments
-    # _create_highlights
-    # _create_rules
     # _create_rooms
-    # create
+
+
+class WebsiteCreateTestCase(DjangoTestCase):
+
+    data = {
+        "name": "a name",
+        "description": ["a description"],
+        "general_info": {"guest_count": 4, "bedroom_count": 2, "bed_count": 3, "bathroom_count": 1},
+        "location": {"title": "my_title", "coords": {"lat": 12.34, "lng": 56.78}},
+        "host": {
+            "name": "host", "description": "a description", "languages": ["fr"],
+            "picture_url": "https://media.fr/host.jpg",
+        },
+        "photos": [],
+        "reviews": [],
+        "equipments": {
+            "areas": [
+                {"name": "area 1", "equipments": ["1", "2", "2"]},
+                {"name": "area 2", "equipments": ["2", "3", "404"]},
+            ],
+            "equipments": {
+                "1": {"name": "eq1", "description": "desc1"},
+                "2": {"name": "eq2", "description": "desc2"},
+                "3": {"name": "eq3", "description": "desc3"},
+            },
+        },
+        "highlights": [{"headline": "h1", "message": "m1"}, {"headline": "h2", "message": "m2"}],
+        "house_rules": ["rule 1", "rule 2"],
+        "rooms": [{"name": "room 1", "details": ["d1", "d2"]}, {"name": "room 2", "details": ["d3"]}],
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        use_temporary_media_root(cls)
+        super().setUpClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="user", email="user@eroo.fr")
+        patcher = patch("websites.models.website.download_media_file", side_effect=lambda *_: io.BytesIO(b"content"))
+        self.mock_download = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_create_in_bulk(self):
+        with self.assertNumQueries(19):
+            website = Website.create(self.user.id, "https://airbnb.fr/rooms/1234", self.data)
+
+        areas = EquipmentArea.objects.filter(website=website).order_by("id")
+        self.assertEqual(
+            [(a.name, sorted(e.name for e in a.equipments.all())) for a in areas],
+            [("area 1", ["eq1", "eq2"]), ("area 2", ["eq2", "eq3"])],
+        )
+        rooms = Room.objects.filter(website=website).order_by("id")
+        self.assertEqual(
+            [(r.name, [d.detail for d in RoomDetail.objects.filter(room=r).order_by("id")]) for r in rooms],
+            [("room 1", ["d1", "d2"]), ("room 2", ["d3"])],
+        )
+        self.assertEqual(Highlight.objects.filter(website=website).count(), 2)
+        self.assertEqual(Rule.objects.filter(website=website).count(), 2)
+
+    @patch('websites.models.Website._create_rooms')
+    def test_create_failure_leaves_nothing(self, mock_rooms):
+        mock_rooms.side_effect = Exception()
+
+        with self.assertRaises(Exception):
+            Website.create(self.user.id, "https://airbnb.fr/rooms/1234", self.data)
+
+        self.assertEqual(Website.objects.count(), 0)
+        self.assertEqual(WebsiteLocation.objects.count(), 0)
+        self.assertEqual(Equipment.objects.count(), 0)
+
+    def test_create_host_picture_download_failure(self):
+        self.mock_download.side_effect = lambda *_: None
+
+        # a website without host can't be rendered: it's not created
+        with self.assertRaises(ValueError):
+            Website.create(self.user.id, "https://airbnb.fr/rooms/1234", self.data)
+
+        self.assertEqual(Website.objects.count(), 0)
+        self.assertEqual(WebsiteLocation.objects.count(), 0)
+
+    def test_create_without_host(self):
+        with self.assertRaises(ValueError):
+            Website.create(self.user.id, "https://airbnb.fr/rooms/1234", {**self.data, "host": None})
+
+        self.assertEqual(Website.objects.count(), 0)
+
+
+class WebsiteRefreshTestCase(DjangoTestCase):
+
+    data = {
+        **WebsiteCreateTestCase.data,
+        "photos": [
+            {"url": "https://media.fr/photo_1.jpg", "caption": "caption 1"},
+            {"url": "https://media.fr/photo_2.jpg", "caption": "caption 2"},
+        ],
+        "reviews": [
+            {
+                "author_name": f"author {i}",
+                "author_picture_url": f"https://media.fr/author_{i}.jpg",
+                "review": f"review {i}",
+                "date": f"2023-01-0{i}",
+                "language": "fr",
+            }
+            for i in [1, 2]
+        ],
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        use_temporary_media_root(cls)
+        super().setUpClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="user", email="user@eroo.fr")
+        patcher = patch("websites.models.website.download_media_file", side_effect=self._download)
+        self.mock_download = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.website = Website.create(self.user.id, "https://airbnb.fr/rooms/1234", self.data)
+        self.mock_download.reset_mock()
+
+    def _download(self, url, filename):
+        return io.BytesIO(b"content")
+
+    def _downloaded_urls(self):
+        return sorted(c.args[0] for c in self.mock_download.call_args_list)
+
+    def test_create_sets_section_hashes_and_photo_positions(self):
+        self.assertEqual(self.website.section_hashes, Website._compute_section_hashes(self.data))
+        photos = WebsitePhoto.objects.filter(website=self.website).order_by("position")
+        self.assertEqual(
+            [(p.source_url, p.position) for p in photos],
+            [("https://media.fr/photo_1.jpg", 0), ("https://media.fr/photo_2.jpg", 1)],
+        )
+
+    def test_create_with_deferred_media(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/5678", self.data, defer_media=True)
+
+        self.assertEqual(website.media_status, "pending")
+        self.assertEqual(
+            [p.source_url for p in WebsitePhoto.objects.filter(website=website)], ["https://media.fr/photo_1.jpg"],
+        )
+        self.assertEqual(Review.objects.filter(website=website).count(), 0)
+
+        self.mock_download.reset_mock()
+        website.ingest_deferred_media(self.data)
+
+        self.assertEqual(Website.objects.get(id=website.id).media_status, "ready")
+        # the main photo is not downloaded again
+        self.assertEqual(
+            self._downloaded_urls(),
+            ["https://media.fr/author_1.jpg", "https://media.fr/author_2.jpg", "https://media.fr/photo_2.jpg"],
+        )
+        self.assertEqual(
+            [(p.source_url, p.position) for p in WebsitePhoto.objects.filter(website=website).order_by("position")],
+            [("https://media.fr/photo_1.jpg", 0), ("https://media.fr/photo_2.jpg", 1)],
+        )
+        self.assertEqual(Review.objects.filter(website=website).count(), 2)
+        self.assertEqual(website.section_hashes, Website._compute_section_hashes(self.data))
+
+    def test_create_with_stored_media(self):
+        stored_media = Website.store_media(self.data, defer_media=True)
+
+        self.assertEqual(self._downloaded_urls(), ["https://media.fr/host.jpg", "https://media.fr/photo_1.jpg"])
+        self.mock_download.reset_mock()
+
+        website = Website.create(
+            self.user.id, "https://airbnb.fr/rooms/5678", self.data, defer_media=True, stored_media=stored_media,
+        )
+
+        # the website is created with the stored media files, without downloading anything
+        self.mock_download.assert_not_called()
+        self.assertEqual(
+            [(p.source_url, p.image.name) for p in WebsitePhoto.objects.filter(website=website)],
+            [("https://media.fr/photo_1.jpg", stored_media["https://media.fr/photo_1.jpg"]["name"])],
+        )
+
+    def test_create_with_missing_stored_media(self):
+        stored_media = Website.store_media({**self.data, "photos": []})
+        self.mock_download.reset_mock()
+
+        website = Website.create(
+            self.user.id, "https://airbnb.fr/rooms/5678", self.data, defer_media=True, stored_media=stored_media,
+        )
+
+        # media files which couldn't be stored are not downloaded again
+        self.mock_download.assert_not_called()
+        self.assertEqual(WebsitePhoto.objects.filter(website=website).count(), 0)
+
+    def test_ingest_media_by_chunks(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/5678", self.data, defer_media=True)
+        self.mock_download.reset_mock()
+
+        self.assertEqual(website.ingest_media(self.data["photos"], []), 1)
+        self.assertEqual(website.ingest_media([], self.data["reviews"][:1]), 1)
+        # chunks are idempotent
+        self.assertEqual(website.ingest_media(self.data["photos"], self.data["reviews"][:1]), 0)
+
+        self.assertEqual(
+            self._downloaded_urls(), ["https://media.fr/author_1.jpg", "https://media.fr/photo_2.jpg"],
+        )
+        self.assertEqual(WebsitePhoto.objects.filter(website=website).count(), 2)
+        self.assertEqual(Review.objects.filter(website=website).count(), 1)
+
+    @patch('websites.models.Website.refresh')
+    def test_ingest_deferred_media_failure(self, mock_refresh):
+        mock_refresh.side_effect = Exception()
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/5678", self.data, defer_media=True)
+
+        with self.assertRaises(Exception):
+            website.ingest_deferred_media(self.data)
+
+        self.assertEqual(Website.objects.get(id=website.id).media_status, "failed")
+
+    def test_expire_pending_media(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/5678", self.data, defer_media=True)
+
+        self.assertEqual(Website.expire_pending_media(website.generated_date), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(Website.expire_pending_media(timezone.now()), [website.key])
+
+        self.assertEqual(Website.objects.get(id=website.id).media_status, "failed")
+        # websites whose media files are ingested are never expired
+        self.assertEqual(Website.objects.get(id=self.website.id).media_status, "ready")
+
+    def test_refresh_unchanged_data(self):
+        with self.assertNumQueries(1):
+            sections = self.website.refresh(copy.deepcopy(self.data))
+
+        self.assertEqual(sections, [])
+        self.mock_download.assert_not_called()
+        self.assertIsNotNone(self.website.refreshed_date)
+
+    def test_refresh_invalid_data(self):
+        self.assertIsNone(self.website.refresh({"name": "a name"}))
+
+    def test_refresh_photos_downloads_only_new_photos(self):
+        data = copy.deepcopy(self.data)
+        data["photos"] = [
+            {"url": "https://media.fr/photo_2.jpg", "caption": "new caption 2"},
+            {"url": "https://media.fr/photo_3.jpg", "caption": "caption 3"},
+        ]
+        kept_photo = WebsitePhoto.objects.get(website=self.website, source_url="https://media.fr/photo_2.jpg")
+
+        sections = self.website.refresh(data)
+
+        self.assertEqual(sections, ["photos"])
+        self.assertEqual(self._downloaded_urls(), ["https://media.fr/photo_3.jpg"])
+        photos = WebsitePhoto.objects.filter(website=self.website).order_by("position")
+        self.assertEqual(
+            [(p.id == kept_photo.id, p.source_url, p.caption, p.position) for p in photos],
+            [
+                (True, "https://media.fr/photo_2.jpg", "new caption 2", 0),
+                (False, "https://media.fr/photo_3.jpg", "caption 3", 1),
+            ],
+        )
+
+    def test_refresh_legacy_website_replaces_its_photos(self):
+        # websites created before the refresh have neither source url nor section hashes
+        WebsitePhoto.objects.filter(website=self.website).update(source_url="")
+        Website.objects.filter(id=self.website.id).update(section_hashes={})
+        website = Website.objects.get(id=self.website.id)
+
+        sections = website.refresh(copy.deepcopy(self.data))
+
+        self.assertIn("photos", sections)
+        photos = WebsitePhoto.objects.filter(website=website).order_by("position")
+        self.assertEqual(
+            [(p.source_url, p.position) for p in photos],
+            [("https://media.fr/photo_1.jpg", 0), ("https://media.fr/photo_2.jpg", 1)],
+        )
+
+    def test_refresh_sections_touches_only_changed_rows(self):
+        data = copy.deepcopy(self.data)
+        data["name"] = "new name"
+        data["reviews"] = data["reviews"][1:] + [{
+            "author_name": "author 3",
+            "author_picture_url": "https://media.fr/author_3.jpg",
+            "review": "review 3",
+            "date": "2023-01-03",
+            "language": "fr",
+        }]
+        data["house_rules"] = ["rule 2", "rule 3"]
+        data["rooms"] = [{"name": "room 1", "details": ["d1", "d2"]}, {"name": "room 2", "details": ["d4"]}]
+        data["equipments"]["areas"] = data["equipments"]["areas"][:1]
+        kept_rule = Rule.objects.get(website=self.website, name="rule 2")
+        kept_room = Room.objects.get(website=self.website, name="room 1")
+
+        sections = self.website.refresh(data)
+
+        self.assertEqual(sections, ["general", "reviews", "equipments", "rooms", "house_rules"])
+        self.assertEqual(self._downloaded_urls(), ["https://media.fr/author_3.jpg"])
+        self.assertEqual(Website.objects.get(id=self.website.id).name, "new name")
+        self.assertEqual(
+            sorted(r.author_name for r in Review.objects.filter(website=self.website)),
+            ["author 2", "author 3"],
+        )
+        rules = Rule.objects.filter(website=self.website).order_by("id")
+        self.assertEqual([(r.id == kept_rule.id, r.name) for r in rules], [(True, "rule 2"), (False, "rule 3")])
+        rooms = Room.objects.filter(website=self.website).order_by("id")
+        self.assertEqual([(r.id == kept_room.id, r.name) for r in rooms], [(True, "room 1"), (False, "room 2")])
+        self.assertEqual(
+            [d.detail for d in RoomDetail.objects.filter(room__website=self.website).order_by("id")],
+            ["d1", "d2", "d4"],
+        )
+        # eq3 was only used by the removed area
+        self.assertEqual(sorted(e.name for e in Equipment.objects.all()), ["eq1", "eq2"])
+        self.assertEqual(
+            [a.name for a in EquipmentArea.objects.filter(website=self.website)], ["area 1"],
+        )
+        self.assertEqual(self.website.section_hashes, Website._compute_section_hashes(data))
+
+    def test_refresh_download_failure_keeps_section_outdated(self):
+        data = copy.deepcopy(self.data)
+        data["photos"].append({"url": "https://media.fr/photo_3.jpg", "caption": "caption 3"})
+        self.mock_download.side_effect = None
+        self.mock_download.return_value = None
+
+        sections = self.website.refresh(data)
+
+        self.assertEqual(sections, [])
+        self.assertNotEqual(self.website.section_hashes["photos"], Website._compute_section_hashes(data)["photos"])
+
+        # the missing photo is downloaded on the next refresh
+        self.mock_download.side_effect = self._download
+        self.assertEqual(self.website.refresh(data), ["photos"])
+        self.assertEqual(WebsitePhoto.objects.filter(website=self.website).count(), 3)
+
+
+class MediaStoreTestCase(DjangoTestCase):
+
+    data = {
+        **WebsiteCreateTestCase.data,
+        "host": {
+            "name": "host", "description": "", "languages": ["fr"], "picture_url": "https://media.fr/host.jpg",
+        },
+        "photos": [
+            {"url": "https://media.fr/photo_1.jpg", "caption": "caption 1"},
+            {"url": "https://media.fr/photo_2.jpg", "caption": "caption 2"},
+        ],
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        use_temporary_media_root(cls)
+        super().setUpClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="user", email="user@eroo.fr")
+        patcher = patch(
+            "websites.models.website.download_media_file",
+            side_effect=lambda url, filename: io.BytesIO(url.encode("utf-8")),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _create_website(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Website.create(self.user.id, "https://airbnb.fr/rooms/1234", self.data)
+
+    def _delete_website(self, website):
+        with self.captureOnCommitCallbacks(execute=True):
+            website.delete()
+
+    def test_identical_media_files_are_stored_once(self):
+        websites = [self._create_website() for _ in range(2)]
+
+        names = [
+            sorted(p.image.name for p in WebsitePhoto.objects.filter(website=website)) for website in websites
+        ]
+        self.assertEqual(names[0], names[1])
+        self.assertEqual(
+            sorted((b.name, b.ref_count) for b in MediaBlob.objects.all()),
+            sorted((name, 2) for name in names[0] + [websites[0].websitehost_set.get().picture.name]),
+        )
+
+    def test_media_files_are_deleted_with_their_last_reference(self):
+        websites = [self._create_website() for _ in range(2)]
+        storage = WebsitePhoto._meta.get_field("image").storage
+        names = [b.name for b in MediaBlob.objects.all()]
+
+        self._delete_website(websites[0])
+        self.assertEqual(set(b.ref_count for b in MediaBlob.objects.all()), {1})
+        self.assertTrue(all(storage.exists(name) for name in names))
+
+        self._delete_website(websites[1])
+        self.assertEqual(MediaBlob.objects.count(), 0)
+        self.assertFalse(any(storage.exists(name) for name in names))
+
+    def test_hidden_websites_are_purged_in_bulk(self):
+        websites = [self._create_website() for _ in range(2)]
+        storage = WebsitePhoto._meta.get_field("image").storage
+        names = [b.name for b in MediaBlob.objects.all()]
+
+        self.assertEqual(Website.hide(Website.objects.filter(id=websites[0].id)), [websites[0].id])
+        self.assertEqual(list(Website.objects.all()), [websites[1]])
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertNumQueries(29):
+            self.assertEqual(Website.purge([websites[0].id]), 1)
+
+        self.assertEqual(Website.all_objects.count(), 1)
+        self.assertEqual(WebsitePhoto.objects.count(), 2)
+        self.assertEqual(Equipment.objects.count(), 3)
+        self.assertEqual(RoomDetail.objects.count(), 3)
+        self.assertEqual(set(b.ref_count for b in MediaBlob.objects.all()), {1})
+        self.assertTrue(all(storage.exists(name) for name in names))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Website.purge([websites[1].id])
+
+        self.assertEqual(WebsiteLocation.objects.count(), 0)
+        self.assertEqual(MediaBlob.objects.count(), 0)
+        self.assertFalse(any(storage.exists(name) for name in names))
+
+    def test_delete_without_signals(self):
+        # `_delete_without_signals` relies on a private API of Django: check it again when upgrading Django
+        self.assertEqual(django.VERSION[:3], (4, 2, 5))
+        website = self._create_website()
+        photos = WebsitePhoto.objects.filter(website=website)
+        count = photos.count()
+
+        with patch("websites.models.photo.MediaBlob.release") as mock_release, self.assertNumQueries(1):
+            self.assertEqual(_delete_without_signals(photos), count)
+
+        mock_release.assert_not_called()
+        self.assertFalse(WebsitePhoto.objects.filter(website=website).exists())
+
+    def test_media_file_released_before_being_referenced(self):
+        storage = WebsitePhoto._meta.get_field("image").storage
+        name = storage.save("blobs/ab/abcdef.jpg", ContentFile(b"content"))
+        MediaBlob.acquire([name], storage)
+
+        # the file is found stored for a new record, then its last reference is released
+        with self.captureOnCommitCallbacks(execute=True):
+            MediaBlob.release([name], storage)
+
+        with self.assertRaises(FileNotFoundError):
+            MediaBlob.acquire([name], storage)
+        self.assertEqual(MediaBlob.objects.count(), 0)
+
+    def test_discard_keeps_referenced_media_files(self):
+        storage = WebsitePhoto._meta.get_field("image").storage
+        names = [storage.save(f"blobs/ab/{name}.jpg", ContentFile(b"content")) for name in ["shared", "unused"]]
+        MediaBlob.acquire(names[:1], storage)
+
+        MediaBlob.discard(names, storage)
+
+        self.assertEqual([storage.exists(name) for name in names], [True, False])
+        self.assertEqual([(b.name, b.ref_count) for b in MediaBlob.objects.all()], [(names[0], 1)])
+
+    @patch('websites.models.Website._create_rooms')
+    def test_create_failure_keeps_shared_media_files(self, mock_rooms):
+        self._create_website()
+        storage = WebsitePhoto._meta.get_field("image").storage
+        mock_rooms.side_effect = Exception()
+
+        with self.assertRaises(Exception):
+            self._create_website()
+
+        self.assertTrue(all(storage.exists(b.name) for b in MediaBlob.objects.all()))
+        self.assertEqual(set(b.ref_count for b in MediaBlob.objects.all()), {1})
+
+    @override_settings(IMAGE_VARIANT_WIDTHS=[100], IMAGE_VARIANTS_MAX_WORKERS=0)
+    @patch("websites.models.website.download_media_file")
+    def test_image_variants_are_deleted_with_their_image(self, mock_download):
+        def _download(url, filename):
+            output = io.BytesIO()
+            Image.new("RGB", (200, 100), "red" if "photo_1" in url else "blue").save(output, "JPEG")
+            output.seek(0)
+            return output
+        mock_download.side_effect = _download
+        website = self._create_website()
+        storage = WebsitePhoto._meta.get_field("image").storage
+        variants = [v["name"] for p in WebsitePhoto.objects.filter(website=website) for v in p.variants]
+
+        self.assertEqual(len(variants), 2)
+        self.assertTrue(all(storage.exists(name) for name in variants))
+
+        self._delete_website(website)
+        self.assertFalse(any(storage.exists(name) for name in variants))
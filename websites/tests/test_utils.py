@@ -1,8 +1,18 @@
-from unittest.mock import patch
+import hashlib
+import io
+from unittest.mock import MagicMock, patch
 from unittest import TestCase
 import requests
 
-from websites.utils import explode_airbnb_url
+from django.test import override_settings
+
+from websites.utils import (
+    download_media_file,
+    explode_airbnb_url,
+    ingest_concurrently,
+    resolve_airbnb_urls,
+    store_media_file,
+)
 
 
 class UtilsTestCase(TestCase):
@@ -75,3 +85,123 @@ class UtilsTestCase(TestCase):
 
         self.assertEqual(base_url, None)
         self.assertEqual(airbnb_id, None)
+
+    @patch("websites.utils.explode_airbnb_url")
+    def test_resolve_airbnb_urls(self, mock_explode):
+        mock_explode.side_effect = lambda url: {
+            "https://airbnb.fr/rooms/1?a=b": ("https://airbnb.fr/rooms/1", "1"),
+            "https://airbnb.fr/rooms/1": ("https://airbnb.fr/rooms/1", "1"),
+            "https://abnb.me/x": ("https://airbnb.fr/rooms/2", "2"),
+        }.get(url, (None, None))
+
+        listings, invalid_urls = resolve_airbnb_urls([
+            "https://airbnb.fr/rooms/1?a=b", "https://toto.fr", "https://abnb.me/x", "https://airbnb.fr/rooms/1",
+        ])
+
+        self.assertEqual(listings, [("https://airbnb.fr/rooms/1", "1"), ("https://airbnb.fr/rooms/2", "2")])
+        self.assertEqual(invalid_urls, ["https://toto.fr"])
+
+    def test_ingest_concurrently_keeps_order(self):
+        """
+        Results are returned in the same order as the provided items
+        """
+        items = list(range(50))
+
+        results = ingest_concurrently(lambda i: i * 2, items, max_workers=8)
+
+        self.assertEqual(results, [i * 2 for i in items])
+
+    def test_ingest_concurrently_failed_item(self):
+        """
+        An item raising an exception gets a None result without stopping the others
+        """
+        def _func(i):
+            if i == 1:
+                raise ValueError()
+            return i
+
+        results = ingest_concurrently(_func, [0, 1, 2], max_workers=2)
+
+        self.assertEqual(results, [0, None, 2])
+
+    def test_ingest_concurrently_no_item(self):
+        self.assertEqual(ingest_concurrently(lambda i: i, []), [])
+
+    def _mock_media_response(self, mock_get, status_code=200, chunks=None, headers=None):
+        response = MagicMock()
+        response.status_code = status_code
+        response.headers = headers or {}
+        response.iter_content.return_value = chunks or []
+        mock_get.return_value.__enter__.return_value = response
+        return response
+
+    @patch("websites.utils.requests.get")
+    def test_download_media_file(self, mock_get):
+        """
+        The media file content is streamed in a file ready to be read
+        """
+        self._mock_media_response(mock_get, chunks=[b"abc", b"def"])
+
+        media_file = download_media_file("https://media.fr/file.jpg", "file.jpg")
+
+        with media_file:
+            self.assertEqual(media_file.read(), b"abcdef")
+        self.assertEqual(mock_get.call_args.kwargs["stream"], True)
+        mock_get.return_value.__exit__.assert_called_once()
+
+    @patch("websites.utils.requests.get")
+    def test_download_media_file_not_found(self, mock_get):
+        self._mock_media_response(mock_get, status_code=404)
+
+        self.assertEqual(download_media_file("https://media.fr/file.jpg", "file.jpg"), None)
+
+    @override_settings(MEDIA_DOWNLOAD_MAX_SIZE=4)
+    @patch("websites.utils.requests.get")
+    def test_download_media_file_too_large_content_length(self, mock_get):
+        """
+        The download is aborted when the announced size exceeds the limit
+        """
+        response = self._mock_media_response(mock_get, chunks=[b"abcdef"], headers={"content-length": "6"})
+
+        self.assertEqual(download_media_file("https://media.fr/file.jpg", "file.jpg"), None)
+        response.iter_content.assert_not_called()
+
+    @override_settings(MEDIA_DOWNLOAD_MAX_SIZE=4)
+    @patch("websites.utils.requests.get")
+    def test_download_media_file_too_large_content(self, mock_get):
+        """
+        The download is aborted when the received content exceeds the limit
+        """
+        self._mock_media_response(mock_get, chunks=[b"abc", b"def"])
+
+        self.assertEqual(download_media_file("https://media.fr/file.jpg", "file.jpg"), None)
+
+    @patch("websites.utils.requests.get")
+    def test_download_media_file_timeout(self, mock_get):
+        mock_get.side_effect = requests.exceptions.Timeout()
+
+        with patch("websites.utils._logger") as mock_logger:
+            self.assertEqual(download_media_file("https://media.fr/file.jpg", "file.jpg"), None)
+        mock_logger.exception.assert_called_once_with("exception: %s, type: %s", "", "Timeout")
+
+    def test_store_media_file(self):
+        storage = MagicMock()
+        storage.exists.return_value = False
+        digest = hashlib.sha256(b"content").hexdigest()
+
+        name = store_media_file(storage, io.BytesIO(b"content"), ".JPG")
+
+        self.assertEqual(name, storage.save.return_value)
+        storage.save.assert_called_once()
+        self.assertEqual(storage.save.call_args.args[0], f"blobs/{digest[:2]}/{digest}.jpg")
+        self.assertEqual(storage.save.call_args.args[1].read(), b"content")
+
+    def test_store_media_file_already_stored(self):
+        storage = MagicMock()
+        storage.exists.return_value = True
+        digest = hashlib.sha256(b"content").hexdigest()
+
+        name = store_media_file(storage, io.BytesIO(b"content"), ".jpg")
+
+        self.assertEqual(name, f"blobs/{digest[:2]}/{digest}.jpg")
+        storage.save.assert_not_called()
@@ -0,0 +1,193 @@
+import io
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase as DjangoTestCase, override_settings
+from django.urls import reverse
+from django.utils.http import http_date
+from parameterized import parameterized
+
+from websites.models import Website
+from websites.page_cache import get_cached_version
+from websites.views import warm_website_pages
+
+from .common import listing_data, use_temporary_media_root
+
+
+# the pages are only cached by a shared cache (Redis), a local memory cache stands for it in the tests
+PAGES_CACHES = settings.CACHES | {
+    "pages": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "pages"},
+}
+
+
+# the static files are not collected for the tests
+@override_settings(
+    STATICFILES_STORAGE="django.contrib.staticfiles.storage.StaticFilesStorage", CACHES=PAGES_CACHES,
+)
+class WebsitePagesTestCase(DjangoTestCase):
+
+    # queries of every page: session + user, the version of the website (not cached yet), then the website
+    # and its related sets (see `get_page_queryset`)
+    QUERY_BUDGETS = {
+        "website_home": 3 + 5,
+        "website_photos": 3 + 3,
+        "website_details": 3 + 7,
+        "website_contact": 3 + 2,
+    }
+
+    @classmethod
+    def setUpClass(cls):
+        use_temporary_media_root(cls)
+        super().setUpClass()
+
+    def setUp(self):
+        self.user = get_user_model().objects.create(username="user", email="user@eroo.fr")
+        self.client.force_login(self.user)
+        patcher = patch("websites.models.website.download_media_file", side_effect=lambda *_: io.BytesIO(b"content"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @parameterized.expand(QUERY_BUDGETS.items())
+    def test_query_budget(self, page, budget):
+        # the number of queries doesn't depend on the size of the listing
+        for size in [1, 8]:
+            website = Website.create(self.user.id, f"https://airbnb.fr/rooms/{size}", listing_data(size))
+
+            with self.assertNumQueries(budget):
+                response = self.client.get(reverse(page, args=[website.key]))
+
+            self.assertEqual(response.status_code, 200)
+
+    def test_details_page_context(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", listing_data(2))
+
+        response = self.client.get(reverse("website_details", args=[website.key]))
+
+        self.assertEqual(response.context["hostname"], "host")
+        self.assertEqual(
+            [(a["name"], sum(map(len, a["equipments"]))) for a in response.context["equipments_per_area"]],
+            [("area 0", 2), ("area 1", 2)],
+        )
+        self.assertEqual(response.context["rules"], ["rule 0", "rule 1"])
+        self.assertEqual(
+            response.context["rooms"],
+            [{"name": "room 0", "details": "d0 · d1"}, {"name": "room 1", "details": "d1 · d2"}],
+        )
+
+    def test_home_page_context(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", listing_data(3))
+
+        response = self.client.get(reverse("website_home", args=[website.key]))
+
+        self.assertTrue(response.context["main_photo_url"])
+        self.assertIn("main_photo_srcset", response.context)
+        self.assertEqual([r["author_name"] for r in response.context["reviews"]], ["author 0", "author 1", "author 2"])
+        self.assertEqual(response.context["location"], {"title": "my_title", "latitude": 12.34, "longitude": 56.78})
+
+    def test_cached_page(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", listing_data(2))
+        url = reverse("website_home", args=[website.key])
+        content = self.client.get(url).content
+
+        # only the session and the user are loaded
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+
+        self.assertEqual(response.content, content)
+
+    def test_warm_website_pages(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", listing_data(2))
+
+        warm_website_pages(website.key)
+
+        for page in self.QUERY_BUDGETS:
+            with self.assertNumQueries(2):
+                self.assertEqual(self.client.get(reverse(page, args=[website.key])).status_code, 200)
+
+    def test_refresh_invalidates_pages(self):
+        data = listing_data(2)
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", data)
+        warm_website_pages(website.key)
+
+        data["name"] = "a new name"
+        with self.captureOnCommitCallbacks(execute=True):
+            website.refresh(data)
+
+        response = self.client.get(reverse("website_home", args=[website.key]))
+        self.assertEqual(response.context["name"], "a new name")
+
+    def test_hidden_website_pages(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", listing_data(2))
+        warm_website_pages(website.key)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Website.hide(Website.objects.filter(id=website.id))
+
+        self.assertEqual(self.client.get(reverse("website_home", args=[website.key])).status_code, 404)
+
+    def test_cache_headers(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", listing_data(2))
+
+        response = self.client.get(reverse("website_photos", args=[website.key]))
+
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertEqual(response["Last-Modified"], http_date(website.generated_date.timestamp()))
+        self.assertEqual(response["Cache-Control"], "no-cache")
+        self.assertEqual(response["Surrogate-Key"], f"website-{website.key} website-{website.key}-photos")
+
+    def test_conditional_get(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", listing_data(2))
+        url = reverse("website_home", args=[website.key])
+        response = self.client.get(url)
+
+        # only the session and the user are loaded
+        with self.assertNumQueries(2):
+            not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified["ETag"], response["ETag"])
+
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response["Last-Modified"])
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_conditional_get_changed_website(self):
+        data = listing_data(2)
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", data)
+        url = reverse("website_home", args=[website.key])
+        etag = self.client.get(url)["ETag"]
+
+        data["name"] = "a new name"
+        with self.captureOnCommitCallbacks(execute=True):
+            website.refresh(data)
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_conditional_get_other_process(self):
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", listing_data(2))
+        url = reverse("website_home", args=[website.key])
+        etag = self.client.get(url)["ETag"]
+
+        # the validators of a process without the cached version are the same
+        caches["pages"].clear()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_ingest_media_changes_etag(self):
+        data = listing_data(2)
+        website = Website.create(self.user.id, "https://airbnb.fr/rooms/1", data, defer_media=True)
+        url = reverse("website_photos", args=[website.key])
+        etag = self.client.get(url)["ETag"]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            website.ingest_media(data["photos"], [])
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context["photos"]), 2)
+
+    def test_unknown_website(self):
+        self.assertEqual(self.client.get(reverse("website_home", args=["unknown"])).status_code, 404)
+        # nothing is cached for unknown websites
+        self.assertIsNone(get_cached_version("unknown"))
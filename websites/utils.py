@@ -1,16 +1,27 @@
+import hashlib
 import logging
 import json
 import re
 import requests
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from tempfile import SpooledTemporaryFile
 
+from django.conf import settings
 from django.core.files import File
+from django.db import connection
 from django.core.files.temp import NamedTemporaryFile
 
 from .storage_backends import private_storage
 
 _logger = logging.getLogger("utils")
 
+MEDIA_DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# media files bigger than this size are written on the disk instead of being kept in memory
+MEDIA_SPOOL_MAX_SIZE = 1024 * 1024
+
 
 def is_ajax(request):
     return request.headers.get("x-requested-with") == "XMLHttpRequest"
@@ -64,6 +75,21 @@ def explode_airbnb_url(url):
     return base_url, airbnb_id
 
 
+def resolve_airbnb_urls(urls):
+    """
+    resolve the airbnb `urls` (shortcut urls may need a request) at the same time.
+    Returns the list of distinct (base url, airbnb id) listings and the list of invalid urls.
+    """
+    listings = {}
+    invalid_urls = []
+    for url, (base_url, airbnb_id) in zip(urls, ingest_concurrently(explode_airbnb_url, urls)):
+        if base_url and airbnb_id:
+            listings.setdefault(airbnb_id, (base_url, airbnb_id))
+        else:
+            invalid_urls.append(url)
+    return list(listings.values()), invalid_urls
+
+
 def get_filename_from_url(url):
     """
     extract the filename from an url
@@ -79,23 +105,159 @@ def get_extension_from_url(url):
     return Path(filename).suffix
 
 
+def _stream_media_content(response, media_file, max_size):
+    """
+    copy the content of `response`, chunk by chunk, in `media_file`.
+    Returns False if the content exceeds `max_size` bytes.
+    """
+    if int(response.headers.get("content-length") or 0) > max_size:
+        return False
+
+    size = 0
+    for chunk in response.iter_content(chunk_size=MEDIA_DOWNLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > max_size:
+            return False
+        media_file.write(chunk)
+    return True
+
+
 def download_media_file(url, filename):
     """
     download a media file from `url`.
+    The content is streamed in a spooled temporary file (kept in memory while it's small,
+    written on the disk otherwise) and the download is aborted if the file is bigger
+    than `MEDIA_DOWNLOAD_MAX_SIZE`.
+    The caller is responsible for closing the returned file.
+    """
+    media_file = SpooledTemporaryFile(max_size=MEDIA_SPOOL_MAX_SIZE)
+    try:
+        with requests.get(url, stream=True, timeout=settings.MEDIA_DOWNLOAD_TIMEOUT) as response:
+            if response.status_code != 200:
+                _logger.warning("Unable to download the media file at '%s'", url)
+            elif not _stream_media_content(response, media_file, settings.MEDIA_DOWNLOAD_MAX_SIZE):
+                _logger.warning("Media file at '%s' is too large", url)
+            else:
+                media_file.seek(0)
+                return media_file
+    except Exception as e:
+        _logger.exception("exception: %s, type: %s", str(e), type(e).__name__)
+
+    media_file.close()
+    return None
+
+
+def get_media_blob_path(digest, extension):
+    """ content-addressed path of a media file, shared by all the websites """
+    return f"blobs/{digest[:2]}/{digest}{extension.lower()}"
+
+
+def store_media_file(storage, media_file, extension):
+    """
+    store `media_file` in the `storage` under a name derived from the hash of its content,
+    unless a file with the same content is already stored.
+    Returns the name of the stored file (see `MediaBlob` for the reference counting: an existing file
+    may be deleted until it's referenced, which is checked by `MediaBlob.acquire`).
+    Doesn't access the database, so it can be called from the ingestion threads.
+    """
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: media_file.read(MEDIA_DOWNLOAD_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    media_file.seek(0)
+
+    name = get_media_blob_path(digest.hexdigest(), extension)
+    if storage.exists(name):
+        return name
+    return storage.save(name, File(media_file))
+
+
+# maximum number of objects removed by a single S3 multi-object delete request
+STORAGE_DELETE_BATCH_SIZE = 1000
+
+
+def delete_storage_files(storage, names):
     """
+    delete the files `names` from the `storage`.
+    On S3, files are removed with multi-object delete requests instead of one request per file.
+    """
+    names = [name for name in dict.fromkeys(names) if name]
+    if hasattr(storage, "bucket"):
+        keys = [storage._normalize_name(name) for name in names]
+        for i in range(0, len(keys), STORAGE_DELETE_BATCH_SIZE):
+            try:
+                storage.bucket.delete_objects(Delete={
+                    "Objects": [{"Key": key} for key in keys[i:i + STORAGE_DELETE_BATCH_SIZE]],
+                    "Quiet": True,
+                })
+            except Exception as e:
+                _logger.exception("exception: %s, type: %s", str(e), type(e).__name__)
+        return
+
+    for name in names:
+        try:
+            storage.delete(name)
+        except Exception as e:
+            _logger.exception("exception: %s, type: %s", str(e), type(e).__name__)
+
+
+def delete_storage_prefix(storage, prefix):
+    """ delete all the files whose name starts with the directory `prefix` from the `storage` """
     try:
-        response = requests.get(url)
-        if response.status_code != 200:
-            _logger.warning("Unable to download the media file at '%s'", url)
+        if hasattr(storage, "bucket"):
+            # batched in multi-object delete requests by boto3
+            storage.bucket.objects.filter(Prefix=storage._normalize_name(prefix)).delete()
+        else:
+            shutil.rmtree(storage.path(prefix), ignore_errors=True)
+    except Exception as e:
+        _logger.exception("exception: %s, type: %s", str(e), type(e).__name__)
+
+
+def ingest_concurrently(func, items, max_workers=None):
+    """
+    call `func` on every item of `items` using a bounded pool of threads and
+    return the results in the same order as `items`.
+    If `func` raises an exception for an item, the result of this item is None.
+
+    `func` is run outside of the calling thread, so it must not access the database.
+    """
+    def _safe_call(item):
+        try:
+            return func(item)
+        except Exception as e:
+            _logger.exception("exception: %s, type: %s", str(e), type(e).__name__)
             return None
-    except Exception:
-        return None
 
-    media_file = NamedTemporaryFile(delete=True)
-    media_file.write(response.content)
-    media_file.flush()
+    if not items:
+        return []
+
+    max_workers = min(max_workers or settings.MEDIA_INGEST_MAX_WORKERS, len(items))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(_safe_call, items))
+
+
+class QueryCounter:
+    """ database execute wrapper counting the executed SQL queries """
 
-    return media_file
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+@contextmanager
+def count_queries():
+    """
+    count the SQL queries executed on the default database inside the `with` block.
+
+    with count_queries() as queries:
+        ...
+    _logger.info("queries: %s", queries.count)
+    """
+    counter = QueryCounter()
+    with connection.execute_wrapper(counter):
+        yield counter
 
 
 def save_debug_data(filename, data):
@@ -1,19 +1,14 @@
-
 from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import Http404, HttpRequest, HttpResponse
+from django.shortcuts import redirect
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
 from django.views.generic import DetailView
 
-from .models import (
-    Website,
-    WebsiteHost,
-    WebsitePhoto,
-    Review,
-    Highlight,
-    EquipmentArea,
-    RoomDetail,
-    Room,
-    Rule,
-)
+from .loaders import CONTACT_PAGE, DETAILS_PAGE, HOME_PAGE, PAGE_FILENAMES, PHOTOS_PAGE, get_page_queryset
+from .models import MEDIA_STATUS_PENDING, Website, WebsitePhoto
+from .page_cache import cache_page, cache_version, get_cached_page, get_cached_version, get_page_etag
 from .utils import partition_list
 
 EQUIPMENT_COLUMN_COUNT = 4
@@ -23,26 +18,75 @@ def _build_context(website):
     return {
         "key": website.key,
         "name": website.name,
-        "hostname": WebsiteHost.objects.filter(website=website).first().name,
+        "hostname": website.hosts[0].name,
+        "media_pending": website.media_status == MEDIA_STATUS_PENDING,
     }
 
 
-class WebsiteHomePage(LoginRequiredMixin, DetailView):
-    template_name = "websites/template1/pages/home.html"
+class WebsitePage(LoginRequiredMixin, DetailView):
+    """
+    page of a website, loaded with its related data by `get_page_queryset`.
+    The rendered page is cached until the website changes (see `websites.page_cache`).
+    """
     model = Website
     slug_field = "key"
     slug_url_kwarg = "key"
+    page = None
+
+    def get_queryset(self):
+        return get_page_queryset(self.page)
+
+    def get(self, request, *args, **kwargs):
+        if settings.WEBSITES_SERVE_EXPORTS:
+            export_url = get_export_url(self.kwargs["key"], self.page)
+            if export_url:
+                return redirect(export_url)
+
+        # the validators of the page come from the version of the website, usually cached:
+        # unchanged pages are answered with a 304 before loading the website
+        version = get_website_version(self.kwargs["key"])
+        etag = get_page_etag(version)
+
+        response = get_conditional_response(request, etag=etag, last_modified=version["last_modified"])
+        if response is None:
+            content = get_cached_page(self.kwargs["key"], self.page, version)
+            response = HttpResponse(content) if content is not None else self.render_page(version)
+        return self._add_cache_headers(response, etag, version["last_modified"])
+
+    def render_page(self, version):
+        """ render the page of the website, cached under its `version` """
+        self.object = self.get_object()
+        response = self.render_to_response(self.get_context_data(object=self.object)).render()
+        cache_page(self.kwargs["key"], self.page, version, response.content)
+        return response
+
+    def _add_cache_headers(self, response, etag, last_modified):
+        response.headers["ETag"] = etag
+        response.headers["Last-Modified"] = http_date(last_modified)
+        # browsers revalidate the page on every visit (cheap with the validators), a CDN keeps it
+        # until it's purged by its surrogate keys: the website, or one of its pages
+        patch_cache_control(response, no_cache=True)
+        response.headers["Surrogate-Control"] = f"max-age={settings.WEBSITES_PAGES_CDN_MAX_AGE}"
+        response.headers["Surrogate-Key"] = f"website-{self.kwargs['key']} website-{self.kwargs['key']}-{self.page}"
+        return response
+
+
+class WebsiteHomePage(WebsitePage):
+    template_name = "websites/template1/pages/home.html"
+    page = HOME_PAGE
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
         if self.object:
             website = self.object
+            main_photo = website.photos[0] if website.photos else None
             context |= _build_context(website)
             context |= {
                 "GOOGLE_MAP_API_KEY": settings.GOOGLE_MAP_API_KEY,
                 "description": website.description,
-                "main_photo_url": WebsitePhoto.objects.filter(website=website).first().url(),
+                "main_photo_url": main_photo.url() if main_photo else None,
+                "main_photo_srcset": main_photo.srcset() if main_photo else "",
                 "general_info": {
                     "bathroom_count": website.bathroom_count,
                     "bed_count": website.bed_count,
@@ -58,28 +102,27 @@ class WebsiteHomePage(LoginRequiredMixin, DetailView):
                     {
                         "author_name": t.author_name,
                         "picture_url": t.picture_url(),
+                        "picture_srcset": t.srcset(),
                         "review": t.review,
                         "date": t.date,
                         "language": t.language,
                     }
-                    for t in Review.objects.filter(website=website)
+                    for t in website.reviews
                 ],
                 "highlights": [
                     {
                         "title": h.title,
                         "message": h.message,
                     }
-                    for h in Highlight.objects.filter(website=website)
+                    for h in website.highlights
                 ],
             }
         return context
 
 
-class WebsitePhotosPage(LoginRequiredMixin, DetailView):
+class WebsitePhotosPage(WebsitePage):
     template_name = "websites/template1/pages/photos.html"
-    model = Website
-    slug_field = "key"
-    slug_url_kwarg = "key"
+    page = PHOTOS_PAGE
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -89,18 +132,16 @@ class WebsitePhotosPage(LoginRequiredMixin, DetailView):
             context |= _build_context(website)
             context |= {
                 "photos": [
-                    {"url": photo.url(), "caption": photo.caption}
-                    for photo in WebsitePhoto.objects.filter(website=website)
+                    {"url": photo.url(), "srcset": photo.srcset(), "caption": photo.caption}
+                    for photo in website.photos
                 ],
             }
         return context
 
 
-class WebsiteDetailsPage(LoginRequiredMixin, DetailView):
+class WebsiteDetailsPage(WebsitePage):
     template_name = "websites/template1/pages/details.html"
-    model = Website
-    slug_field = "key"
-    slug_url_kwarg = "key"
+    page = DETAILS_PAGE
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -123,41 +164,82 @@ class WebsiteDetailsPage(LoginRequiredMixin, DetailView):
                             EQUIPMENT_COLUMN_COUNT,
                         ),
                     }
-                    for a in EquipmentArea.objects.filter(website=website)
+                    for a in website.equipment_areas
                 ],
-                "rules": [r.name for r in Rule.objects.filter(website=website)],
+                "rules": [r.name for r in website.rules],
                 "rooms": [
                     {
                         "name": r.name,
-                        "details": " · ".join(
-                            [d.detail for d in RoomDetail.objects.filter(room=r)]
-                        ),
+                        "details": " · ".join([d.detail for d in r.details]),
                     }
-                    for r in Room.objects.filter(website=website)
+                    for r in website.rooms
                 ],
             }
         return context
 
 
-class WebsiteContactPage(LoginRequiredMixin, DetailView):
+class WebsiteContactPage(WebsitePage):
     template_name = "websites/template1/pages/contact.html"
-    model = Website
-    slug_field = "key"
-    slug_url_kwarg = "key"
+    page = CONTACT_PAGE
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
         if self.object:
             website = self.object
-            host = WebsiteHost.objects.filter(website=website).first()
+            host = website.hosts[0]
             context |= _build_context(website)
             context |= {
                 "host": {
                     "name": host.name,
                     "picture_url": host.picture_url(),
+                    "picture_srcset": host.srcset(),
                     "description": host.description,
                     "languages": host.languages.replace(",", " · "),
                 }
             }
         return context
+
+
+PAGE_VIEWS = [WebsiteHomePage, WebsitePhotosPage, WebsiteDetailsPage, WebsiteContactPage]
+
+
+def get_website_version(key):
+    """
+    version of the pages of the website `key` (see `websites.page_cache`): from the cache, or else loaded
+    from the database and cached. Raises Http404 for unknown or deleted websites, which are not cached.
+    """
+    version = get_cached_version(key)
+    if version is None:
+        version = Website.get_page_versions([key]).get(key)
+        if version is None:
+            raise Http404("unknown website")
+        cache_version(key, version)
+    if version["version"] is None:
+        raise Http404("deleted website")
+    return version
+
+
+def render_website_page(key, view_class):
+    """ get the rendered page (`view_class`) of the website `key` from the cache, or render and cache it """
+    request = HttpRequest()
+    request.method = "GET"
+    view = view_class()
+    view.setup(request, key=key)
+    version = get_website_version(key)
+    content = get_cached_page(key, view.page, version)
+    return content if content is not None else view.render_page(version).content
+
+
+def warm_website_pages(key):
+    """ render and cache all the pages of the website `key`, so that its first visitors get cached pages """
+    for view_class in PAGE_VIEWS:
+        render_website_page(key, view_class)
+
+
+def get_export_url(key, page):
+    """ url of the `page` in the static export of the website `key`, None if the website is not exported """
+    export_path = Website.objects.filter(key=key).values_list("export_path", flat=True).first()
+    if not export_path:
+        return None
+    return WebsitePhoto._meta.get_field("image").storage.url(export_path + PAGE_FILENAMES[page])